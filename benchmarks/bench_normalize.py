@@ -0,0 +1,144 @@
+#########################
+#   gs2_correlation     #
+#   Ferdinand van Wyk   #
+#########################
+
+###############################################################################
+# This file is part of gs2_correlation.
+#
+# gs2_correlation_analysis is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# gs2_correlation is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with gs2_correlation.
+# If not, see <http://www.gnu.org/licenses/>.
+###############################################################################
+
+"""
+Benchmark of the vectorized ``Simulation.field_normalize_perp`` and
+``Simulation.field_normalize_time`` against the original loops over single
+rows of the field, on a synthetic field and on the test run.
+
+Run from the package root directory:
+
+    $ python benchmarks/bench_normalize.py
+"""
+
+# Standard
+import os
+import time
+import configparser
+import warnings
+
+# Third Party
+import numpy as np
+
+# Local
+from gs2_correlation.simulation import Simulation
+
+
+def loop_normalize_perp(field):
+    """
+    Original implementation of field_normalize_perp.
+    """
+    nt, nx, ny = field.shape
+    norm_x = np.empty([nt, nx, ny], dtype=float)
+    norm_y = np.empty([nt, nx, ny], dtype=float)
+    for it in range(nt):
+        for iy in range(ny):
+            norm_x[it,:,iy] = field[it,:,iy] - np.mean(field[it,:,iy])
+            norm_x[it,:,iy] /= np.std(norm_x[it,:,iy])
+        for ix in range(nx):
+            norm_y[it,ix,:] = field[it,ix,:] - np.mean(field[it,ix,:])
+            norm_y[it,ix,:] /= np.std(norm_y[it,ix,:])
+    return norm_x, norm_y
+
+
+def loop_normalize_time(field, time_slice):
+    """
+    Original implementation of field_normalize_time.
+    """
+    nt, nx, ny = field.shape
+    norm = np.empty([nt, nx, ny], dtype=float)
+    for it in range(int(nt/time_slice)):
+        t_min = it*time_slice
+        t_max = (it+1)*time_slice
+        for ix in range(nx):
+            norm[t_min:t_max,ix,:] = field[t_min:t_max,ix,:] - \
+                                     np.mean(field[t_min:t_max,ix,:])
+            norm[t_min:t_max,ix,:] /= np.std(norm[t_min:t_max,ix,:])
+    return norm
+
+
+def bare_run(field, time_slice):
+    """
+    Simulation object holding only what the normalization functions need.
+    """
+    run = Simulation.__new__(Simulation)
+    run.field_real_space = field
+    run.nt, run.nx, run.ny = field.shape
+    run.time_slice = time_slice
+    run.nt_slices = int(run.nt/time_slice)
+    run.real_dtype = np.float64
+    return run
+
+
+def compare(run):
+    """
+    Time the loop and vectorized normalizations on *run* and return the
+    timings and the maximum difference.
+    """
+    field = run.field_real_space
+    nt_windows = run.nt_slices*run.time_slice
+
+    start = time.perf_counter()
+    ref_x, ref_y = loop_normalize_perp(field)
+    ref_t = loop_normalize_time(field, run.time_slice)
+    t_loop = time.perf_counter() - start
+
+    start = time.perf_counter()
+    run.field_normalize_perp()
+    run.field_normalize_time()
+    t_vec = time.perf_counter() - start
+
+    diff = max(np.nanmax(np.abs(run.field_real_space_norm_x - ref_x)),
+               np.nanmax(np.abs(run.field_real_space_norm_y - ref_y)),
+               np.nanmax(np.abs(run.field_real_space_norm[:nt_windows] -
+                                ref_t[:nt_windows])))
+    return t_loop, t_vec, diff
+
+
+if __name__ == '__main__':
+    rng = np.random.RandomState(0)
+
+    print('{:>22} {:>10} {:>10} {:>10} {:>12}'.format(
+          '[nt, nx, ny]', 'loop (s)', 'vec (s)', 'speedup', 'max |diff|'))
+
+    for shape in [(100, 50, 50), (500, 100, 100)]:
+        run = bare_run(rng.normal(size=shape), 49)
+        t_loop, t_vec, diff = compare(run)
+        print('{:>22} {:10.3f} {:10.3f} {:10.1f} {:12.2e}'.format(
+              str(list(shape)), t_loop, t_vec, t_loop/t_vec, diff))
+
+    # Test run, without zeroing the BES scales so the field is not zero
+    os.system('tar -zxf test/test_run.tar.gz -C test/.')
+    config = configparser.ConfigParser()
+    config.read('test/test_config.ini')
+    config['general']['zero_bes_scales'] = 'False'
+    with open('test/test_run/bench_config.ini', 'w') as configfile:
+        config.write(configfile)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        run = Simulation('test/test_run/bench_config.ini')
+    os.system('rm -rf test/test_run')
+
+    t_loop, t_vec, diff = compare(run)
+    print('{:>22} {:10.3f} {:10.3f} {:10.1f} {:12.2e}'.format(
+          'test_run', t_loop, t_vec, t_loop/t_vec, diff))
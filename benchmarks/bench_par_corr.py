@@ -0,0 +1,108 @@
+#########################
+#   gs2_correlation     #
+#   Ferdinand van Wyk   #
+#########################
+
+###############################################################################
+# This file is part of gs2_correlation.
+#
+# gs2_correlation_analysis is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# gs2_correlation is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with gs2_correlation.
+# If not, see <http://www.gnu.org/licenses/>.
+###############################################################################
+
+"""
+Benchmark of ``Simulation.calculate_par_corr``, which interpolates with a
+sparse matrix and correlates with one batched FFT, against the original loop
+over single parallel signals, on synthetic fields with an irregular parallel
+grid.
+
+Run from the package root directory:
+
+    $ python benchmarks/bench_par_corr.py
+"""
+
+# Standard
+import time
+
+# Third Party
+import numpy as np
+import scipy.interpolate as interp
+import scipy.signal as sig
+
+# Local
+from gs2_correlation.simulation import Simulation
+
+
+def loop_par_corr(field, l_par):
+    """
+    Original implementation of calculate_par_corr.
+    """
+    nt, nx, ny, ntheta = field.shape
+    field = field.copy()
+    x = np.ones([ntheta])
+    mask = sig.correlate(x, x, 'same')
+
+    par_corr = np.empty([nt, nx, ny, ntheta], dtype=float)
+    l_par_reg = np.linspace(0, l_par[-1], ntheta)
+    for it in range(nt):
+        for ix in range(nx):
+            for iy in range(ny):
+                f = interp.interp1d(l_par, field[it,ix,iy,:])
+                field[it,ix,iy,:] = f(l_par_reg)
+                field[it,ix,iy,:] = field[it,ix,iy,:] - \
+                                    np.mean(field[it,ix,iy,:])
+                field[it,ix,iy,:] = field[it,ix,iy,:] / \
+                                    np.std(field[it,ix,iy,:])
+                par_corr[it,ix,iy,:] = sig.correlate(field[it,ix,iy,:],
+                                                     field[it,ix,iy,:],
+                                                     'same')/mask
+    return par_corr
+
+
+def bare_run(field, l_par):
+    """
+    Simulation object holding only what calculate_par_corr needs.
+    """
+    run = Simulation.__new__(Simulation)
+    run.field_real_space = field.copy()
+    run.nt, run.nx, run.ny, run.ntheta = field.shape
+    run.l_par = l_par
+    run.real_dtype = np.float64
+    return run
+
+
+if __name__ == '__main__':
+    rng = np.random.RandomState(0)
+
+    print('{:>22} {:>10} {:>10} {:>10} {:>12}'.format(
+          '[nt, nx, ny, ntheta]', 'loop (s)', 'vec (s)', 'speedup',
+          'max |diff|'))
+
+    for shape in [(20, 32, 32, 33), (50, 64, 64, 33)]:
+        field = rng.normal(size=shape)
+        theta = np.linspace(-np.pi, np.pi, shape[3])
+        l_par = np.cumsum(np.append(0, 1 + 0.5*np.cos(theta[1:])))
+
+        start = time.perf_counter()
+        ref = loop_par_corr(field, l_par)
+        t_loop = time.perf_counter() - start
+
+        run = bare_run(field, l_par)
+        start = time.perf_counter()
+        run.calculate_par_corr()
+        t_vec = time.perf_counter() - start
+
+        diff = np.max(np.abs(run.par_corr - ref))
+        print('{:>22} {:10.3f} {:10.3f} {:10.1f} {:12.2e}'.format(
+              str(list(shape)), t_loop, t_vec, t_loop/t_vec, diff))
@@ -0,0 +1,426 @@
+#########################
+#   gs2_correlation     #
+#   Ferdinand van Wyk   #
+#########################
+
+###############################################################################
+# This file is part of gs2_correlation.
+#
+# gs2_correlation_analysis is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# gs2_correlation is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with gs2_correlation.
+# If not, see <http://www.gnu.org/licenses/>.
+###############################################################################
+
+"""
+Scaling benchmark of the stages of ``Simulation`` with nt, nkx, nky and
+ntheta, on synthetic GS2 runs written by ``gs2_correlation.synthetic``.
+
+Starting from a base problem size, each dimension is scaled by powers of two
+up to the largest factor of the grid ('quick': 2, 'full': 8). For every
+size, the 'all' and 'par' analyses are run with profiling enabled, each in a
+new process so that the peak RSS of one does not include the other.
+
+The memory allocated by every stage is reproducible for given Python and
+NumPy versions, so it is compared with the baseline of the grid stored in
+benchmarks/baselines, which only holds the allocations and the versions they
+were recorded with. The comparison is skipped if the versions differ. Wall
+times depend on the machine and its load, so they are only compared with the
+results of an earlier run on the same machine given by --time_baseline.
+Regressions are listed and the exit code is 1 if there are any.
+
+The per time slice plots are replaced by no-ops unless --plots is given,
+since they dominate the run time and do not depend on the problem size.
+
+Run from the package root directory:
+
+    $ python benchmarks/bench_scaling.py --grid quick --output before.json
+    $ python benchmarks/bench_scaling.py --grid quick --repeat 3 \
+          --time_baseline before.json
+    $ python benchmarks/bench_scaling.py --grid quick --update
+"""
+
+# Standard
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import traceback
+import warnings
+import multiprocessing
+
+# Third Party
+import numpy as np
+
+# Local
+import gs2_correlation.synthetic as synthetic
+from gs2_correlation.simulation import Simulation
+
+BASE_SIZE = {'nt': 100, 'nkx': 33, 'nky': 17, 'ntheta': 17}
+GRIDS = {'quick': 2, 'full': 8}
+ANALYSES = ['all', 'par']
+PLOT_METHODS = ['perp_plots_x', 'perp_plots_y', 'time_plot', 'par_plot']
+# Reproducible quantities of each stage stored in the baseline
+BASELINE_KEYS = ['calls', 'alloc_peak_mb', 'alloc_net_mb']
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'baselines')
+
+
+def grid_sizes(max_factor):
+    """
+    Returns the problem sizes of a grid: the base size and every dimension
+    scaled on its own by the powers of two up to *max_factor*. The number
+    of grid points (nkx, 2*(nky - 1), ntheta - 1) is scaled, keeping nkx and
+    ntheta odd as in GS2.
+    """
+    sizes = [dict(BASE_SIZE)]
+    for dim in ['nt', 'nkx', 'nky', 'ntheta']:
+        factor = 2
+        while factor <= max_factor:
+            size = dict(BASE_SIZE)
+            if dim == 'nt':
+                size[dim] = BASE_SIZE[dim]*factor
+            else:
+                size[dim] = (BASE_SIZE[dim] - 1)*factor + 1
+            sizes.append(size)
+            factor *= 2
+
+    return sizes
+
+
+def case_name(size):
+    """
+    Name of the problem *size*, e.g. 'nt100_nkx33_nky17_ntheta17'.
+    """
+    return '_'.join(dim + str(size[dim]) for dim in ['nt', 'nkx', 'nky',
+                                                     'ntheta'])
+
+
+def write_case(run_folder, size):
+    """
+    Writes the synthetic run of *size* and returns the time taken.
+    """
+    start = time.perf_counter()
+    synthetic.write_run(run_folder, jtwist=10, l_par=2.0, **size)
+    return time.perf_counter() - start
+
+
+def profile_case(run_folder, analysis, plots):
+    """
+    Runs *analysis* on the synthetic run in *run_folder* with profiling
+    enabled and returns the profile report without the configuration file,
+    or the traceback if the analysis failed.
+    """
+    with open(os.path.join(run_folder, 'synthetic.json'), 'r') as fp:
+        info = json.load(fp)
+    config_file = os.path.join(run_folder, analysis + '.ini')
+    synthetic.write_config(config_file, run_folder, info, analysis, options={
+        'general': {'out_dir': os.path.join(run_folder, analysis),
+                    'profile': True}})
+
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            run = Simulation(config_file)
+            if not plots:
+                for method in PLOT_METHODS:
+                    setattr(run, method, lambda *args, **kwargs: None)
+            run.run_analysis()
+    except Exception:
+        return {'error': traceback.format_exc()}
+
+    with open(os.path.join(run_folder, analysis, 'profile.json'), 'r') as fp:
+        report = json.load(fp)
+    # The run folder is a temporary directory
+    del report['info']['config_file']
+
+    return report
+
+
+def run_grid(sizes, plots, work_dir, repeat=1):
+    """
+    Profiles every analysis of every problem size, each in a new process.
+    Each analysis is run *repeat* times and the run with the shortest wall
+    time is kept, to reduce the noise from other processes.
+
+    Returns
+    -------
+    cases : dict
+        Profile report of each analysis of each case, with the time taken to
+        write the synthetic run.
+    """
+    ctx = multiprocessing.get_context('spawn')
+    cases = {}
+    for size in sizes:
+        name = case_name(size)
+        run_folder = os.path.join(work_dir, name)
+        cases[name] = {'size': size}
+        with ctx.Pool(1) as pool:
+            cases[name]['write'] = pool.apply(write_case, (run_folder, size))
+        for analysis in ANALYSES:
+            reports = []
+            for i in range(repeat):
+                with ctx.Pool(1) as pool:
+                    reports.append(pool.apply(profile_case, (run_folder,
+                                                             analysis, plots)))
+            cases[name][analysis] = min(
+                    reports, key=lambda r: r['total']['wall']
+                    if 'error' not in r else np.inf)
+        shutil.rmtree(run_folder)
+        print_case(name, cases[name])
+
+    return cases
+
+
+def print_case(name, case):
+    """
+    Prints the totals of each analysis of a case.
+    """
+    for analysis in ANALYSES:
+        report = case[analysis]
+        if 'error' in report:
+            print('{:>30} {:>5} failed:\n{}'.format(name, analysis,
+                                                  report['error']))
+            continue
+        total = report['total']
+        alloc = total['alloc_peak_mb']
+        print('{:>30} {:>5} {:10.3f} {:10.3f} {:12.1f} {:>12}'.format(
+              name, analysis, total['wall'], total['cpu'],
+              total['peak_rss_mb'],
+              '-' if alloc is None else '{:.1f}'.format(alloc)))
+
+
+def scaling_exponents(cases, min_time, min_mem):
+    """
+    Fits the exponent p of wall time ~ n^p and allocated memory ~ n^p of
+    every top level stage along each scaled dimension, where n is the number
+    of grid points in that dimension. Stages taking less than *min_time*
+    seconds or allocating less than *min_mem* MB in every case are left out,
+    since their exponents are dominated by noise.
+    """
+    base = case_name(BASE_SIZE)
+    exponents = {}
+    for dim in ['nt', 'nkx', 'nky', 'ntheta']:
+        names = [base] + [name for name, case in cases.items()
+                          if case['size'][dim] != BASE_SIZE[dim]]
+        if len(names) < 2:
+            continue
+        n = np.log([cases[name]['size'][dim] - (dim != 'nt')
+                    for name in names])
+        for analysis in ANALYSES:
+            if any('error' in cases[name][analysis] for name in names):
+                continue
+            stages = cases[base][analysis]['stages']
+            for stage in [s for s in stages if '/' not in s]:
+                for key, min_value in [('wall', min_time),
+                                       ('alloc_peak_mb', min_mem)]:
+                    values = [cases[name][analysis]['stages'].get(stage, {})
+                              .get(key) or 0 for name in names]
+                    if min(values) <= 0 or max(values) < min_value:
+                        continue
+                    slope = np.polyfit(n, np.log(values), 1)[0]
+                    exponents.setdefault(dim, {}).setdefault(
+                            analysis + ':' + stage, {})[key] = slope
+
+    return exponents
+
+
+def baseline_cases(cases):
+    """
+    Returns the reproducible part of *cases* stored in the baseline: the
+    *BASELINE_KEYS* of every stage, rounded to kB, and whether each analysis
+    failed. The allocations are None if NumPy arrays are not traced, see
+    ``profiling.arrays_traced``.
+    """
+    baseline = {}
+    for name, case in cases.items():
+        baseline[name] = {'size': case['size']}
+        for analysis in ANALYSES:
+            report = case[analysis]
+            if 'error' in report:
+                baseline[name][analysis] = {'error': True}
+                continue
+            baseline[name][analysis] = {'stages': {
+                    stage: {key: None if record[key] is None
+                            else round(record[key], 3)
+                            for key in BASELINE_KEYS}
+                    for stage, record in report['stages'].items()}}
+
+    return baseline
+
+
+def compare(cases, baseline, checks):
+    """
+    Compares the stages of every case with the baseline.
+
+    For each (key, tol, min_diff) of *checks*, e.g. ('alloc_peak_mb', 0.1,
+    1), a stage regresses if its value of key grows by more than the
+    fraction tol and by more than min_diff. An analysis regresses if it
+    fails but did not fail in the baseline. Values which are not available
+    in either are not compared.
+
+    Returns
+    -------
+    regressions : list
+        Description of each regression.
+    """
+    regressions = []
+    for name, case in cases.items():
+        if name not in baseline:
+            continue
+        for analysis in ANALYSES:
+            report = case[analysis]
+            base_report = baseline[name][analysis]
+            if 'error' in report:
+                if 'error' not in base_report:
+                    regressions.append(name + ' ' + analysis + ' failed')
+                continue
+            if 'error' in base_report:
+                continue
+
+            for stage, record in report['stages'].items():
+                base_record = base_report['stages'].get(stage)
+                if base_record is None:
+                    continue
+                for key, tol, min_diff in checks:
+                    if record[key] is None or base_record[key] is None:
+                        continue
+                    diff = record[key] - base_record[key]
+                    if diff > tol*base_record[key] and diff > min_diff:
+                        regressions.append(
+                                '{} {} {} {}: {:.4g} -> {:.4g}'.format(
+                                name, analysis, stage, key,
+                                base_record[key], record[key]))
+
+    return regressions
+
+
+def machine():
+    """
+    Description of the machine the benchmark runs on.
+    """
+    return {'node': platform.node(), 'machine': platform.machine(),
+            'processor': platform.processor(), 'cpu_count': os.cpu_count(),
+            'python': platform.python_version(), 'numpy': np.__version__}
+
+
+def versions():
+    """
+    Versions which the allocated memory depends on.
+    """
+    return {'python': platform.python_version(), 'numpy': np.__version__}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Scaling benchmark of the '
+                                     'Simulation stages')
+    parser.add_argument('--grid', type=str, default='quick',
+                        choices=sorted(GRIDS), help='Grid of problem sizes')
+    parser.add_argument('--plots', action='store_true',
+                        help='Include the per time slice plots')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='Number of runs of each case, keeping the '
+                        'fastest')
+    parser.add_argument('--update', action='store_true',
+                        help='Store the allocated memory as the baseline of '
+                        'the grid')
+    parser.add_argument('--time_baseline', type=str, default=None,
+                        help='Results of an earlier run on this machine to '
+                        'compare the wall times with')
+    parser.add_argument('--output', type=str, default='bench_scaling.json',
+                        help='JSON file the results are written to')
+    parser.add_argument('--time_tol', type=float, default=1.0,
+                        help='Relative wall time increase flagged')
+    parser.add_argument('--mem_tol', type=float, default=0.1,
+                        help='Relative allocated memory increase flagged')
+    parser.add_argument('--min_time', type=float, default=0.25,
+                        help='Wall time increase (s) below which stages are '
+                        'not flagged')
+    parser.add_argument('--min_mem', type=float, default=1,
+                        help='Allocated memory increase (MB) below which '
+                        'stages are not flagged')
+    args = parser.parse_args()
+
+    baseline_file = os.path.join(BASELINE_DIR, 'scaling_' + args.grid +
+                                 ('_plots' if args.plots else '') + '.json')
+
+    print('{:>30} {:>5} {:>10} {:>10} {:>12} {:>12}'.format(
+          'case', '', 'wall (s)', 'cpu (s)', 'peak RSS (MB)', 'alloc (MB)'))
+    work_dir = tempfile.mkdtemp(prefix='bench_scaling_')
+    try:
+        cases = run_grid(grid_sizes(GRIDS[args.grid]), args.plots, work_dir,
+                         args.repeat)
+    finally:
+        shutil.rmtree(work_dir)
+
+    exponents = scaling_exponents(cases, args.min_time, args.min_mem)
+    print('\nScaling exponents p of wall time ~ n^p (allocated memory):')
+    for dim, stages in exponents.items():
+        for stage, fit in sorted(stages.items()):
+            print('{:>8} {:>40} {:>8} ({})'.format(
+                  dim, stage, *['{:.2f}'.format(fit[key]) if key in fit
+                                else '-' for key in ['wall',
+                                                     'alloc_peak_mb']]))
+
+    results = {'machine': machine(), 'grid': args.grid, 'plots': args.plots,
+               'cases': cases, 'exponents': exponents}
+    with open(args.output, 'w') as fp:
+        json.dump(results, fp, indent=1)
+
+    if args.update:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        with open(baseline_file, 'w') as fp:
+            json.dump({'versions': versions(),
+                       'cases': baseline_cases(cases)}, fp, indent=1,
+                      sort_keys=True)
+        print('\nBaseline written to ' + baseline_file)
+        sys.exit(0)
+
+    regressions = []
+    if os.path.exists(baseline_file):
+        with open(baseline_file, 'r') as fp:
+            baseline = json.load(fp)
+        if baseline['versions'] != versions():
+            print('\nThe baseline ' + baseline_file + ' was stored with '
+                  'different versions, not comparing the allocated memory:\n' +
+                  json.dumps(baseline['versions']) + '\nRun with --update to '
+                  'store a baseline for ' + json.dumps(versions()) + '.')
+        else:
+            regressions += compare(cases, baseline['cases'],
+                                   [('alloc_peak_mb', args.mem_tol,
+                                     args.min_mem)])
+            print('\nCompared allocated memory with ' + baseline_file + '.')
+    else:
+        print('\nNo baseline ' + baseline_file + ', run with --update to '
+              'store one.')
+
+    if args.time_baseline is not None:
+        with open(args.time_baseline, 'r') as fp:
+            time_baseline = json.load(fp)
+        if time_baseline['machine'] != results['machine']:
+            print('Warning: ' + args.time_baseline + ' was run on a '
+                  'different machine:\n' +
+                  json.dumps(time_baseline['machine']))
+        regressions += compare(cases, time_baseline['cases'],
+                               [('wall', args.time_tol, args.min_time)])
+        print('Compared wall times with ' + args.time_baseline + '.')
+
+    if regressions:
+        print('\nRegressions:')
+        for regression in regressions:
+            print('    ' + regression)
+        sys.exit(1)
+    print('\nNo regressions.')
@@ -0,0 +1,103 @@
+#########################
+#   gs2_correlation     #
+#   Ferdinand van Wyk   #
+#########################
+
+###############################################################################
+# This file is part of gs2_correlation.
+#
+# gs2_correlation_analysis is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# gs2_correlation is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with gs2_correlation.
+# If not, see <http://www.gnu.org/licenses/>.
+###############################################################################
+
+"""
+Benchmark of the batched ``Simulation.time_interpolate`` against the original
+loop which built one ``interp1d`` object per (kx, ky, theta) mode.
+
+Run from the package root directory:
+
+    $ python benchmarks/bench_time_interpolate.py
+"""
+
+# Standard
+import time
+
+# Third Party
+import numpy as np
+import scipy.interpolate as interp
+
+# Local
+from gs2_correlation.simulation import Simulation
+
+
+def loop_interpolate(t, field, t_reg):
+    """
+    Original implementation of time_interpolate.
+    """
+    nt, nkx, nky, ntheta = field.shape
+    tmp_field = np.empty([len(t_reg), nkx, nky, ntheta], dtype=complex)
+    for ikx in range(nkx):
+        for iky in range(nky):
+            for ith in range(ntheta):
+                f = interp.interp1d(t, field[:, ikx, iky, ith])
+                tmp_field[:, ikx, iky, ith] = f(t_reg)
+    return tmp_field
+
+
+def batched_interpolate(t, field, t_reg, method, interp_fac):
+    """
+    Call Simulation.time_interpolate on a bare object holding only the field.
+    """
+    run = Simulation.__new__(Simulation)
+    run.t = t
+    run.nt = len(t)
+    run.time_interp_fac = interp_fac
+    run.field = field.copy()
+    run.time_interp_method = method
+    run.real_dtype = np.float64
+    run.complex_dtype = np.complex128
+    run.time_interpolate(t_reg)
+    return run.field
+
+
+if __name__ == '__main__':
+    rng = np.random.RandomState(0)
+    interp_fac = 4
+
+    print('{:>22} {:>10} {:>10} {:>10} {:>10} {:>12}'.format(
+          '[nt, nkx, nky]', 'loop (s)', 'linear', 'cubic', 'fft',
+          'max |diff|'))
+    for shape in [(100, 32, 17), (200, 64, 33), (400, 128, 65)]:
+        nt, nkx, nky = shape
+        t = np.cumsum(rng.uniform(0.9, 1.1, nt))
+        field = (rng.normal(size=[nt, nkx, nky, 1]) +
+                 1j*rng.normal(size=[nt, nkx, nky, 1]))
+        t_reg = np.linspace(t[0], t[-1], interp_fac*nt)
+
+        start = time.perf_counter()
+        ref = loop_interpolate(t, field, t_reg)
+        times = [time.perf_counter() - start]
+
+        for method in ['linear', 'cubic', 'fft']:
+            # Band-limited interpolation needs a regular input grid
+            if method == 'fft':
+                t = np.linspace(t[0], t[-1], nt)
+            start = time.perf_counter()
+            new = batched_interpolate(t, field, t_reg, method, interp_fac)
+            times.append(time.perf_counter() - start)
+            if method == 'linear':
+                diff = np.abs(new - ref).max()
+
+        print('{:>22} {:10.3f} {:10.3f} {:10.3f} {:10.3f} {:12.2e}'.format(
+              str(list(shape)), *times, diff))
@@ -0,0 +1,378 @@
+#########################
+#   gs2_correlation     #
+#   Ferdinand van Wyk   #
+#########################
+
+###############################################################################
+# This file is part of gs2_correlation.
+#
+# gs2_correlation_analysis is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# gs2_correlation is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with gs2_correlation.
+# If not, see <http://www.gnu.org/licenses/>.
+###############################################################################
+
+"""
+.. module:: batch
+   :platform: Unix, OSX
+   :synopsis: Runs the correlation analysis over an ensemble of GS2 runs.
+
+.. moduleauthor:: Ferdinand van Wyk <ferdinandvwyk@gmail.com>
+
+Usage::
+
+    $ python gs2_correlation/batch.py config_template.ini 'scan/*/' \\
+          --workers 8 --max_mem 64000 --table scan_results.csv
+
+"""
+
+# Standard
+import os
+import sys
+import glob
+import csv
+import json
+import time
+import logging
+import argparse
+import traceback
+import configparser
+import concurrent.futures
+
+# Third Party
+import numpy as np
+from netCDF4 import Dataset
+
+# Local
+from gs2_correlation.simulation import Simulation
+
+def find_run_folders(patterns):
+    """
+    Expands a list of run folders and glob patterns into a sorted list of
+    unique folders, each ending in '/'.
+    """
+    run_folders = set()
+    for pattern in patterns:
+        for folder in glob.glob(pattern):
+            if os.path.isdir(folder):
+                run_folders.add(os.path.join(folder, ''))
+
+    return sorted(run_folders)
+
+
+def write_run_config(template, run_folder):
+    """
+    Writes the configuration file of *run_folder* from the configuration file
+    *template*.
+
+    *run_folder* replaces the run folder of the template. The cdf_file,
+    g_file and out_dir options of the template are only kept if they contain
+    '{run_folder}', which is replaced by *run_folder*, otherwise they are
+    reset to their defaults for each run. The files found in the run folder
+    are written to the configuration file, so that they are only searched for
+    once.
+
+    Returns
+    -------
+    config_file : str
+        Path of the configuration file, which is written to the
+        'correlation_analysis' directory of the run.
+    run : Simulation
+        Object with only the configuration of the run read in.
+    """
+    config_parse = configparser.ConfigParser()
+    config_parse.read(template)
+    config_parse['general']['run_folder'] = run_folder
+    for option in ['cdf_file', 'g_file', 'out_dir']:
+        value = config_parse.get('general', option, fallback='None')
+        if '{run_folder}' in value:
+            config_parse['general'][option] = value.format(
+                    run_folder=run_folder)
+        elif option == 'out_dir':
+            config_parse.remove_option('general', option)
+        else:
+            config_parse['general'][option] = 'None'
+
+    config_dir = run_folder + 'correlation_analysis'
+    os.makedirs(config_dir, exist_ok=True)
+    config_file = config_dir + '/batch_config.ini'
+    with open(config_file, 'w') as fp:
+        config_parse.write(fp)
+
+    run = Simulation.__new__(Simulation)
+    run.config_file = config_file
+    run.read_config()
+
+    config_parse['general']['cdf_file'] = run.cdf_file
+    config_parse['general']['g_file'] = run.g_file
+    with open(config_file, 'w') as fp:
+        config_parse.write(fp)
+
+    return config_file, run
+
+
+def complete_file(out_dir):
+    """
+    Returns the path of the file marking that the analysis writing to
+    *out_dir* finished successfully.
+    """
+    return out_dir + '/batch_complete.json'
+
+
+def up_to_date(run, template):
+    """
+    Returns True if the analysis of *run* finished successfully after its
+    NetCDF file and the configuration *template* were last changed.
+
+    The results file alone is not enough, since with *analysis* = 'all' it is
+    written by the first stage even if a later stage fails. The completion
+    file written by ``analyze`` is checked instead.
+    """
+    marker = complete_file(run.out_dir)
+    if not os.path.exists(marker):
+        return False
+
+    inputs = [run.cdf_file, template]
+    return os.path.getmtime(marker) >= max(os.path.getmtime(f)
+                                           for f in inputs)
+
+
+def estimate_memory(run):
+    """
+    Estimates the peak memory in MB used to analyze *run*, from the sizes of
+    the Fourier and real space fields set by its configuration.
+
+    Notes
+    -----
+
+    The number of time steps is that of *time_range*, multiplied by
+    *time_interp_fac* if the field is interpolated, and the element size is
+    that of *precision*. Without *max_chunk_mem*, the peak is the larger of:
+
+    * the field read from the NetCDF file and the interpolated field, both
+      held by ``time_interpolate``, and
+    * the interpolated field, the transform input buffer, the full real
+      space transform output and the real space field kept after
+      ``field_odd_pts``, all held at the end of ``field_to_real_space``.
+
+    With *max_chunk_mem*, the peak is *max_chunk_mem* plus the real space
+    field kept, see ``stream_real_space``. For *domain* = 'middle' the number
+    of points kept is only known once the geometry is read, so the full grid
+    is used as an upper bound. The correlation functions of the time windows
+    are much smaller than the field and are not included.
+    """
+    with Dataset(run.cdf_file, 'r') as ncfile:
+        nt = len(ncfile.variables['t'][run.time_range[0]:run.time_range[1]])
+        nkx = len(ncfile.variables['kx'])
+        nky = len(ncfile.variables['ky'])
+        ntheta = len(ncfile.variables['theta'])
+    if run.theta_idx is not None:
+        ntheta = len(range(ntheta)[run.theta_idx[0]:run.theta_idx[1]])
+
+    nt_out = nt
+    if run.time_interpolate_bool or run.lab_frame:
+        nt_out = run.time_interp_fac*nt
+
+    itemsize = np.dtype(run.real_dtype).itemsize
+    fourier_step = nkx*nky*ntheta*2*itemsize
+    real_step = nkx*2*(nky - 1)*ntheta*itemsize
+
+    if run.max_chunk_mem is not None:
+        mem = run.max_chunk_mem*1024**2 + nt_out*real_step
+    else:
+        mem = max((nt + nt_out)*fourier_step,
+                  nt_out*(2*fourier_step + 2*real_step))
+
+    return mem/1024**2
+
+
+def analyze(config_file):
+    """
+    Runs the analysis of a single configuration file in a worker process.
+
+    The completion file ``complete_file(out_dir)`` is only written once
+    ``run_analysis`` has returned, so a run is not considered up to date if
+    any of its stages failed.
+
+    Returns
+    -------
+    error : str or None
+        Traceback of the exception raised by the analysis, or None if it
+        finished successfully.
+    """
+    logging.info('Starting analysis of ' + config_file)
+    try:
+        run = Simulation(config_file)
+        run.run_analysis()
+        with open(complete_file(run.out_dir), 'w') as fp:
+            json.dump({'config_file': config_file,
+                       'finished': time.strftime("%Y-%m-%d %H:%M:%S",
+                                                 time.gmtime())}, fp)
+    except Exception:
+        error = traceback.format_exc()
+        logging.error('Analysis of ' + config_file + ' failed:\n' + error)
+        return error
+
+    logging.info('Finished analysis of ' + config_file)
+    return None
+
+
+def run_batch(template, run_folders, workers=1, max_mem=None, force=False):
+    """
+    Analyzes every run folder using the configuration *template*.
+
+    Parameters
+    ----------
+    template : str
+        Configuration file used for every run, see ``write_run_config``.
+    run_folders : list
+        Run folders to analyze.
+    workers : int
+        Maximum number of runs analyzed at the same time, each in its own
+        worker process. Worker processes are reused for several runs, so the
+        interpreter is only started and the modules imported once per worker.
+    max_mem : float or None
+        Maximum total estimated memory in MB of the runs analyzed at the same
+        time, see ``estimate_memory``. A run which is larger than *max_mem*
+        is analyzed on its own.
+    force : bool
+        Analyze runs even if their results are up to date.
+
+    Returns
+    -------
+    status : dict
+        Status of each run folder: 'done', 'skipped' or the traceback of the
+        exception raised by the analysis.
+    out_dirs : dict
+        Output directory of each run folder.
+    """
+    status = {}
+    out_dirs = {}
+    jobs = []
+    for run_folder in run_folders:
+        try:
+            config_file, run = write_run_config(template, run_folder)
+            out_dirs[run_folder] = run.out_dir
+            if not force and up_to_date(run, template):
+                logging.info('Results of ' + run_folder + ' are up to date, '
+                             'skipping.')
+                status[run_folder] = 'skipped'
+            else:
+                # A failed analysis must not leave the previous marker behind
+                if os.path.exists(complete_file(run.out_dir)):
+                    os.remove(complete_file(run.out_dir))
+                jobs.append((run_folder, config_file, estimate_memory(run)))
+        except Exception:
+            status[run_folder] = traceback.format_exc()
+
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        running = {}
+        mem_used = 0
+        while jobs or running:
+            # Start runs in order while they fit within the memory limit
+            while jobs and len(running) < workers and \
+                    (not running or max_mem is None or
+                     mem_used + jobs[0][2] <= max_mem):
+                run_folder, config_file, mem = jobs.pop(0)
+                running[pool.submit(analyze, config_file)] = (run_folder, mem)
+                mem_used += mem
+
+            done, _ = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                run_folder, mem = running.pop(future)
+                mem_used -= mem
+                error = future.result()
+                status[run_folder] = 'done' if error is None else error
+
+    return status, out_dirs
+
+
+def gather_results(status, out_dirs, table_file):
+    """
+    Collects the results files of all runs into one table.
+
+    The scalar results of each analysis are written to the CSV file
+    *table_file*, one row per run folder, with columns named
+    'analysis:result'. The full contents of every results file are written
+    to a JSON file with the same name as *table_file* and the extension
+    '.json'.
+    """
+    rows = []
+    all_results = {}
+    for run_folder in sorted(status):
+        if status[run_folder] in ['done', 'skipped']:
+            row = {'run_folder': run_folder, 'status': status[run_folder]}
+        else:
+            row = {'run_folder': run_folder, 'status': 'failed'}
+        try:
+            with open(out_dirs[run_folder] + '/results.json', 'r') as fp:
+                results = json.load(fp)
+        except (KeyError, FileNotFoundError):
+            results = {}
+
+        all_results[run_folder] = results
+        for analysis, result_dict in results.items():
+            for key, value in result_dict.items():
+                if isinstance(value, (int, float, str)):
+                    row[analysis + ':' + key] = value
+        rows.append(row)
+
+    columns = ['run_folder', 'status']
+    columns += sorted(set(k for row in rows for k in row) - set(columns))
+    with open(table_file, 'w', newline='') as fp:
+        writer = csv.DictWriter(fp, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+
+    with open(os.path.splitext(table_file)[0] + '.json', 'w') as fp:
+        json.dump(all_results, fp)
+
+
+#############
+# Main Code #
+#############
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Perform the correlation '
+                                     'analysis of many GS2 runs')
+    parser.add_argument('template', metavar='template', type=str,
+                        help='Configuration file used for every run')
+    parser.add_argument('run_folders', metavar='run_folders', type=str,
+                        nargs='+', help='Run folders or glob patterns')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='Maximum number of runs analyzed at once')
+    parser.add_argument('--max_mem', type=float, default=None,
+                        help='Maximum estimated memory (MB) of the runs '
+                        'analyzed at once')
+    parser.add_argument('--force', action='store_true',
+                        help='Analyze runs whose results are up to date')
+    parser.add_argument('--table', type=str, default='ensemble_results.csv',
+                        help='CSV file the results of all runs are written to')
+    args = parser.parse_args()
+
+    logging.basicConfig(filename='batch.log', level=logging.INFO)
+    logging.info('')
+    logging.info(time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime()))
+    logging.info('')
+
+    status, out_dirs = run_batch(args.template,
+                                 find_run_folders(args.run_folders),
+                                 args.workers, args.max_mem, args.force)
+    gather_results(status, out_dirs, args.table)
+
+    failed = [f for f in status if status[f] not in ['done', 'skipped']]
+    for run_folder in failed:
+        print('Analysis of ' + run_folder + ' failed:\n' + status[run_folder])
+    print(str(len(status) - len(failed)) + ' of ' + str(len(status)) +
+          ' runs analyzed successfully, results written to ' + args.table)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,415 @@
+#########################
+#   gs2_correlation     #
+#   Ferdinand van Wyk   #
+#########################
+
+###############################################################################
+# This file is part of gs2_correlation.
+#
+# gs2_correlation_analysis is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# gs2_correlation is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with gs2_correlation.
+# If not, see <http://www.gnu.org/licenses/>.
+###############################################################################
+
+"""
+.. module:: fft_backend
+   :platform: Unix, OSX
+   :synopsis: Shared pyfftw backend with cached plans and persistent wisdom.
+
+.. moduleauthor:: Ferdinand van Wyk <ferdinandvwyk@gmail.com>
+
+"""
+
+# Standard
+import os
+import atexit
+import pickle
+import logging
+
+# Third Party
+import numpy as np
+import scipy.fftpack as fftpack
+import pyfftw
+import pyfftw.builders
+
+# Module state shared by all transforms
+threads = 1
+planner_effort = 'FFTW_MEASURE'
+wisdom_file = None
+plans = {}
+
+
+def configure(n_threads=1, effort='FFTW_MEASURE', wisdom=None):
+    """
+    Sets the number of threads, planner effort and wisdom file used for all
+    subsequent plans.
+
+    Parameters
+    ----------
+    n_threads : int
+        Number of threads used by FFTW.
+    effort : str
+        FFTW planner effort, e.g. 'FFTW_ESTIMATE', 'FFTW_MEASURE'.
+    wisdom : str or None
+        File from which FFTW wisdom is loaded and to which it is saved when
+        the interpreter exits. If None, wisdom is not persisted.
+    """
+    global threads, planner_effort, wisdom_file
+
+    if (n_threads, effort) != (threads, planner_effort):
+        clear_plans()
+    threads = n_threads
+    planner_effort = effort
+
+    if wisdom is not None and wisdom != wisdom_file:
+        load_wisdom(wisdom)
+        if wisdom_file is None:
+            atexit.register(save_wisdom)
+    wisdom_file = wisdom
+
+
+def load_wisdom(filename):
+    """
+    Imports FFTW wisdom from *filename*, if it exists.
+    """
+    try:
+        with open(filename, 'rb') as fp:
+            pyfftw.import_wisdom(pickle.load(fp))
+        logging.info('Loaded FFTW wisdom from ' + filename)
+    except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+        logging.info('No usable FFTW wisdom found in ' + filename)
+
+
+def save_wisdom():
+    """
+    Exports the accumulated FFTW wisdom to *wisdom_file*.
+    """
+    if wisdom_file is None:
+        return
+
+    tmp_file = wisdom_file + '.tmp' + str(os.getpid())
+    with open(tmp_file, 'wb') as fp:
+        pickle.dump(pyfftw.export_wisdom(), fp)
+    os.replace(tmp_file, wisdom_file)
+
+
+def clear_plans():
+    """
+    Removes all cached plans, releasing their input and output buffers.
+    """
+    plans.clear()
+
+
+def get_plan(kind, shape, dtype, axes, s=None):
+    """
+    Returns the cached plan for a transform, creating it if necessary.
+
+    Parameters
+    ----------
+    kind : str
+        Name of the pyfftw builder: 'fftn', 'ifftn', 'rfftn' or 'irfftn'.
+    shape : tuple
+        Shape of the input array.
+    dtype : dtype
+        Data type of the input array.
+    axes : tuple
+        Axes over which to transform.
+    s : tuple, optional
+        Length of the transform along *axes*, as in ``numpy.fft``.
+
+    Notes
+    -----
+
+    Each plan owns an aligned input buffer and output buffer which are reused
+    every time the plan is executed, so repeated transforms of the same shape
+    cost no planning or allocation.
+    """
+    key = (kind, tuple(shape), np.dtype(dtype).str, tuple(axes),
+           None if s is None else tuple(s))
+    try:
+        return plans[key]
+    except KeyError:
+        pass
+
+    input_array = pyfftw.empty_aligned(shape, dtype=dtype)
+    builder = getattr(pyfftw.builders, kind)
+    plan = builder(input_array, s=s, axes=axes, threads=threads,
+                   planner_effort=planner_effort, avoid_copy=True)
+    plans[key] = plan
+
+    return plan
+
+
+def execute(kind, a, axes, s=None, weight=None):
+    """
+    Copies *a* into the input buffer of the cached plan and executes it.
+
+    For forward transforms *s* may only zero pad *a*, which is done directly
+    in the input buffer. For 'irfftn', *s* gives the real output lengths as
+    in ``numpy.fft.irfftn``. If *weight* is given, *a* is multiplied by it
+    (with broadcasting) while being copied into the input buffer, so that
+    scaling the input costs no extra pass over memory.
+
+    Returns
+    -------
+    out : array_like
+        Output buffer of the plan. This is overwritten the next time a
+        transform of the same shape is done, so it must be copied if it is
+        kept.
+    """
+    a = np.asarray(a)
+    if s is not None and kind != 'irfftn':
+        shape = list(a.shape)
+        for ax, n in zip(axes, s):
+            shape[ax] = n
+        plan = get_plan(kind, shape, a.dtype, axes)
+        plan.input_array[...] = 0
+        input_array = plan.input_array[tuple(slice(0, n) for n in a.shape)]
+    else:
+        plan = get_plan(kind, a.shape, a.dtype, axes, s)
+        input_array = plan.input_array
+
+    if weight is None:
+        input_array[...] = a
+    else:
+        np.multiply(a, weight, out=input_array)
+
+    return plan()
+
+
+def fftn(a, axes, s=None):
+    """
+    Complex forward FFT over *axes*. See ``execute``.
+    """
+    return execute('fftn', np.asarray(a, dtype=complex_type(a)), axes, s)
+
+
+def ifftn(a, axes, s=None):
+    """
+    Complex inverse FFT over *axes*, normalized as ``numpy.fft.ifftn``. See
+    ``execute``.
+    """
+    return execute('ifftn', np.asarray(a, dtype=complex_type(a)), axes, s)
+
+
+def rfftn(a, axes, s=None):
+    """
+    Real forward FFT over *axes*. See ``execute``.
+    """
+    return execute('rfftn', a, axes, s)
+
+
+def irfftn(a, axes, s=None, weight=None):
+    """
+    Real inverse FFT over *axes*, normalized as ``numpy.fft.irfftn``. See
+    ``execute``.
+    """
+    return execute('irfftn', a, axes, s, weight)
+
+
+def complex_type(a):
+    """
+    Complex data type with the same precision as *a*.
+    """
+    return np.result_type(np.asarray(a).dtype, np.complex64)
+
+
+def autocorr_same(a, axes, norm=None):
+    """
+    Autocorrelation of *a* over *axes*, equivalent to
+    ``sig.fftconvolve(a, a[::-1,...,::-1], 'same')`` over those axes.
+
+    The array is zero padded to a fast length of at least 2n-1 along each
+    axis, so that the circular correlation calculated from the power spectrum
+    equals the linear one. The zero lag is at index n//2.
+
+    Parameters
+    ----------
+    a : array_like
+        Real array to be correlated.
+    axes : tuple
+        Axes over which to correlate. All other axes are batched.
+    norm : array_like, optional
+        Normalization which the correlation is divided by in place, e.g. the
+        number of overlapping points at each lag. Must broadcast against the
+        correlation.
+    """
+    n = [a.shape[ax] for ax in axes]
+    n_pad = [fftpack.next_fast_len(2*ni - 1) for ni in n]
+
+    spec = rfftn(a, axes, s=n_pad)
+    spec *= np.conj(spec)
+    corr = irfftn(spec, axes, s=n_pad)
+
+    # Pick out lags -n//2, ..., (n-1)//2 from the circular correlation
+    for ax, ni, ni_pad in zip(axes, n, n_pad):
+        corr = np.take(corr, (np.arange(ni) - ni//2) % ni_pad, axis=ax)
+
+    if norm is not None:
+        corr /= norm
+
+    return corr
+
+
+def autocorr_lags(a, axes, idx, norm=None):
+    """
+    Autocorrelation of *a* over *axes*, like ``autocorr_same``, but only at
+    the indices *idx* of the last axis in *axes*.
+
+    The zero padded spectrum is transformed back in full along all but the
+    last axis. Along the last axis, a partial DFT onto the requested lags is
+    done as a matrix product with the Hermitian half spectrum, so the cost
+    and the size of the result scale with ``len(idx)`` rather than with the
+    length of that axis.
+
+    Parameters
+    ----------
+    a : array_like
+        Real array to be correlated.
+    axes : tuple
+        Axes over which to correlate. All other axes are batched.
+    idx : array_like
+        Indices of the last axis in *axes* to keep, in the ordering of
+        ``autocorr_same``, i.e. the zero lag is at index n//2.
+    norm : array_like, optional
+        Normalization which the correlation is divided by in place. Must
+        broadcast against the correlation.
+    """
+    n = [a.shape[ax] for ax in axes]
+    n_pad = [fftpack.next_fast_len(2*ni - 1) for ni in n]
+
+    spec = rfftn(a, axes, s=n_pad)
+    power = spec.real**2 + spec.imag**2
+
+    # Complex inverse transform along all but the last axis
+    if len(axes) > 1:
+        power = ifftn(power, axes[:-1])
+        for ax, ni, ni_pad in zip(axes[:-1], n, n_pad):
+            power = np.take(power, (np.arange(ni) - ni//2) % ni_pad, axis=ax)
+
+    # Partial DFT along the last axis, with the negative frequencies of the
+    # Hermitian spectrum accounted for by a factor of 2
+    ax = axes[-1]
+    k = np.arange(power.shape[ax])
+    weight = np.full(len(k), 2.0)
+    weight[0] = 1
+    if n_pad[-1]%2 == 0:
+        weight[-1] = 1
+    lags = np.asarray(idx) - n[-1]//2
+    dft = (weight[:,np.newaxis]/n_pad[-1] *
+           np.exp(2j*np.pi*np.outer(k, lags)/n_pad[-1]))
+
+    corr = np.matmul(np.moveaxis(power, ax, -1),
+                     dft.astype(complex_type(power))).real
+    corr = np.moveaxis(corr, -1, ax)
+
+    if norm is not None:
+        corr /= norm
+
+    return corr
+
+
+def autocorr_binned(a, t, axis, idx=None, norm=None):
+    """
+    Autocorrelation of *a* over its first axis, sampled at the irregular
+    times *t*, and over *axis*, with the time lags binned onto a regular grid.
+
+    The time lags are binned onto ``len(t)`` points spaced by the mean time
+    step, with the zero lag at index len(t)//2, so on a regular time grid the
+    result is the same as ``autocorr_same(a, (0, axis))`` divided by the
+    number of pairs of time steps at each lag.
+
+    Parameters
+    ----------
+    a : array_like
+        Real array to be correlated, with time as its first axis.
+    t : array_like
+        Times of the first axis of *a*, in increasing order.
+    axis : int
+        Other axis over which to correlate, which must be regular. All
+        remaining axes are batched.
+    idx : array_like, optional
+        Indices of *axis* to keep, in the ordering of ``autocorr_same``. By
+        default all indices are kept.
+    norm : array_like, optional
+        Normalization which the correlation is divided by in place, e.g. the
+        number of overlapping points along *axis*. Must broadcast against the
+        correlation.
+
+    Notes
+    -----
+
+    * The cross spectrum along *axis* of every pair of time steps i < j is
+      shared between the two bins either side of the lag t[j] - t[i], with
+      linear (tent) weights, and the bins of negative lags are the complex
+      conjugates of the positive ones. The zero lag bin only contains the
+      pairs i = j, so that it stays the variance of the field. Each bin is
+      then transformed back once and divided by the sum of its weights, so
+      the cost is O(nt^2) spectra products rather than O(nt^2) transforms.
+    * Bins without any pairs, which occur when the time step changes
+      strongly within *t*, are linearly interpolated from the neighbouring
+      bins.
+    """
+    a = np.moveaxis(np.asarray(a), axis, -1)
+    nt = len(t)
+    n = a.shape[-1]
+    n_pad = fftpack.next_fast_len(2*n - 1)
+    if idx is None:
+        idx = np.arange(n)
+
+    spec = np.array(rfftn(a, (a.ndim - 1,), s=(n_pad,)))
+    dt_bin = (t[-1] - t[0])/(nt - 1)
+    n_bins = nt//2 + 1
+
+    # Weighted sum of the cross spectra and of the weights in the bins of
+    # lags >= 0. Each pair is shared between the two bins either side of its
+    # lag, with linear weights.
+    spec_sum = np.zeros((n_bins,) + spec.shape[1:], dtype=spec.dtype)
+    counts = np.zeros(n_bins)
+    for m in range(nt):
+        u = (t[m:] - t[:nt-m])/dt_bin
+        lower = np.floor(u).astype(int)
+        for bins, weights in [(lower, 1 - (u - lower)), (lower + 1, u - lower)]:
+            keep = (bins < n_bins) & (weights > 0)
+            if m > 0:
+                keep &= bins > 0
+            for b in np.unique(bins[keep]):
+                pairs = np.where(keep & (bins == b))[0]
+                w = weights[pairs].reshape((-1,) + (1,)*(spec.ndim - 1))
+                spec_sum[b] += np.sum(w*np.conj(spec[pairs])*spec[pairs + m],
+                                      axis=0)
+                counts[b] += np.sum(weights[pairs])
+
+    mid = nt//2
+    spec_full = np.empty((nt,) + spec.shape[1:], dtype=spec.dtype)
+    spec_full[mid:] = spec_sum[:nt-mid]
+    spec_full[:mid] = np.conj(spec_sum[mid:0:-1])
+    counts_full = np.concatenate([counts[mid:0:-1], counts[:nt-mid]])
+
+    corr = irfftn(spec_full, (a.ndim - 1,), s=(n_pad,))
+    corr = np.take(corr, (np.asarray(idx) - n//2) % n_pad, axis=-1)
+
+    valid = np.where(counts_full > 0)[0]
+    corr[valid] /= counts_full[valid].reshape((-1,) + (1,)*(corr.ndim - 1))
+    for k in np.where(counts_full == 0)[0]:
+        r = np.searchsorted(valid, k)
+        left = valid[max(r - 1, 0)]
+        right = valid[min(r, len(valid) - 1)]
+        weight = 0 if left == right else (k - left)/(right - left)
+        corr[k] = (1 - weight)*corr[left] + weight*corr[right]
+
+    corr = np.moveaxis(corr, -1, axis)
+    if norm is not None:
+        corr /= norm
+
+    return corr
@@ -84,6 +84,118 @@ def gauss(x, l, p):
     # fitting function only works on 1D data, reshape later to plot
     return fit_fn.ravel()
 
+#Batched fit of exp(-a/tau_c) to every row of peaks, see Notes
+def exp_fit_batch(a, peaks, tau_guess, n_iter=20, n_halve=10, rtol=1e-10):
+    """
+    Fits peaks = exp(-a/tau_c) for each row of *a* and *peaks* at once.
+
+    Parameters
+    ----------
+    a : array_like
+        Time separations of the peaks, shape (n, npeaks). This is |t| for a
+        decaying exponential and -t for a growing exponential.
+    peaks : array_like
+        Peak values of the correlation function, shape (n, npeaks).
+    tau_guess : float
+        Initial guess for rows where the log-linear estimate does not exist.
+    n_iter : int
+        Maximum number of Gauss-Newton iterations used to polish the
+        log-linear estimate. If 0, only the log-linear estimate is used.
+    n_halve : int
+        Maximum number of times the step of each iteration is halved.
+    rtol : float
+        The iterations stop once no rate changes by more than *rtol* times
+        itself.
+
+    Returns
+    -------
+    tau_c, tau_c_err : array_like
+        Fitted correlation time and its standard error for each row. The
+        error is NaN if there are not enough peaks to estimate it.
+
+    Notes
+    -----
+
+    * The initial estimate is the closed form weighted least squares fit of
+      log(peaks) = -a/tau_c, with weights peaks**2 so that the fit
+      approximates the least squares fit of the peaks themselves. Peaks which
+      are not positive are given zero weight. If the estimate is not
+      positive and finite, e.g. for increasing peaks, 1/*tau_guess* is used.
+    * The Gauss-Newton iterations then minimize the same sum of squares as
+      ``lmfit`` does when fitting ``decaying_exp`` or ``growing_exp``. A step
+      is halved until the rate stays positive and the sum of squares does
+      not increase, and is not taken otherwise, so the polished fit is never
+      worse than the initial estimate.
+    * As for ``lmfit``, the error is scaled by the reduced chi-squared.
+    """
+    a = np.asarray(a, dtype=np.float64)
+    peaks = np.asarray(peaks, dtype=np.float64)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        valid = peaks > 0
+        weight = np.where(valid, peaks**2, 0)
+        log_peaks = np.log(np.where(valid, peaks, 1))
+        rate = -np.sum(weight*a*log_peaks, axis=-1) / \
+                np.sum(weight*a**2, axis=-1)
+        rate = np.where(np.isfinite(rate) & (rate > 0), rate, 1/tau_guess)
+
+        cost = exp_fit_cost(a, peaks, rate)
+        for i in range(n_iter):
+            rate_prev = rate
+            fit_fn = np.exp(-a*rate[:,np.newaxis])
+            jac = -a*fit_fn
+            step = np.sum(jac*(peaks - fit_fn), axis=-1) / \
+                   np.sum(jac**2, axis=-1)
+
+            # Halve the step until the rate stays positive and the sum of
+            # squares does not increase, otherwise keep the current rate
+            accepted = np.zeros(len(rate), dtype=bool)
+            for j in range(n_halve):
+                trial = rate + step
+                trial_cost = exp_fit_cost(a, peaks, trial)
+                ok = (~accepted & np.isfinite(trial) & (trial > 0) &
+                      (trial_cost <= cost))
+                rate = np.where(ok, trial, rate)
+                cost = np.where(ok, trial_cost, cost)
+                accepted |= ok
+                step = step/2
+
+            if np.all(np.abs(rate - rate_prev) <= rtol*rate):
+                break
+
+        fit_fn = np.exp(-a*rate[:,np.newaxis])
+        jac = -a*fit_fn
+        dof = a.shape[-1] - 1
+        if dof > 0:
+            rate_var = np.sum((peaks - fit_fn)**2, axis=-1)/dof / \
+                       np.sum(jac**2, axis=-1)
+        else:
+            rate_var = np.full(len(rate), np.nan)
+
+        tau_c = 1/rate
+        tau_c_err = np.sqrt(rate_var)/rate**2
+
+    return tau_c, tau_c_err
+
+#Sum of squares minimized by exp_fit_batch for each row
+def exp_fit_cost(a, peaks, rate):
+    return np.sum((peaks - np.exp(-a*rate[:,np.newaxis]))**2, axis=-1)
+
+#Sub-sample position and value of maxima from a parabola through 3 points
+def parabolic_peak(y_left, y_mid, y_right):
+    """
+    Returns the offset (in samples, between -0.5 and 0.5) of the vertex of
+    the parabola through three equally spaced points from the middle point,
+    and the value at the vertex.
+    """
+    curv = y_left - 2*y_mid + y_right
+    with np.errstate(divide='ignore', invalid='ignore'):
+        offset = np.where(curv < 0, 0.5*(y_left - y_right)/curv, 0)
+    offset = np.clip(offset, -0.5, 0.5)
+    value = y_mid - 0.25*(y_left - y_right)*offset
+
+    return offset, value
+
 ###################
 # Misc Procedures #
 ###################
@@ -42,6 +42,9 @@ parser = argparse.ArgumentParser(description='Perform correlation and other '
                                  'analyses')
 parser.add_argument('config_file', metavar='config_file', type=str, 
                     help='Location of the configuration file')
+parser.add_argument('--profile', action='store_true',
+                    help='Write the time and memory used by each stage to '
+                    'profile.json in the output directory')
 args = parser.parse_args()
 
 # Set up logging framework
@@ -52,19 +55,7 @@ logging.info('')
 
 #Create Simulation object
 
-run = simulation.Simulation(args.config_file)
+run = simulation.Simulation(args.config_file,
+                             profile=True if args.profile else None)
 
-if run.analysis == 'all':
-    run.perp_analysis()
-    run.time_analysis()
-    run.write_field()
-elif run.analysis == 'perp':
-    run.perp_analysis()
-elif run.analysis == 'time':
-    run.time_analysis()
-elif run.analysis == 'par':
-    run.par_analysis()
-elif run.analysis == 'write_field':
-    run.write_field()
-elif run.analysis == 'write_field_full':
-    run.write_field_full()
+run.run_analysis()
@@ -0,0 +1,224 @@
+#########################
+#   gs2_correlation     #
+#   Ferdinand van Wyk   #
+#########################
+
+###############################################################################
+# This file is part of gs2_correlation.
+#
+# gs2_correlation_analysis is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# gs2_correlation is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with gs2_correlation.
+# If not, see <http://www.gnu.org/licenses/>.
+###############################################################################
+
+"""
+.. module:: parallel_fit
+   :platform: Unix, OSX
+   :synopsis: Process pool executor for the correlation function fits.
+
+.. moduleauthor:: Ferdinand van Wyk <ferdinandvwyk@gmail.com>
+
+"""
+
+# Standard
+import concurrent.futures
+
+# Third Party
+import numpy as np
+import lmfit as lm
+
+# Local
+import gs2_correlation.fitting_functions as fit
+
+
+def run_fits(tasks, n_workers=1):
+    """
+    Runs a list of fits, distributing independent chains of fits over a
+    process pool.
+
+    Parameters
+    ----------
+    tasks : list
+        List of ``(chain, fit_fn, guess, args)`` tuples. *fit_fn* is a module
+        level function called as ``fit_fn(guess, *args)`` which returns
+        ``(result, new_guess)``, where *new_guess* is None if the fit did not
+        converge. Fits with the same (hashable) *chain* label are done one
+        after the other in the order of *tasks*, each starting from the last
+        converged result of the chain, or from its own *guess* if there is
+        none. Fits in different chains are independent.
+    n_workers : int
+        Number of worker processes. If 1 or less, all fits are done in this
+        process.
+
+    Returns
+    -------
+    results : list
+        Result of each fit, in the order of *tasks*.
+
+    Notes
+    -----
+
+    The initial guess of every fit only depends on the chain it belongs to,
+    so the results do not depend on *n_workers* or on the order in which the
+    workers finish. The next fit of a chain is submitted as soon as the
+    previous one has finished, so chains are pipelined through the pool.
+    """
+    chains = {}
+    for i, task in enumerate(tasks):
+        chains.setdefault(task[0], []).append(i)
+
+    results = [None]*len(tasks)
+
+    if n_workers <= 1 or len(chains) <= 1:
+        for idx in chains.values():
+            chain_guess = None
+            for i in idx:
+                chain, fit_fn, guess, args = tasks[i]
+                if chain_guess is not None:
+                    guess = chain_guess
+                results[i], new_guess = fit_fn(guess, *args)
+                if new_guess is not None:
+                    chain_guess = new_guess
+        return results
+
+    with concurrent.futures.ProcessPoolExecutor(n_workers) as pool:
+        # Position in the chain and last converged guess of each chain
+        state = {chain: [0, None] for chain in chains}
+        pending = {}
+
+        def submit(chain):
+            _, fit_fn, guess, args = tasks[chains[chain][state[chain][0]]]
+            if state[chain][1] is not None:
+                guess = state[chain][1]
+            pending[pool.submit(fit_fn, guess, *args)] = chain
+
+        for chain in chains:
+            submit(chain)
+
+        while pending:
+            done, _ = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                chain = pending.pop(future)
+                i = chains[chain][state[chain][0]]
+                results[i], new_guess = future.result()
+                if new_guess is not None:
+                    state[chain][1] = new_guess
+                state[chain][0] += 1
+                if state[chain][0] < len(chains[chain]):
+                    submit(chain)
+
+    return results
+
+
+def model_result(fit_result):
+    """
+    Picklable summary of an ``lmfit`` ModelResult.
+
+    Returns
+    -------
+    result : dict
+        Dictionary with the best fit values ('values'), the fitted curve
+        ('best_fit') and the covariance matrix ('covar'), which is None if
+        the errors could not be estimated.
+    """
+    if fit_result.errorbars:
+        covar = np.array(fit_result.covar)
+    else:
+        covar = None
+
+    return {'values': dict(fit_result.best_values),
+            'best_fit': np.array(fit_result.best_fit),
+            'covar': covar}
+
+
+def fit_perp_x(guess, corr_fn, dx):
+    """
+    Fits the radial correlation function with a Gaussian.
+
+    *guess* contains the initial radial correlation length 'l'.
+    """
+    params = lm.Parameters()
+    params.add('l', value=guess['l'])
+    params.add('p', value=0.0, vary=False)
+    fit_x = lm.Model(fit.gauss).fit(corr_fn, params, x=dx)
+
+    result = model_result(fit_x)
+    return result, {'l': result['values']['l']}
+
+
+def fit_perp_y(guess, corr_fn, dy, ky_free):
+    """
+    Fits the poloidal correlation function with an oscillating Gaussian.
+
+    *guess* contains the initial poloidal correlation length 'l' and, if
+    *ky_free* is True, the wavenumber 'k'. Otherwise k = 2 pi/l.
+    """
+    params = lm.Parameters()
+    params.add('l', value=guess['l'])
+    if not ky_free:
+        params.add('k', value=1, expr='2*3.141592653589793/l')
+    else:
+        params.add('k', value=guess['k'])
+    params.add('p', value=0.0, vary=False)
+    fit_y = lm.Model(fit.osc_gauss).fit(corr_fn, params, x=dy)
+
+    result = model_result(fit_y)
+    return result, {'l': result['values']['l'], 'k': result['values']['k']}
+
+
+def fit_time_osc(guess, corr_fn, dt, time_max):
+    """
+    Fits the central peak of the time correlation function with an
+    oscillating Gaussian.
+
+    *guess* contains the initial 'l', 'k' and 'p' of ``fit.osc_gauss``. If
+    the fit does not converge, the result is None. If the correlation time
+    is larger than *time_max*, the fit is kept but not used as the next
+    guess.
+    """
+    try:
+        params = lm.Parameters()
+        params.add('l', value=guess['l'])
+        params.add('k', value=guess['k'])
+        params.add('p', value=guess['p'], vary=False)
+        fit_t = lm.Model(fit.osc_gauss).fit(corr_fn, params, x=dt)
+    except RuntimeError:
+        return None, None
+
+    result = model_result(fit_t)
+    if np.abs(result['values']['l']) > time_max:
+        return result, None
+    return result, dict(result['values'])
+
+
+def fit_par(guess, corr_fn, dl_par, l_min, k_max):
+    """
+    Fits the parallel correlation function with an oscillating Gaussian.
+
+    *guess* contains the initial parallel correlation length 'l' and
+    wavenumber 'k', which are bounded by [l_min, 100] and k_max. If the fit
+    does not converge, the result is None.
+    """
+    try:
+        params = lm.Parameters()
+        params.add('l', value=guess['l'], min=l_min, max=100)
+        params.add('k', value=guess['k'], max=k_max)
+        params.add('p', value=0, vary=False)
+        par_fit = lm.Model(fit.osc_gauss).fit(corr_fn, params, x=dl_par)
+    except RuntimeError:
+        return None, None
+
+    result = model_result(par_fit)
+    return result, {'l': np.abs(result['values']['l']),
+                    'k': np.abs(result['values']['k'])}
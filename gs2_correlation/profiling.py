@@ -0,0 +1,276 @@
+#########################
+#   gs2_correlation     #
+#   Ferdinand van Wyk   #
+#########################
+
+###############################################################################
+# This file is part of gs2_correlation.
+#
+# gs2_correlation_analysis is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# gs2_correlation is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with gs2_correlation.
+# If not, see <http://www.gnu.org/licenses/>.
+###############################################################################
+
+"""
+.. module:: profiling
+   :platform: Unix, OSX
+   :synopsis: Records the time and memory used by the analysis stages.
+
+.. moduleauthor:: Ferdinand van Wyk <ferdinandvwyk@gmail.com>
+
+"""
+
+# Standard
+import os
+import sys
+import time
+import json
+import resource
+import tracemalloc
+import functools
+import contextlib
+
+# Third Party
+import numpy as np
+
+# ru_maxrss is in bytes on OSX and in kB on Linux
+RSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+# tracemalloc.reset_peak is only available from Python 3.9
+RESET_PEAK = hasattr(tracemalloc, 'reset_peak')
+
+
+def peak_rss():
+    """
+    Returns the peak resident set size of this process in MB.
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*RSS_UNIT/1024**2
+
+
+def current_rss():
+    """
+    Returns the current resident set size of this process in MB, or None if
+    /proc/self/statm is not available, e.g. on OSX.
+    """
+    try:
+        with open('/proc/self/statm', 'r') as fp:
+            pages = int(fp.read().split()[1])
+    except (IOError, OSError, IndexError, ValueError):
+        return None
+
+    return pages*resource.getpagesize()/1024**2
+
+
+def arrays_traced():
+    """
+    Returns True if ``tracemalloc`` traces the data of NumPy arrays, which is
+    the case from NumPy 1.13 on Python 3.6. Tracing must be started.
+    """
+    start = tracemalloc.get_traced_memory()[0]
+    a = np.ones(2**18)
+    traced = tracemalloc.get_traced_memory()[0] - start >= a.nbytes/2
+    del a
+
+    return traced
+
+
+def cpu_children():
+    """
+    Returns the CPU time in seconds of the finished child processes, e.g. the
+    fit workers.
+    """
+    times = os.times()
+    return times.children_user + times.children_system
+
+
+class Profiler(object):
+    """
+    Records the wall time, CPU time, peak RSS and memory allocated by each
+    stage of the analysis.
+
+    Stages are nested, and each stage is recorded under its path, e.g.
+    'time_analysis/calculate_time_corr'. Stages which are called several
+    times, e.g. once per time window, are accumulated into one record.
+
+    Memory allocations are traced with ``tracemalloc``, so the allocated
+    memory of a stage is that of the arrays created by it rather than the
+    change of the RSS of the process. The data of NumPy arrays is only traced
+    from NumPy 1.13 on Python 3.6, see ``arrays_traced``, and otherwise the
+    allocated memory is reported as None and only the RSS of the stages is
+    available. Tracing slows down code which allocates many small Python
+    objects, so a Profiler should only be created when profiling is
+    requested.
+
+    Before Python 3.9 the peak of ``tracemalloc`` cannot be reset, so it is
+    the peak since tracing started. The peak of a stage is then only known
+    if it exceeds every earlier peak, and is otherwise the largest memory
+    traced at the start and end of the stage and of its substages.
+    """
+
+    def __init__(self):
+        self.records = {}
+        self.stack = []
+        self.alloc_max = 0
+        self.wall_start = time.time()
+        self.cpu_start = time.process_time()
+        self.cpu_children_start = cpu_children()
+        self.started_tracing = not tracemalloc.is_tracing()
+        if self.started_tracing:
+            tracemalloc.start()
+        self.alloc_traced = arrays_traced()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        Context manager recording the stage *name* within the current stage.
+        """
+        current, peak = tracemalloc.get_traced_memory()
+        if RESET_PEAK:
+            if self.stack:
+                self.stack[-1]['alloc_peak'] = max(
+                        self.stack[-1]['alloc_peak'], peak)
+            self.alloc_max = max(self.alloc_max, peak)
+            tracemalloc.reset_peak()
+
+        path = self.stack[-1]['path'] + '/' + name if self.stack else name
+        frame = {'path': path, 'alloc_start': current, 'alloc_peak': current,
+                 'peak_start': peak, 'rss_start': peak_rss(),
+                 'rss_now': current_rss(),
+                 'wall': time.perf_counter(), 'cpu': time.process_time(),
+                 'cpu_children': cpu_children()}
+        self.stack.append(frame)
+        try:
+            yield
+        finally:
+            current, peak = tracemalloc.get_traced_memory()
+            frame = self.stack.pop()
+            if RESET_PEAK or peak > frame['peak_start']:
+                alloc_peak = max(frame['alloc_peak'], peak)
+            else:
+                alloc_peak = max(frame['alloc_peak'], current)
+            if self.stack:
+                self.stack[-1]['alloc_peak'] = max(
+                        self.stack[-1]['alloc_peak'], alloc_peak)
+
+            rss = peak_rss()
+            rss_now = current_rss()
+            record = {
+                'calls': 1,
+                'wall': time.perf_counter() - frame['wall'],
+                'cpu': time.process_time() - frame['cpu'],
+                'cpu_children': cpu_children() - frame['cpu_children'],
+                'peak_rss_mb': rss,
+                'rss_growth_mb': rss - frame['rss_start'],
+                'rss_net_mb': None,
+                'alloc_peak_mb': None,
+                'alloc_net_mb': None}
+            if rss_now is not None and frame['rss_now'] is not None:
+                record['rss_net_mb'] = rss_now - frame['rss_now']
+            if self.alloc_traced:
+                record['alloc_peak_mb'] = (alloc_peak -
+                                           frame['alloc_start'])/1024**2
+                record['alloc_net_mb'] = (current -
+                                          frame['alloc_start'])/1024**2
+            self.add(path, record)
+
+    def add(self, path, record):
+        """
+        Accumulates *record* into the record of the stage *path*. Times,
+        calls and net allocations are summed, and peaks are maximized. Values
+        which are not available are None.
+        """
+        if path not in self.records:
+            self.records[path] = dict(record)
+            return
+
+        total = self.records[path]
+        for key, value in record.items():
+            if value is None or total[key] is None:
+                total[key] = None
+            elif key in ['peak_rss_mb', 'rss_growth_mb', 'alloc_peak_mb']:
+                total[key] = max(total[key], value)
+            else:
+                total[key] += value
+
+    def profile_methods(self, obj, names):
+        """
+        Replaces the methods *names* of the instance *obj* with wrappers
+        which record each call as a stage. Only the instance is changed, so
+        other instances are not profiled.
+        """
+        for name in names:
+            method = getattr(obj, name)
+
+            @functools.wraps(method)
+            def wrapper(*args, method=method, name=name, **kwargs):
+                with self.stage(name):
+                    return method(*args, **kwargs)
+
+            setattr(obj, name, wrapper)
+
+    def dump(self, filename):
+        """
+        Writes the records to *filename*, e.g. from a forked process, to be
+        merged by ``load``.
+        """
+        with open(filename, 'w') as fp:
+            json.dump(self.records, fp)
+
+    def load(self, filename):
+        """
+        Merges the records written by ``dump`` to *filename* and deletes the
+        file.
+        """
+        with open(filename, 'r') as fp:
+            records = json.load(fp)
+        os.remove(filename)
+
+        for path, record in records.items():
+            self.add(path, record)
+
+    def report(self, **info):
+        """
+        Returns the profile of all stages as a dictionary.
+
+        Parameters
+        ----------
+        info :
+            Additional information about the analysis to be included, e.g.
+            the field size.
+        """
+        alloc_max = None
+        if self.alloc_traced:
+            alloc_max = max(self.alloc_max,
+                            tracemalloc.get_traced_memory()[1])/1024**2
+        return {'info': info,
+                'total': {'wall': time.time() - self.wall_start,
+                          'cpu': time.process_time() - self.cpu_start,
+                          'cpu_children': (cpu_children() -
+                                           self.cpu_children_start),
+                          'peak_rss_mb': peak_rss(),
+                          'alloc_peak_mb': alloc_max},
+                'stages': self.records}
+
+    def write(self, filename, **info):
+        """
+        Writes the ``report`` to the JSON file *filename*.
+        """
+        with open(filename, 'w') as fp:
+            json.dump(self.report(**info), fp, indent=2)
+
+    def close(self):
+        """
+        Stops tracing memory allocations if it was started by this Profiler.
+        """
+        if self.started_tracing and tracemalloc.is_tracing():
+            tracemalloc.stop()
@@ -39,6 +39,11 @@ import logging
 import operator
 import warnings
 import json
+import hashlib
+import shutil
+import fcntl
+import multiprocessing
+import multiprocessing.connection
 
 # Third Party
 import numpy as np
@@ -47,6 +52,7 @@ import scipy.interpolate as interp
 import scipy.integrate as integrate
 import scipy.optimize as opt
 import scipy.signal as sig
+import scipy.sparse as sparse
 import matplotlib as mpl
 mpl.use('Agg')
 import matplotlib.pyplot as plt
@@ -54,7 +60,6 @@ import seaborn as sns
 from mpl_toolkits.axes_grid1 import make_axes_locatable
 import f90nml as nml
 import lmfit as lm
-import pyfftw
 from progressbar import ProgressBar, Percentage, Bar
 plt.rcParams.update({'figure.autolayout': True})
 mpl.rcParams['axes.unicode_minus'] = False
@@ -63,6 +68,26 @@ pal = sns.color_palette('deep')
 # Local
 import gs2_correlation.fitting_functions as fit
 import gs2_correlation.plot_style as plot_style
+import gs2_correlation.fft_backend as fft_backend
+import gs2_correlation.parallel_fit as parallel_fit
+import gs2_correlation.profiling as profiling
+
+# Methods recorded as stages by the profiler when *profile* is True
+PROFILED_STAGES = ['read_input_file', 'read_geometry_file', 'read_netcdf',
+                   'stream_real_space', 'load_cache', 'save_cache',
+                   'field_to_complex', 'time_interpolate', 'zero_bes_scales',
+                   'zero_zf_scales', 'to_lab_frame', 'perp_spectra',
+                   'domain_reduce', 'field_to_real_space', 'field_odd_pts',
+                   'perp_analysis', 'field_normalize_perp',
+                   'calculate_perp_corr', 'perp_window_stats',
+                   'perp_corr_fit', 'perp_plots_x', 'perp_plots_y',
+                   'perp_analysis_summary', 'time_analysis',
+                   'lab_frame_window', 'field_normalize_time',
+                   'calculate_time_corr', 'time_corr_fit', 'time_osc_fit',
+                   'time_plot', 'time_analysis_summary', 'par_analysis',
+                   'calculate_l_par', 'calculate_par_corr', 'par_corr_fit',
+                   'par_window_stats', 'par_plot', 'par_analysis_summary',
+                   'write_field', 'write_field_full', 'write_field_nc']
 
 
 class Simulation(object):
@@ -77,7 +102,7 @@ class Simulation(object):
     documentation since it is very long.
     """
 
-    def __init__(self, config_file):
+    def __init__(self, config_file, profile=None):
         """
         Initialized by object using information from configuration file.
 
@@ -89,17 +114,33 @@ class Simulation(object):
         * Interpolates onto a regular time grid.
         * Zeros out BES scales.
         * Zeros out ZF scales.
-        * Transforms to lab frame.
-        * Calculates the real space field.
+        * Transforms to lab frame, unless *lab_frame_method* is 'window'.
         * Reduce domain size to according to *box_size* if domain is specified
           as 'middle', otherwise do nothing.
+        * Calculates the perpendicular power spectra if *perp_engine* is
+          'spectral'.
+        * Calculates the real space field on the (reduced) domain, unless
+          only the spectral perpendicular analysis is done.
         * Ensures real space field has odd points.
 
+        If *max_chunk_mem* is set, the steps from reading the field to
+        calculating the real space field are done in time chunks by
+        ``stream_real_space``. If *cache_dir* is set, the real space field is
+        memory mapped from the cache if it exists, and written to the cache
+        after it is calculated otherwise.
+
+        If *profile* is True, the methods in ``PROFILED_STAGES`` are recorded
+        by a ``profiling.Profiler`` and the report is written by
+        ``run_analysis``, see ``write_profile``.
+
         Parameters
         ----------
         config_file : str
             Filename of configuration file and path if not in the same
             directory.
+        profile : bool, optional
+            Overrides the *profile* option of the configuration file if not
+            None.
 
         Notes
         -----
@@ -119,6 +160,16 @@ class Simulation(object):
 
         self.config_file = config_file
         self.read_config()
+        if profile is not None:
+            self.profile = profile
+
+        self.profiler = None
+        if self.profile:
+            self.profiler = profiling.Profiler()
+            self.profiler.profile_methods(self, PROFILED_STAGES)
+
+        fft_backend.configure(self.fft_threads, self.fft_planner_effort,
+                              self.fft_wisdom_file)
 
         # Set plot options
         sns.set_context(self.seaborn_context)
@@ -135,6 +186,9 @@ class Simulation(object):
         self.nx = self.nkx
         self.ny = 2*(self.nky - 1)
         self.ntheta = self.field.shape[3]
+        self.box_idx = [0, 0]
+        self.time_mask = None
+        self.par_interp = None
 
         self.config_checks()
 
@@ -168,28 +222,63 @@ class Simulation(object):
         self.btor = self.bref*self.r_geo/self.R[int(self.ntheta/2)]
         self.bmag = np.sqrt(self.btor**2 + self.bpol**2)
 
-        self.field_to_complex()
-        self.fourier_correction()
-
-        if self.time_interpolate_bool or self.lab_frame:
-            self.time_interpolate()
-        self.nt_slices = int(self.nt/self.time_slice)
-
-        if self.zero_bes_scales_bool:
-            self.zero_bes_scales()
-
-        if self.zero_zf_scales_bool:
-            self.zero_zf_scales()
-
-        if self.lab_frame:
-            self.to_lab_frame()
+        if self.cache_dir is not None:
+            self.cache_path = os.path.join(self.cache_dir, self.cache_key())
+
+        if self.cache_dir is not None and os.path.isdir(self.cache_path):
+            self.load_cache()
+        elif self.max_chunk_mem is None and self.cache_dir is None:
+            self.field_to_complex()
+
+            if self.lab_frame_method == 'window':
+                # The field is kept at the NetCDF time steps in the plasma
+                # frame, see lab_frame_window
+                self.t_field = self.t
+                self.t = np.linspace(min(self.t), max(self.t),
+                                     self.time_interp_fac*self.nt)
+                self.nt = len(self.t)
+            elif self.time_interpolate_bool or self.lab_frame:
+                self.time_interpolate()
+
+            if self.zero_bes_scales_bool:
+                self.zero_bes_scales()
+
+            if self.zero_zf_scales_bool:
+                self.zero_zf_scales()
+
+            if self.lab_frame and self.lab_frame_method == 'field':
+                self.to_lab_frame()
+
+            if self.use_perp_spectra():
+                self.perp_power_x, self.perp_power_y = self.perp_spectra()
+
+            if self.domain == 'middle':
+                self.domain_reduce()
+
+            if self.use_perp_spectra() and self.analysis == 'perp':
+                # Only the power spectra are needed, so the real space field
+                # is left empty
+                self.field = None
+                self.field_real_space = np.empty([0, self.nx, self.ny,
+                                                  self.ntheta],
+                                                 dtype=self.real_dtype)
+            elif self.lab_frame_method == 'window':
+                self.field_real_space = np.empty([0, self.nx, self.ny,
+                                                  self.ntheta],
+                                                 dtype=self.real_dtype)
+            else:
+                self.field_to_real_space()
 
-        self.field_to_real_space()
+            self.field_odd_pts()
+        else:
+            self.stream_real_space()
+            if self.cache_dir is not None:
+                self.save_cache()
 
-        if self.domain == 'middle':
-            self.domain_reduce()
+        # Release the transform buffers sized for the whole field
+        fft_backend.clear_plans()
 
-        self.field_odd_pts()
+        self.nt_slices = int(self.nt/self.time_slice)
 
         if self.analysis != 'par' and self.analysis != 'write_field_full':
             self.field_real_space = self.field_real_space[:,:,:,0]
@@ -273,12 +362,8 @@ class Simulation(object):
         if self.g_file == 'None':
             self.g_file = self.find_file_with_ext('.g')
 
-        self.extract_input_file()
-        if 'input_file.in' in os.listdir(self.run_folder):
-            self.in_file = self.run_folder + 'input_file.in'
-        else:
-            NameError('Could not extract input file from NetCDF file. '
-                      'Make sure GS2 is using new diagnostic output.')
+        # The input file is read from the input_file variable in the NetCDF file
+        self.in_file = self.cdf_file
 
         self.in_field = str(config_parse['general']['field'])
 
@@ -297,6 +382,24 @@ class Simulation(object):
                                                     'time_interp_fac',
                                                     fallback=1))
 
+        self.time_interp_method = config_parse.get('general',
+                                                   'time_interp_method',
+                                                   fallback='linear')
+        if self.time_interp_method not in ['linear', 'cubic', 'fft']:
+            raise ValueError('time_interp_method must be one of (linear, '
+                             'cubic, fft)')
+
+        self.precision = config_parse.get('general', 'precision',
+                                          fallback='double')
+        if self.precision == 'double':
+            self.real_dtype = np.float64
+            self.complex_dtype = np.complex128
+        elif self.precision == 'single':
+            self.real_dtype = np.float32
+            self.complex_dtype = np.complex64
+        else:
+            raise ValueError('precision must be one of (single, double)')
+
         self.zero_bes_scales_bool = config_parse.getboolean('general',
                                    'zero_bes_scales', fallback=False)
 
@@ -306,6 +409,11 @@ class Simulation(object):
         self.lab_frame = config_parse.getboolean('general',
                                    'lab_frame', fallback=False)
 
+        self.lab_frame_method = config_parse.get('general', 'lab_frame_method',
+                                                 fallback='field')
+        if self.lab_frame_method not in ['field', 'window']:
+            raise ValueError('lab_frame_method must be one of (field, window)')
+
         self.spec_idx = str(config_parse['general']['species_index'])
         if self.spec_idx == "None":
             self.spec_idx = None
@@ -342,12 +450,66 @@ class Simulation(object):
         if self.time_range[1] == -1:
             self.time_range[1] = None
 
+        self.max_chunk_mem = str(config_parse.get('general', 'max_chunk_mem',
+                                                  fallback='None'))
+        if self.max_chunk_mem == 'None':
+            self.max_chunk_mem = None
+        else:
+            self.max_chunk_mem = float(self.max_chunk_mem)
+
+        self.cache_dir = str(config_parse.get('general', 'cache_dir',
+                                              fallback='None'))
+        if self.cache_dir == 'None':
+            self.cache_dir = None
+
+        self.fft_threads = int(config_parse.get('general', 'fft_threads',
+                                                fallback=1))
+        self.fft_planner_effort = config_parse.get('general',
+                                                   'fft_planner_effort',
+                                                   fallback='FFTW_MEASURE')
+        self.fft_wisdom_file = str(config_parse.get('general',
+                                                    'fft_wisdom_file',
+                                                    fallback='None'))
+        if self.fft_wisdom_file == 'None':
+            self.fft_wisdom_file = None
+
+        self.fit_workers = int(config_parse.get('general', 'fit_workers',
+                                                fallback=1))
+        self.fit_warm_start = config_parse.get('general', 'fit_warm_start',
+                                               fallback='serial')
+        if self.fit_warm_start not in ['serial', 'window', 'independent']:
+            raise ValueError('fit_warm_start must be one of (serial, window, '
+                             'independent)')
+
+        self.stage_workers = int(config_parse.get('general', 'stage_workers',
+                                                  fallback=1))
+
+        self.profile = config_parse.getboolean('general', 'profile',
+                                               fallback=False)
+
         #################
         # Perp Namelist #
         #################
 
         self.ky_free = config_parse.getboolean('perp','ky_free', fallback=False)
 
+        self.perp_stream = config_parse.getboolean('perp', 'perp_stream',
+                                                   fallback=False)
+
+        self.perp_engine = config_parse.get('perp', 'perp_engine',
+                                            fallback='real')
+        if self.perp_engine not in ['real', 'spectral']:
+            raise ValueError('perp_engine must be one of (real, spectral)')
+        if self.perp_engine == 'spectral' and self.domain == 'middle':
+            warnings.warn('perp_engine = spectral calculates the correlation '
+                          'functions of the full domain, not of the middle '
+                          'box. Changing to real.')
+            self.perp_engine = 'real'
+        if self.perp_engine == 'spectral' and self.cache_dir is not None:
+            warnings.warn('perp_engine = spectral needs the Fourier space '
+                          'field, which is not cached. Not using cache_dir.')
+            self.cache_dir = None
+
         perp_guess = str(config_parse.get('perp',
                                           'perp_guess', fallback='[0.05,0.1,1]'))
         perp_guess = perp_guess[1:-1].split(',')
@@ -382,6 +544,17 @@ class Simulation(object):
         self.time_max = float(config_parse.get('time',
                                                'time_max', fallback=1))
 
+        self.time_corr_full = config_parse.getboolean('time', 'time_corr_full',
+                                                      fallback=False)
+
+        self.time_fit_polish = int(config_parse.get('time', 'time_fit_polish',
+                                                    fallback=20))
+
+        self.time_corr_method = config_parse.get('time', 'time_corr_method',
+                                                 fallback='fft')
+        if self.time_corr_method not in ['fft', 'binned']:
+            raise ValueError('time_corr_method must be one of (fft, binned)')
+
         ################
         # Par Namelist #
         ################
@@ -391,6 +564,9 @@ class Simulation(object):
         self.par_guess = self.par_guess[1:-1].split(',')
         self.par_guess = [float(s) for s in self.par_guess]
 
+        self.par_stream = config_parse.getboolean('par', 'par_stream',
+                                                  fallback=False)
+
         ###################
         # Output Namelist #
         ###################
@@ -400,38 +576,58 @@ class Simulation(object):
         self.write_field_interp_x = config_parse.getboolean('output',
                                                          'write_field_interp_x',
                                                          fallback=True)
+        self.write_field_chunks = config_parse.get('output',
+                                                   'write_field_chunks',
+                                                   fallback='contiguous')
+        if self.write_field_chunks not in ['contiguous', 'frame', 'series']:
+            raise ValueError('write_field_chunks must be one of (contiguous, '
+                             'frame, series)')
+        self.write_field_zlib = config_parse.getboolean('output',
+                                                        'write_field_zlib',
+                                                        fallback=False)
+        self.write_field_complevel = int(config_parse.get('output',
+                                                          'write_field_complevel',
+                                                          fallback=4))
+        self.write_field_precision = config_parse.get('output',
+                                                      'write_field_precision',
+                                                      fallback='double')
+        if self.write_field_precision not in ['single', 'double']:
+            raise ValueError('write_field_precision must be one of (single, '
+                             'double)')
 
         # Log the variables
         logging.info('The following values were read from ' + self.config_file)
         logging.info(vars(self))
         logging.info('Finished read_config.')
 
-    def extract_input_file(self):
+    def extract_input_file(self, ncfile):
         """
         Extract input file from cdf_file.
+
+        Parameters
+        ----------
+        ncfile : object
+            Open NetCDF4 Dataset of the GS2 run.
+
+        Returns
+        -------
+        input_file : str
+            Contents of the GS2 input file.
+
+        Notes
+        -----
+
+        GS2 stores the input file as a character array in which new lines are
+        written as literal '\\n' sequences, so these simply need to be
+        converted back to new lines.
         """
-        # Extract input file from NetCDf file.
-        # Taken from extract_input_file in the GS2 scripts folder:
-        #1: Get the input_file variable from the netcdf file
-        #2: Only print lines between '${VAR} = "' and '" ;'
-        #   (i.e. ignore header and footer)
-        #3: Convert \\n to new lines
-        #4: Delete empty lines
-        #5: Ignore first line
-        #6: Ignore last line
-        #7: Fix " style quotes
-        #8: Fix ' style quotes
-        bash_extract_input = (""" ncdump -v input_file ${FILE} | """ +
-                          """ sed -n '/input_file = /,/" ;/p' | """ +
-                          """ sed 's|\\\\\\\\n|\\n|g' | """ +
-                          """ sed '/^ *$/d' | """ +
-                          """ tail -n+2 | """ +
-                          """ head -n-2 | """ +
-                          """ sed 's|\\\\\\"|\\"|g' | """ +
-                          """ sed "s|\\\\\\'|\\'|g" """)
-        os.system('FILE=' + self.cdf_file + '; ' +
-                  bash_extract_input + ' > ' +
-                  self.run_folder + 'input_file.in')
+        try:
+            input_file = np.array(ncfile.variables['input_file'][:])
+        except KeyError:
+            raise NameError('Could not extract input file from NetCDF file. '
+                            'Make sure GS2 is using new diagnostic output.')
+
+        return input_file.tobytes().decode().replace('\\n', '\n')
 
     def config_checks(self):
         """
@@ -456,6 +652,48 @@ class Simulation(object):
             warnings.warn('Not transforming to lab frame, but time_interp_fac > 1. '
                           'This is probably not needed.')
 
+        if self.max_chunk_mem is not None and self.time_interp_method != 'linear':
+            warnings.warn('time_interp_method = ' + self.time_interp_method +
+                          ' needs the whole time series but the field is '
+                          'being read in chunks. Changing to linear.')
+            self.time_interp_method = 'linear'
+
+        if self.cache_dir is not None and self.time_interp_method == 'fft':
+            warnings.warn('time_interp_method = fft does not interpolate onto '
+                          'the time grid of the streamed field used with '
+                          'cache_dir. Changing to linear.')
+            self.time_interp_method = 'linear'
+
+        if self.lab_frame_method == 'window' and (
+                not self.lab_frame or self.analysis != 'time' or
+                self.max_chunk_mem is not None or self.cache_dir is not None):
+            warnings.warn('lab_frame_method = window is only used for the '
+                          'lab frame time analysis without max_chunk_mem or '
+                          'cache_dir. Changing to field.')
+            self.lab_frame_method = 'field'
+
+        if self.lab_frame_method == 'window' and \
+                self.time_interp_method != 'linear':
+            warnings.warn('time_interp_method = ' + self.time_interp_method +
+                          ' needs the whole time series but the lab frame '
+                          'is calculated for each time slice. Changing to '
+                          'linear.')
+            self.time_interp_method = 'linear'
+
+        dt = np.diff(self.t)
+        regular_t = len(dt) == 0 or np.allclose(dt, dt[0], rtol=1e-6)
+        if (self.time_corr_method == 'fft' and not regular_t and
+                not (self.time_interpolate_bool or self.lab_frame)):
+            warnings.warn('The time grid is not regular, but time_interpolate '
+                          '= False and time_corr_method = fft, which assumes '
+                          'a regular grid. Use time_corr_method = binned.')
+
+        if (self.time_corr_method == 'binned' and
+                self.time_interpolate_bool and not self.lab_frame):
+            warnings.warn('time_corr_method = binned does not need a regular '
+                          'time grid. Set time_interpolate = False to avoid '
+                          'interpolating the field.')
+
         if self.theta_idx == None and self.in_field[-2:] == '_t':
             raise ValueError('You have specified a field with theta info but '
                              'left theta_idx=None. Specify theta_idx as -1 '
@@ -487,31 +725,24 @@ class Simulation(object):
           usual loops in theta to be kept but have no effect. If only one
           element in dimension initialization will be performed regardless,
           however dimension will be removed for perp and time analysis.
+        * If *max_chunk_mem* or *cache_dir* is set, only the first time step
+          of the field is read here in order to determine its shape. The full
+          field is then read in time chunks by ``read_netcdf_chunks``, if
+          needed.
         """
         logging.info('Start reading from NetCDf file...')
 
         with Dataset(self.cdf_file, 'r') as ncfile:
 
-            # NetCDF order is [t, species, ky, kx, theta, r]
-            if self.theta_idx == None:
-                self.field = np.array(ncfile.variables[self.in_field]
-                                        [self.time_range[0]:self.time_range[1],
-                                         self.spec_idx,:,:,:])
+            if self.max_chunk_mem is None and self.cache_dir is None:
+                self.field = self.read_field_slice(ncfile, self.time_range[0],
+                                                   self.time_range[1])
             else:
-                self.field = np.array(ncfile.variables[self.in_field]
-                                        [self.time_range[0]:self.time_range[1],
-                                         self.spec_idx,:,:,
-                                         self.theta_idx[0]:self.theta_idx[1],
-                                         :])
+                self.field = self.read_field_slice(ncfile, self.time_range[0],
+                                                   self.time_range[0]+1)
             self.t = np.array(ncfile.variables['t'][self.time_range[0]:
                                                          self.time_range[1]])
 
-
-            self.field = np.squeeze(self.field)
-            self.field = np.swapaxes(self.field, 1, 2)
-            if len(self.field.shape) < 5:
-                self.field = self.field[:,:,:,np.newaxis,:]
-
             self.drho_dpsi = float(ncfile.variables['drhodpsi'][:])
             self.kx = np.array(ncfile.variables['kx'][:])/self.drho_dpsi
             self.ky = np.array(ncfile.variables['ky'][:])/self.drho_dpsi
@@ -525,6 +756,274 @@ class Simulation(object):
 
         logging.info('Finished reading from NetCDf file.')
 
+    def read_field_slice(self, ncfile, t_min, t_max):
+        """
+        Read the time indices [t_min, t_max) of the field from an open NetCDF
+        file.
+
+        Parameters
+        ----------
+        ncfile : object
+            Open NetCDF4 Dataset containing *in_field*.
+        t_min, t_max : int or None
+            Time index range to read, relative to the start of the file.
+
+        Returns
+        -------
+        field : array_like
+            Field in the format field[t, kx, ky, theta, ri].
+        """
+        # NetCDF order is [t, species, ky, kx, theta, r]
+        var = ncfile.variables[self.in_field]
+        var.set_auto_mask(False)
+        if self.theta_idx == None:
+            field = np.asarray(var[t_min:t_max, self.spec_idx,:,:,:],
+                               dtype=self.real_dtype)
+        else:
+            field = np.asarray(var[t_min:t_max, self.spec_idx,:,:,
+                                   self.theta_idx[0]:self.theta_idx[1], :],
+                               dtype=self.real_dtype)
+
+        # Squeezing, swapping and adding axes only creates views of the array
+        # read from the file. Never squeeze the time axis since a chunk may
+        # be a single time step.
+        field = np.squeeze(field, axis=tuple(i for i in range(1, field.ndim)
+                                             if field.shape[i] == 1))
+        field = np.swapaxes(field, 1, 2)
+        if len(field.shape) < 5:
+            field = field[:,:,:,np.newaxis,:]
+
+        return field
+
+    def chunk_size(self):
+        """
+        Number of output time steps processed per chunk when streaming.
+
+        The estimate includes the raw NetCDF slice (viewed as complex), the
+        interpolated field, the transform input buffer and the full real space
+        transform output for every time step.
+        """
+        ny_full = 2*(self.nky - 1)
+        itemsize = np.dtype(self.real_dtype).itemsize
+        bytes_per_step = self.nkx*self.nky*self.ntheta*3*2*itemsize + \
+                         self.nkx*ny_full*self.ntheta*itemsize
+        return max(1, int(self.max_chunk_mem*1024**2/bytes_per_step))
+
+    def read_netcdf_chunks(self, t_out=None):
+        """
+        Generator which reads the field from the NetCDF file in time chunks.
+
+        Parameters
+        ----------
+        t_out : array_like, optional
+            Output time grid. Each chunk contains the NetCDF time steps needed
+            to cover (and interpolate onto) *chunk_size* points of *t_out*.
+            If None, the NetCDF time steps themselves are the output grid.
+
+        Yields
+        ------
+        out_idx : slice
+            Indices of *t_out* covered by the chunk.
+        field : array_like
+            Field chunk in the same format as returned by ``read_field_slice``.
+        t : array_like
+            Times of the NetCDF time steps in the chunk.
+        """
+        t_in = self.t
+        nt_in = len(t_in)
+        nt_out = nt_in if t_out is None else len(t_out)
+        if self.max_chunk_mem is None:
+            n_chunk = nt_out
+        else:
+            n_chunk = self.chunk_size()
+
+        with Dataset(self.cdf_file, 'r') as ncfile:
+            for j_min in range(0, nt_out, n_chunk):
+                j_max = min(j_min + n_chunk, nt_out)
+
+                if t_out is None:
+                    i_min, i_max = j_min, j_max
+                else:
+                    # Bracket the output times with at least two time steps
+                    i_min = max(np.searchsorted(t_in, t_out[j_min], 'right')-1,
+                                0)
+                    i_max = min(np.searchsorted(t_in, t_out[j_max-1],
+                                                'left')+1, nt_in)
+                    if i_max - i_min < 2 and nt_in > 1:
+                        i_max = min(i_min + 2, nt_in)
+                        i_min = i_max - 2
+
+                field = self.read_field_slice(ncfile,
+                                              self.time_range[0] + i_min,
+                                              self.time_range[0] + i_max)
+
+                yield slice(j_min, j_max), field, t_in[i_min:i_max]
+
+    def stream_real_space(self):
+        """
+        Calculates the real space field by streaming the NetCDF field in time
+        chunks.
+
+        Each chunk is read, converted to complex, interpolated in time,
+        filtered, transformed to the lab frame and real space, and reduced in
+        size before being stored. Peak memory is
+        therefore set by *max_chunk_mem* and the size of the final real space
+        field, and not by the length of *time_range*.
+
+        Notes
+        -----
+
+        * The real space grid (domain reduction and odd points) is determined
+          before streaming by running ``domain_reduce`` and ``field_odd_pts``
+          on an empty field, so that ``field_to_real_space`` only evaluates
+          the points which are kept.
+        * The Fourier space field is not kept and ``field`` is set to None.
+        * If *perp_engine* is 'spectral', the power spectra of
+          ``perp_spectra`` are calculated for each chunk, and if *analysis*
+          is 'perp' the real space field is not calculated at all.
+        """
+        logging.info('Streaming real space field in time chunks...')
+
+        interpolate = self.time_interpolate_bool or self.lab_frame
+        if interpolate:
+            t_out = np.linspace(min(self.t), max(self.t),
+                                self.time_interp_fac*self.nt)
+        else:
+            t_out = self.t
+
+        self.box_idx = [0, 0]
+        if self.domain == 'middle':
+            self.domain_reduce()
+        self.field_real_space = np.empty([0, self.nx, self.ny, self.ntheta])
+        self.field_odd_pts()
+
+        spectral = self.use_perp_spectra()
+        real_space = not (spectral and self.analysis == 'perp')
+        field_real_space = np.empty([len(t_out) if real_space else 0, self.nx,
+                                     self.ny, self.ntheta],
+                                    dtype=self.real_dtype)
+        if spectral:
+            self.perp_power_x = np.empty([len(t_out), self.nkx])
+            self.perp_power_y = np.empty([len(t_out), self.nky])
+
+        t_in = self.t
+        for out_idx, field, t in self.read_netcdf_chunks(t_out if interpolate
+                                                         else None):
+            self.field = field
+            self.t = t
+            self.field_to_complex()
+            if interpolate:
+                self.time_interpolate(t_out[out_idx])
+            if self.zero_bes_scales_bool:
+                self.zero_bes_scales()
+            if self.zero_zf_scales_bool:
+                self.zero_zf_scales()
+            if self.lab_frame:
+                self.to_lab_frame()
+            if spectral:
+                self.perp_power_x[out_idx], self.perp_power_y[out_idx] = \
+                        self.perp_spectra()
+            if real_space:
+                self.field_to_real_space()
+                field_real_space[out_idx] = self.field_real_space
+            self.t = t_in
+
+        self.field = None
+        self.field_real_space = field_real_space
+        self.t = t_out
+        self.nt = len(self.t)
+
+        logging.info('Finished streaming real space field.')
+
+    def cache_key(self):
+        """
+        Hash identifying the real space field in the cache.
+
+        The key is built from the identity (path, size and modification time)
+        of the NetCDF and geometry files as well as every configuration
+        parameter which affects the calculation of the real space field.
+        """
+        files = {}
+        for f in [self.cdf_file, self.g_file]:
+            stat = os.stat(f)
+            files[os.path.abspath(f)] = [stat.st_size, stat.st_mtime_ns]
+
+        key = {'cache_version': 1,
+               'files': files,
+               'in_field': self.in_field,
+               'spec_idx': self.spec_idx,
+               'theta_idx': self.theta_idx,
+               'time_range': self.time_range,
+               'time_interpolate': self.time_interpolate_bool,
+               'time_interp_fac': self.time_interp_fac,
+               'time_interp_method': self.time_interp_method,
+               'zero_bes_scales': self.zero_bes_scales_bool,
+               'zero_zf_scales': self.zero_zf_scales_bool,
+               'lab_frame': self.lab_frame,
+               'precision': self.precision,
+               'domain': self.domain,
+               'box_size': list(self.box_size),
+               'normalization': [self.amin, self.bref, self.dpsi_da,
+                                 self.omega, self.rho_ref, self.rho_tor,
+                                 self.vth]}
+
+        return hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+    def save_cache(self):
+        """
+        Writes the real space field and its coordinates to *cache_path*.
+
+        The field is saved in the NumPy '.npy' format so that it can be memory
+        mapped when loaded. The cache is written to a temporary directory
+        first and then renamed, so that an interrupted run never leaves an
+        incomplete cache behind.
+        """
+        logging.info('Writing real space field to cache ' + self.cache_path)
+
+        self.calculate_l_par()
+
+        tmp_path = self.cache_path + '.tmp' + str(os.getpid())
+        os.makedirs(tmp_path, exist_ok=True)
+        np.save(os.path.join(tmp_path, 'field_real_space.npy'),
+                self.field_real_space)
+        np.savez(os.path.join(tmp_path, 'coords.npz'), t=self.t, x=self.x,
+                 y=self.y, dx=self.dx, dy=self.dy, l_par=self.l_par)
+        try:
+            os.rename(tmp_path, self.cache_path)
+        except OSError:
+            # Another run has written the same cache in the meantime
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+        logging.info('Finished writing cache.')
+
+    def load_cache(self):
+        """
+        Memory maps the real space field and reads its coordinates from
+        *cache_path*.
+
+        The field is mapped copy-on-write, so it is read lazily from disk and
+        in place modifications never change the cache.
+        """
+        logging.info('Loading real space field from cache ' + self.cache_path)
+
+        self.field = None
+        self.field_real_space = np.load(os.path.join(self.cache_path,
+                                                     'field_real_space.npy'),
+                                        mmap_mode='c')
+        with np.load(os.path.join(self.cache_path, 'coords.npz')) as coords:
+            self.t = coords['t']
+            self.x = coords['x']
+            self.y = coords['y']
+            self.dx = coords['dx']
+            self.dy = coords['dy']
+            self.l_par = coords['l_par']
+
+        self.nt = len(self.t)
+        self.nx = len(self.x)
+        self.ny = len(self.y)
+
+        logging.info('Finished loading cache.')
+
     def read_geometry_file(self):
         """
         Read the geometry file for the GS2 run.
@@ -537,11 +1036,13 @@ class Simulation(object):
 
     def read_input_file(self):
         """
-        Read the input '.inp' file for the GS2 run.
+        Read the GS2 input file stored in the NetCDF file and parse it with
+        f90nml.
         """
         logging.info('Reading input file...')
 
-        self.input_file = nml.read(self.in_file)
+        with Dataset(self.in_file, 'r') as ncfile:
+            self.input_file = nml.reads(self.extract_input_file(ncfile))
 
         self.r_geo = self.input_file['theta_grid_parameters']['R_geo']*self.amin
         self.rhoc = float(self.input_file['theta_grid_parameters']['rhoc'])
@@ -560,12 +1061,31 @@ class Simulation(object):
 
         * ri = 0 - Real part of the field.
         * ri = 1 - Imaginary part of the field.
+
+        The complex field has the data type set by *precision*. If the field
+        is C-contiguous, it is reinterpreted as complex without copying.
+        Otherwise, e.g. for the swapped axes returned by
+        ``read_field_slice``, it is copied, since older NumPy versions only
+        allow views with a different item size of C-contiguous arrays.
         """
-        self.field = self.field[:,:,:,:,0] + 1j*self.field[:,:,:,:,1]
+        if (self.field.dtype == self.real_dtype and
+                self.field.flags.c_contiguous):
+            self.field = self.field.view(self.complex_dtype)[...,0]
+        else:
+            field = np.empty(self.field.shape[:-1], dtype=self.complex_dtype)
+            field.real = self.field[:,:,:,:,0]
+            field.imag = self.field[:,:,:,:,1]
+            self.field = field
 
     def fourier_correction(self):
         """
-        Correction to GS2s Fourier components to regular Fourier components.
+        Factor correcting GS2s Fourier components to regular Fourier
+        components.
+
+        Returns
+        -------
+        corr : array_like
+            Correction factor for each ky.
 
         Notes
         -----
@@ -577,11 +1097,17 @@ class Simulation(object):
         G_k = {g_k for ky = 0, 2g_k for ky > 0}
 
         Therfore converting to regular fourier components simply means dividing
-        all non-zonal components by 2.
+        all non-zonal components by 2. Since every step up to the transform
+        to real space is linear in the field, the correction is applied by
+        ``field_to_real_space`` as part of its input scaling, instead of as a
+        separate pass over the field.
         """
-        self.field[:,:,1:,:] = self.field[:,:,1:,:]/2
+        corr = np.full(self.nky, 0.5)
+        corr[0] = 1
+
+        return corr
 
-    def time_interpolate(self):
+    def time_interpolate(self, t_reg=None):
         """
         Interpolates in time onto a regular grid
 
@@ -589,23 +1115,69 @@ class Simulation(object):
         is interpolated into a regular grid. This is required in order to do
         FFTs in time. Interpolation is done by default if not specified.
         time_interp_fac sets the multiple of interpolation.
+
+        Parameters
+        ----------
+        t_reg : array_like, optional
+            Time grid to interpolate onto. Must lie within the range of *t*.
+            By default a regular grid of time_interp_fac*nt points spanning
+            *t* is used.
+
+        Notes
+        -----
+
+        All modes are interpolated at once along the time axis. The method is
+        set by *time_interp_method*:
+
+        * 'linear' - The bracketing time indices and weights are calculated
+          once and shared by all modes.
+        * 'cubic' - A single cubic spline is fitted along the time axis of the
+          whole field.
+        * 'fft' - Band-limited interpolation by zero padding the spectrum of
+          each mode's time signal. This requires the NetCDF time grid to be
+          regular (otherwise linear interpolation is used) and assumes the
+          signal is periodic in the time window. The field is interpolated
+          onto a grid with spacing dt/time_interp_fac, i.e. with
+          time_interp_fac*(nt-1)+1 points, and *t_reg* is not used.
         """
         logging.info('Started interpolating onto a regular time grid...')
 
-        t_reg = np.linspace(min(self.t), max(self.t), self.time_interp_fac*self.nt)
-        tmp_field = np.empty([self.time_interp_fac*self.nt, self.nkx, self.nky,
-                              self.ntheta], dtype=complex)
-        for ikx in range(self.nkx):
-            for iky in range(self.nky):
-                for ith in range(self.ntheta):
-                    f = interp.interp1d(self.t, self.field[:, ikx, iky, ith])
-                    tmp_field[:, ikx, iky, ith] = f(t_reg)
+        if t_reg is None:
+            t_reg = np.linspace(min(self.t), max(self.t),
+                                self.time_interp_fac*self.nt)
+
+        method = self.time_interp_method
+        dt = np.diff(self.t)
+        if method == 'fft' and not np.allclose(dt, dt[0], rtol=1e-6):
+            warnings.warn('time_interp_method = fft requires a regular time '
+                          'grid, using linear interpolation instead.')
+            method = 'linear'
+
+        if method == 'linear':
+            idx = np.searchsorted(self.t, t_reg, side='right') - 1
+            idx = np.clip(idx, 0, len(self.t) - 2)
+            weight = ((t_reg - self.t[idx]) / dt[idx]).astype(self.real_dtype)
+            weight = weight[:,np.newaxis,np.newaxis,np.newaxis]
+
+            tmp_field = self.field[idx]
+            tmp_field *= 1 - weight
+            tmp_field += weight*self.field[idx+1]
+        elif method == 'cubic':
+            tmp_field = interp.CubicSpline(self.t, self.field, axis=0)(t_reg)
+        elif method == 'fft':
+            # Zero padding the spectrum gives the field every dt/time_interp_fac
+            # over one period, so drop the points beyond the final time.
+            nt = len(self.t)
+            nt_reg = self.time_interp_fac*(nt - 1) + 1
+            tmp_field = sig.resample(self.field, self.time_interp_fac*nt,
+                                     axis=0)[:nt_reg]
+            t_reg = self.t[0] + np.arange(nt_reg)*dt[0]/self.time_interp_fac
+
         self.t = t_reg
         self.nt = len(self.t)
-        self.field = tmp_field
+        self.field = tmp_field.astype(self.complex_dtype, copy=False)
 
         tmp_field = None
-        f = None
         gc.collect()
 
         logging.info('Finished interpolating onto a regular time grid.')
@@ -645,13 +1217,65 @@ class Simulation(object):
         .. [1] C. M. Roach, "Equilibrium flow shear implementation in GS2",
                http://gyrokinetics.sourceforge.net/wiki/index.php/Documents,
                http://svn.code.sf.net/p/gyrokinetics/code/wikifiles/CMR/ExB_GS2.pdf
+
+        The phase exp(i n0 iy omega t) only depends on t and ky, so it is
+        calculated once as a (t, ky) array and broadcast over kx and theta
+        while multiplying the field in place. A real field is converted to
+        *complex_dtype* first, so that no part of the product is discarded.
         """
-        for ix in range(self.nkx):
-            for iy in range(self.nky):
-                for ith in range(self.ntheta):
-                    self.field[:,ix,iy,ith] = self.field[:,ix,iy,ith] * \
-                                              np.exp(1j * self.n0 * iy *
-                                                     self.omega * self.t)
+        if not np.iscomplexobj(self.field):
+            self.field = self.field.astype(self.complex_dtype)
+
+        iky = np.arange(self.field.shape[2])
+        phase = np.exp(1j*self.n0*self.omega*np.outer(self.t, iky))
+        phase = phase.astype(self.field.dtype)
+        np.multiply(self.field, phase[:,np.newaxis,:,np.newaxis],
+                    out=self.field)
+
+    def lab_frame_window(self, it):
+        """
+        Calculates the real space field of time slice *it* in the lab frame,
+        when *lab_frame_method* is 'window'.
+
+        Parameters
+        ----------
+
+        it : int
+            Index of the time slice.
+
+        Returns
+        -------
+        field_window : array_like
+            Real space field in the lab frame as a function of (t, x, y) at
+            the times of the time slice.
+
+        Notes
+        -----
+
+        The Fourier space field is kept in the plasma frame at the NetCDF
+        time steps *t_field*. For each time slice it is interpolated onto the
+        times of the slice, transformed to the lab frame and then to real
+        space, so the field interpolated by *time_interp_fac* and its real
+        space transform are never stored for all times. Since interpolation,
+        zeroing scales and the lab frame phase are all done mode by mode,
+        the result is the same as for *lab_frame_method* = 'field'.
+        """
+        field = self.field
+        field_real_space = self.field_real_space
+        t = self.t
+
+        self.t = self.t_field
+        self.time_interpolate(t[it*self.time_slice:(it+1)*self.time_slice])
+        self.to_lab_frame()
+        self.field_to_real_space()
+        field_window = np.array(self.field_real_space[:,:,:,0])
+
+        self.field = field
+        self.field_real_space = field_real_space
+        self.t = t
+        self.nt = len(t)
+
+        return field_window
 
     def field_to_real_space(self):
         """
@@ -664,28 +1288,90 @@ class Simulation(object):
           normalization by multiplying by the size of the arrays.
         * GS2 fluctuations are O(rho_star) and must be multiplied by rho_star
           to get their true values.
+        * The field is rolled by nx/2 in x, which is done by a phase ramp in
+          kx.
+        * The Fourier correction, phase ramp and normalization are combined
+          into one weight which multiplies the field as it is copied into the
+          transform buffer, so the field is only passed over once.
         * In order to avoid memory overloads, the fourier space field is
           cleared after the real space field is calculated.
+        * The transform uses the cached plans of ``fft_backend``, so
+          transforming time chunks of the same size only plans once. The
+          real space field is a view of the output buffer of the plan and is
+          overwritten by the next transform of the same shape.
+        * Only the *nx* x *ny* box starting at *box_idx* of the full real
+          space grid is returned. If domain is 'middle' this box is evaluated
+          directly by ``field_to_real_space_box``.
         """
         logging.info('Calculating real space field...')
 
-        self.field_real_space = np.empty([self.nt,self.nx,self.ny,self.ntheta],
-                                         dtype=float)
-        pyfftw.n_byte_align(self.field, 16)
-        self.field_real_space = pyfftw.interfaces.numpy_fft.irfft2(self.field,
-                                                                   axes=[1,2])
+        if self.domain == 'middle':
+            self.field_to_real_space_box()
+        else:
+            # Use the full grid size since nx, ny may already describe the
+            # odd point domain when streaming
+            nx = self.nkx
+            ny = 2*(self.nky - 1)
+
+            ramp = np.exp(-2j*np.pi*np.arange(self.nkx)*int(nx/2)/nx)
+            weight = np.outer(ramp, self.fourier_correction())*nx*ny* \
+                     self.rho_star
+            weight = weight.astype(self.complex_dtype)[np.newaxis,:,:,
+                                                       np.newaxis]
+
+            field_real_space = fft_backend.irfftn(self.field, axes=(1,2),
+                                                  weight=weight)
+            self.field_real_space = field_real_space[
+                    :, self.box_idx[0]:self.box_idx[0]+self.nx,
+                    self.box_idx[1]:self.box_idx[1]+self.ny, :]
 
         if self.analysis == 'par' or self.analysis == 'write_field_full':
             self.field = None
             gc.collect()
 
-        self.field_real_space = np.roll(self.field_real_space,
-                                                int(self.nx/2), axis=1)
+        logging.info('Finished calculating real space field.')
 
-        self.field_real_space = self.field_real_space*self.nx*self.ny
-        self.field_real_space = self.field_real_space*self.rho_star
+    def field_to_real_space_box(self):
+        """
+        Evaluates the real space field only on the *nx* x *ny* box starting
+        at *box_idx*, without transforming the full domain.
 
-        logging.info('Finished calculating real space field.')
+        Notes
+        -----
+
+        The inverse transform is written as two partial DFTs, done as matrix
+        products:
+
+        * along x, a complex DFT onto the kept (rolled) x indices, and
+        * along y, a DFT onto the kept y indices, with the ky > 0 modes
+          weighted by 2 (except the Nyquist mode) and the real part taken.
+          This is identical to the Hermitian inverse transform done by
+          ``irfftn``. The Fourier correction is folded into these weights.
+
+        The cost is O(nt*nkx*nky*nx) + O(nt*nky*nx*ny) and the memory
+        O(nt*nky*nx) for the reduced *nx*, *ny*, compared with the
+        O(nt*nkx*ny_full*log(nkx*ny_full)) transform of the full domain.
+        The normalization is the same as for ``field_to_real_space``.
+        """
+        nx_full = self.nkx
+        ny_full = 2*(self.nky - 1)
+
+        ix = (self.box_idx[0] + np.arange(self.nx) - int(nx_full/2)) % nx_full
+        iy = self.box_idx[1] + np.arange(self.ny)
+        dft_x = np.exp(2j*np.pi*np.outer(ix, np.arange(self.nkx))/nx_full)
+        dft_y = np.exp(2j*np.pi*np.outer(np.arange(self.nky), iy)/ny_full)
+        dft_y[1:self.nky-1,:] *= 2
+        dft_y *= (self.fourier_correction()*self.rho_star)[:,np.newaxis]
+        dft_x = dft_x.astype(self.complex_dtype)
+        dft_y = dft_y.astype(self.complex_dtype)
+
+        # field[t,kx,ky,theta] -> [t,theta,kx,ky] so that matmul is batched
+        # over t and theta
+        field = np.moveaxis(self.field, 3, 1)
+        field = np.matmul(dft_x, field)
+        field = np.matmul(field, dft_y).real
+
+        self.field_real_space = np.ascontiguousarray(np.moveaxis(field, 1, 3))
 
     def domain_reduce(self):
         """
@@ -694,8 +1380,11 @@ class Simulation(object):
         * Calculating radial and poloidal coordinates r, z.
         * Using input parameter *box_size* to determine the index range to
           perform the correlation analysis on.
-        * Reduce extent of real space field using this index.
+        * Storing the start of this index range in *box_idx*.
         * Recalculate some real space arrays such as x, y, dx, dy, etc.
+
+        This is called before ``field_to_real_space``, which then only
+        calculates the real space field in the reduced domain.
         """
         logging.info('Reducing domain size to %f x %f m'%(self.box_size[0],
                                                           self.box_size[1]))
@@ -718,11 +1407,9 @@ class Simulation(object):
         z_box_idx = z_min_idx-int(self.ny/2) + 1
 
         # Reduce extent
+        self.box_idx = [int(self.nx/2)-r_box_idx+1, int(self.ny/2)-z_box_idx+1]
         self.r = self.r[int(self.nx/2)-r_box_idx+1:int(self.nx/2)+r_box_idx]
         self.z = self.z[int(self.ny/2)-z_box_idx+1:int(self.ny/2)+z_box_idx]
-        self.field_real_space = self.field_real_space[
-                :,int(self.nx/2)-r_box_idx+1:int(self.nx/2)+r_box_idx,
-                int(self.ny/2)-z_box_idx+1:int(self.ny/2)+z_box_idx,:]
 
         # Recalculate real space arrays
         self.nx = len(self.r)
@@ -761,6 +1448,150 @@ class Simulation(object):
         self.dx = np.linspace(-self.x[-1]/2, self.x[-1]/2, self.nx)
         self.dy = np.linspace(-self.y[-1]/2, self.y[-1]/2, self.ny)
 
+    def run_analysis(self):
+        """
+        Runs the analysis specified by *analysis* in the configuration file.
+
+        For *analysis* = 'all', the perpendicular analysis, time analysis and
+        write_field are run by ``run_stages``. If *profile* is True, the
+        profile is written afterwards by ``write_profile``.
+        """
+        if self.analysis == 'all':
+            self.run_stages(['perp_analysis', 'time_analysis', 'write_field'])
+        elif self.analysis == 'perp':
+            self.perp_analysis()
+        elif self.analysis == 'time':
+            self.time_analysis()
+        elif self.analysis == 'par':
+            self.par_analysis()
+        elif self.analysis == 'write_field':
+            self.write_field()
+        elif self.analysis == 'write_field_full':
+            self.write_field_full()
+
+        if self.profiler is not None:
+            self.write_profile()
+
+    def write_profile(self):
+        """
+        Writes the profile of the stages run so far to 'profile.json' in
+        *out_dir*.
+
+        For each stage, the report contains the number of calls, the wall and
+        CPU times in seconds, the CPU time of the finished child processes
+        (e.g. the fit workers), the peak RSS of the process at the end of the
+        stage and its growth during the stage, the change of the current RSS,
+        and the peak and net memory allocated by the stage in MB, see
+        ``profiling.Profiler``. Memory tracing is stopped afterwards.
+        """
+        profile_file = self.out_dir + '/profile.json'
+        self.profiler.write(profile_file, config_file=self.config_file,
+                            analysis=self.analysis,
+                            field_shape=[self.nt, self.nx, self.ny,
+                                         self.ntheta],
+                            time_slice=self.time_slice,
+                            fft_threads=self.fft_threads,
+                            fit_workers=self.fit_workers,
+                            stage_workers=self.stage_workers)
+        self.profiler.close()
+        logging.info('Written profile to ' + profile_file)
+
+    def run_stages(self, stages):
+        """
+        Runs several analyses on the real space field, at the same time if
+        *stage_workers* > 1.
+
+        Parameters
+        ----------
+
+        stages : list
+            Names of the analysis methods to run, e.g. ['perp_analysis',
+            'time_analysis', 'write_field'].
+
+        Notes
+        -----
+
+        * The real space field is calculated once when the object is
+          initialized and is made read-only while the stages run, so that no
+          stage can change the field seen by another.
+        * If *stage_workers* > 1, up to *stage_workers* stages run at the same
+          time, each in a process forked from this one. The forked processes
+          share the memory of the field and of the rest of the object with
+          this process, so nothing is copied or pickled. The stages only
+          communicate through the output directory, so the attributes they
+          set (e.g. ``perp_fit_x``) are not available in this process. The
+          profile of each stage is passed back in the same way, see
+          ``run_stage_process``.
+        * A RuntimeError is raised after all stages have finished if any of
+          them failed.
+        """
+        writeable = self.field_real_space.flags.writeable
+        self.field_real_space.flags.writeable = False
+
+        try:
+            if self.stage_workers <= 1:
+                for stage in stages:
+                    getattr(self, stage)()
+                return
+
+            ctx = multiprocessing.get_context('fork')
+            pending = list(stages)
+            running = {}
+            failed = []
+            while pending or running:
+                while pending and len(running) < self.stage_workers:
+                    stage = pending.pop(0)
+                    proc = ctx.Process(target=self.run_stage_process,
+                                       args=(stage,), name=stage)
+                    proc.start()
+                    running[proc.sentinel] = proc
+                    logging.info('Started ' + stage + ' in process ' +
+                                 str(proc.pid))
+
+                for sentinel in multiprocessing.connection.wait(running):
+                    proc = running.pop(sentinel)
+                    proc.join()
+                    if proc.exitcode != 0:
+                        failed.append(proc.name)
+                    profile_file = self.stage_profile_file(proc.name)
+                    if self.profiler is not None and \
+                            os.path.exists(profile_file):
+                        self.profiler.load(profile_file)
+                    logging.info('Finished ' + proc.name + ' with exit code ' +
+                                 str(proc.exitcode))
+
+            if failed:
+                raise RuntimeError('The following analyses failed: ' +
+                                   ', '.join(failed))
+        finally:
+            self.field_real_space.flags.writeable = writeable
+
+    def run_stage_process(self, stage):
+        """
+        Runs the analysis method *stage* in a process forked by
+        ``run_stages``.
+
+        If profiling, the records of the stage are written to the file
+        ``stage_profile_file(stage)``, which ``run_stages`` merges into the
+        profile of the main process.
+        """
+        if self.profiler is None:
+            getattr(self, stage)()
+            return
+
+        self.profiler.records = {}
+        try:
+            getattr(self, stage)()
+        finally:
+            self.profiler.dump(self.stage_profile_file(stage))
+
+    def stage_profile_file(self, stage):
+        """
+        Returns the file the profile of *stage* is passed back in by
+        ``run_stage_process``.
+        """
+        return self.out_dir + '/profile_' + stage + '.json'
+
     def perp_analysis(self):
         """
         Performs a perpendicular correlation analysis on the field.
@@ -771,12 +1602,19 @@ class Simulation(object):
         * Remove theta dimension before doing analysis to avoid pointless code
           which accounts for a theta information. Will produce error if more
           than one element during config_checks.
-        * Uses sig.fftconvolve to calculate the 2D perp correlation function.
+        * Uses batched FFTs to calculate the radial and poloidal correlation
+          functions.
         * Splits correlation function into time slices and fits each time
-          slice with a tilted Gaussian using the perp_fit function.
-        * The fit parameters for the previous time slice is used as the initial
-          guess for the next time slice.
+          slice with a tilted Gaussian using the perp_corr_fit function.
+        * By default, the fit parameters for the previous time slice is used
+          as the initial guess for the next time slice, see ``fit_chain``.
         * Also writes information on the mean fluctuation levels
+        * If *perp_stream* is True, the normalized field and correlation
+          functions are only calculated for one time slice at a time, see
+          ``perp_window_stats``.
+        * If *perp_engine* is 'spectral', the correlation functions are
+          calculated from the power spectra instead, see
+          ``perp_spectral_stats``.
         """
 
         logging.info('Start perpendicular correlation analysis...')
@@ -794,9 +1632,9 @@ class Simulation(object):
         os.system('rm -f ' + self.out_dir + '/' + self.perp_dir + '/corr_fns_x/*')
         os.system('rm -f ' + self.out_dir + '/' + self.perp_dir + '/corr_fns_y/*')
 
-        self.field_normalize_perp()
-        self.calculate_perp_corr()
-        self.perp_norm_mask()
+        if not self.perp_stream and self.perp_engine == 'real':
+            self.field_normalize_perp()
+            self.calculate_perp_corr()
 
         self.perp_fit_x = np.empty([self.nt_slices], dtype=float)
         self.perp_fit_x_err = np.empty([self.nt_slices], dtype=float)
@@ -807,108 +1645,123 @@ class Simulation(object):
             self.perp_fit_ky_err = np.empty([self.nt_slices], dtype=float)
 
         pbar = ProgressBar(widgets=['Progress: ', Percentage(), Bar()])
-        for it in pbar(range(self.nt_slices)):
-            self.perp_corr_fit(it)
+        stats = [self.perp_window_stats(it) for it in
+                 pbar(range(self.nt_slices))]
+        self.perp_corr_fit(stats)
 
         self.perp_analysis_summary()
 
         logging.info('Finished perpendicular correlation analysis.')
 
-    def field_normalize_perp(self):
+    def field_normalize_perp(self, it=None):
         """
         Defines normalized field for the perpandicular correlation by
         subtracting the mean and dividing by the RMS value.
+
+        Parameters
+        ----------
+
+        it : int, optional
+            Index of the time slice to normalize. By default the whole field
+            is normalized.
+
+        The field is normalized along x for the radial correlation and along
+        y for the poloidal correlation, for every (t, y) or (t, x) at once
+        using reductions along that axis of the whole field.
         """
         logging.info('Normalizing the real space field...')
 
-        self.field_real_space_norm_x = \
-                                np.empty([self.nt,self.nx,self.ny],dtype=float)
-        self.field_real_space_norm_y = \
-                                np.empty([self.nt,self.nx,self.ny],dtype=float)
-        for it in range(self.nt):
-            for iy in range(self.ny):
-                self.field_real_space_norm_x[it,:,iy] = \
-                                    self.field_real_space[it,:,iy] - \
-                                    np.mean(self.field_real_space[it,:,iy])
-                self.field_real_space_norm_x[it,:,iy] /= \
-                                    np.std(self.field_real_space_norm_x[it,:,iy])
-
-            for ix in range(self.nx):
-                self.field_real_space_norm_y[it,ix,:] = \
-                                    self.field_real_space[it,ix,:] - \
-                                    np.mean(self.field_real_space[it,ix,:])
-                self.field_real_space_norm_y[it,ix,:] /= \
-                                    np.std(self.field_real_space_norm_y[it,ix,:])
+        if it is None:
+            field = self.field_real_space
+        else:
+            field = self.field_real_space[it*self.time_slice:
+                                          (it+1)*self.time_slice]
+
+        self.field_real_space_norm_x = np.empty(field.shape,
+                                                dtype=self.real_dtype)
+        self.field_real_space_norm_y = np.empty(field.shape,
+                                                dtype=self.real_dtype)
+
+        for axis, field_norm in [(1, self.field_real_space_norm_x),
+                                 (2, self.field_real_space_norm_y)]:
+            np.subtract(field, np.mean(field, axis=axis, keepdims=True),
+                        out=field_norm)
+            field_norm /= np.std(field_norm, axis=axis, keepdims=True)
 
         logging.info('Finished normalizing the real space field.')
 
     def calculate_perp_corr(self):
         """
-        Calculates the perpendicular correlation function from the real space
-        field.
+        Calculates the normalized perpendicular correlation function from the
+        real space field.
+
+        Notes
+        -----
+
+        The radial (poloidal) correlation functions of every t and y (x) are
+        calculated together by ``fft_backend.autocorr_same`` as a single
+        zero padded real FFT along the x (y) axis of the whole field. The
+        lags are centred as for ``sig.correlate`` with mode 'same', and the
+        normalization mask of ``perp_norm_mask`` is applied to the result.
         """
         logging.info("Calculating perpendicular correlation function...")
 
-        self.perp_corr_x = np.empty([self.nt, self.nx, self.ny], dtype=float)
-        self.perp_corr_y = np.empty([self.nt, self.nx, self.ny], dtype=float)
-        for it in range(self.nt):
+        mask_x, mask_y = self.perp_norm_mask()
 
-            for iy in range(self.ny):
-                self.perp_corr_x[it,:,iy] = \
-                            sig.correlate(self.field_real_space_norm_x[it,:,iy],
-                                          self.field_real_space_norm_x[it,:,iy],
-                                          mode='same')
-
-            for ix in range(self.nx):
-                self.perp_corr_y[it,ix,:] = \
-                            sig.correlate(self.field_real_space_norm_y[it,ix,:],
-                                          self.field_real_space_norm_y[it,ix,:],
-                                          mode='same')
+        self.perp_corr_x = fft_backend.autocorr_same(
+                self.field_real_space_norm_x, (1,),
+                norm=mask_x[np.newaxis, :, np.newaxis])
+        self.perp_corr_y = fft_backend.autocorr_same(
+                self.field_real_space_norm_y, (2,), norm=mask_y)
 
         logging.info("Finished calculating perpendicular correlation "
                      "function...")
 
     def perp_norm_mask(self):
         """
-        Applies the appropriate normalization to the perpendicular correlation
-        function.
+        Calculates the appropriate normalization of the perpendicular
+        correlation function.
+
+        Returns
+        -------
+        mask_x, mask_y : array_like
+            Normalization of the radial and poloidal correlation functions as
+            a function of dx and dy.
 
         Notes
         -----
 
-        After calling ``sig.correlate`` to calculate ``perp_corr``, we are
-        left with an unnormalized correlation function as a function of dx
-        or dy. This function applies a nomalization mask to ``perp_corr_x`` and
-        ``perp_corr_y`` which is dependent on the number of points that
-        ``field_real_space_norm`` has in common with itself for a given dx or dy.
+        The autocorrelation of ``field_real_space_norm`` is an unnormalized
+        correlation function as a function of dx or dy. The nomalization mask
+        used by ``calculate_perp_corr`` is the number of points that
+        ``field_real_space_norm`` has in common with itself for a given dx or
+        dy.
         ``field_real_space_norm`` is already normalized to the standard
-        deviation of the time signal, so the only difference between correlate
-        and np.corrcoef is the number of points in common in the convolution
+        deviation of the time signal, so the only difference between the
+        autocorrelation and np.corrcoef is the number of points in common in
+        the convolution
         (that aren't the zero padded values and after averaging over many time
         steps).
         """
-        logging.info('Applying perp normalization mask...')
-
         x = np.ones([self.nx])
         y = np.ones([self.ny])
         mask_x = sig.correlate(x,x,'same')
         mask_y = sig.correlate(y,y,'same')
 
-        self.perp_corr_x /= mask_x[np.newaxis, :, np.newaxis]
-        self.perp_corr_y /= mask_y
-
-        logging.info('Finised applying perp normalization mask...')
+        return mask_x, mask_y
 
-    def perp_corr_fit(self, it):
+    def perp_corr_fit(self, stats):
         """
         Fits the appropriate Gaussian to the radial and poloidal correlation
-        functions.
+        functions of every time slice.
 
         Parameters
         ----------
 
-        it : int
-            This is the index of the time slice currently being fitted.
+        stats : list
+            Mean and standard deviation of the radial and poloidal
+            correlation functions of each time slice, as returned by
+            ``perp_window_stats``.
 
         Notes
         -----
@@ -916,66 +1769,295 @@ class Simulation(object):
         * The radial correlation function is fitted with a Gaussian.
         * The poloidal correlation function is fitted with an oscillating
           Gaussian.
+        * The fits are done by ``parallel_fit.run_fits`` on *fit_workers*
+          processes, warm-started according to *fit_warm_start*, see
+          ``fit_chain``.
         """
+        if self.ky_free:
+            guess_y = {'l': self.perp_guess_y, 'k': self.perp_guess_ky}
+        else:
+            guess_y = {'l': self.perp_guess_y}
+
+        tasks = []
+        for it, (avg_corr_x, corr_std_x, avg_corr_y, corr_std_y) in \
+                enumerate(stats):
+            tasks.append((self.fit_chain('perp_x', it),
+                          parallel_fit.fit_perp_x, {'l': self.perp_guess_x},
+                          (avg_corr_x, self.dx)))
+            tasks.append((self.fit_chain('perp_y', it),
+                          parallel_fit.fit_perp_y, guess_y,
+                          (avg_corr_y, self.dy, self.ky_free)))
+        results = parallel_fit.run_fits(tasks, self.fit_workers)
+
+        for it, (avg_corr_x, corr_std_x, avg_corr_y, corr_std_y) in \
+                enumerate(stats):
+            fit_x, fit_y = results[2*it], results[2*it+1]
+
+            self.perp_fit_x[it] = fit_x['values']['l']
+            self.perp_fit_y[it] = fit_y['values']['l']
+            if self.ky_free:
+                self.perp_fit_ky[it] = fit_y['values']['k']
 
-        corr_fn_x = \
-            np.array(self.perp_corr_x[it*self.time_slice:(it+1)*self.time_slice,:,:])
-        corr_fn_y = \
-            np.array(self.perp_corr_y[it*self.time_slice:(it+1)*self.time_slice,:,:])
+            if fit_x['covar'] is not None:
+                self.perp_fit_x_err[it] = np.sqrt(fit_x['covar'][0,0])
+            else:
+                self.perp_fit_x_err[it] = 0
 
-        # Average corr_fn over time
-        corr_std_x = np.empty([self.nx])
-        corr_std_y = np.empty([self.ny])
-        for ix in range(self.nx):
-            corr_std_x[ix] = np.std(corr_fn_x[:,ix,:])
-        for iy in range(self.ny):
-            corr_std_y[iy] = np.std(corr_fn_y[:,:,iy])
-        avg_corr_x = np.mean(np.mean(corr_fn_x, axis=0), axis=1)
-        avg_corr_y = np.mean(np.mean(corr_fn_y, axis=0), axis=0)
+            if fit_y['covar'] is not None:
+                self.perp_fit_y_err[it] = np.sqrt(fit_y['covar'][0,0])
+                if self.ky_free:
+                    self.perp_fit_ky_err[it] = np.sqrt(fit_y['covar'][1,1])
+            else:
+                self.perp_fit_y_err[it] = 0
+                if self.ky_free:
+                    self.perp_fit_ky_err[it] = 0
 
-        gmod_gauss = lm.Model(fit.gauss)
-        gmod_osc_gauss = lm.Model(fit.osc_gauss)
+            self.perp_plots_x(it, avg_corr_x, corr_std_x, fit_x)
+            self.perp_plots_y(it, avg_corr_y, corr_std_y, fit_y)
 
-        params_x = lm.Parameters()
-        params_x.add('l', value=self.perp_guess_x)
-        params_x.add('p', value=0.0, vary=False)
-        fit_x = gmod_gauss.fit(avg_corr_x, params_x, x=self.dx)
+        self.perp_guess_x = fit_x['values']['l']
+        self.perp_guess_y = fit_y['values']['l']
+        if self.ky_free:
+            self.perp_guess_ky = fit_y['values']['k']
 
-        params_y = lm.Parameters()
-        params_y.add('l', value=self.perp_guess_y)
-        if not self.ky_free:
-            params_y.add('k', value=1, expr='2*3.141592653589793/l')
-        else:
-            params_y.add('k', value=self.perp_guess_ky)
-        params_y.add('p', value=0.0, vary=False)
-        fit_y = gmod_osc_gauss.fit(avg_corr_y, params_y, x=self.dy)
+    def fit_chain(self, name, it, ix=0):
+        """
+        Returns the label of the warm start chain of a fit, see
+        ``parallel_fit.run_fits``.
 
-        self.perp_fit_x[it] = fit_x.best_values['l']
-        self.perp_fit_y[it] = fit_y.best_values['l']
-        if self.ky_free:
-            self.perp_fit_ky[it] = fit_y.best_values['k']
+        Parameters
+        ----------
 
-        if fit_x.errorbars:
-            self.perp_fit_x_err[it] = np.sqrt(fit_x.covar[0,0])
+        name : str
+            Name of the type of fit, e.g. 'perp_x'.
+        it : int
+            Index of the time slice being fitted.
+        ix : int, optional
+            Index of the radial point being fitted, for fits which are done
+            for every radial point.
+
+        Notes
+        -----
+
+        * *fit_warm_start* = 'serial': all fits of the same type are
+          warm-started from the previous one, in the order of it and ix, so
+          they are done one after the other.
+        * *fit_warm_start* = 'window': each fit is warm-started from the fit
+          of the same radial point in the previous time slice, so the radial
+          points are fitted in parallel.
+        * *fit_warm_start* = 'independent': every fit starts from the guess
+          in the configuration file, so all fits are done in parallel.
+        """
+        if self.fit_warm_start == 'serial':
+            return name
+        elif self.fit_warm_start == 'window':
+            return (name, ix)
         else:
-            self.perp_fit_x_err[it] = 0
+            return (name, it, ix)
 
-        if fit_y.errorbars:
-            self.perp_fit_y_err[it] = np.sqrt(fit_y.covar[0,0])
-            if self.ky_free:
-                self.perp_fit_ky_err[it] = np.sqrt(fit_y.covar[1,1])
+    def perp_window_stats(self, it):
+        """
+        Averages the radial and poloidal correlation functions over time
+        slice *it*.
+
+        Parameters
+        ----------
+
+        it : int
+            This is the index of the time slice currently being fitted.
+
+        Returns
+        -------
+        avg_corr_x, corr_std_x : array_like
+            Mean and standard deviation of the radial correlation function
+            over t and y as a function of dx.
+        avg_corr_y, corr_std_y : array_like
+            Mean and standard deviation of the poloidal correlation function
+            over t and x as a function of dy.
+
+        Notes
+        -----
+
+        * If *perp_stream* is True, the field of the time slice is normalized
+          and correlated here, so that the memory used does not grow with
+          *nt*. Otherwise the slice of ``perp_corr_x`` and ``perp_corr_y``
+          is used.
+        * The mean and standard deviation are calculated by
+          ``window_mean_std``, one time step at a time, so no copy of the
+          time slice is made.
+        * If *perp_engine* is 'spectral', the statistics are calculated by
+          ``perp_spectral_stats`` instead.
+        """
+        if self.perp_engine == 'spectral':
+            return self.perp_spectral_stats(it)
+
+        if self.perp_stream:
+            self.field_normalize_perp(it)
+            self.calculate_perp_corr()
+            corr_fn_x = self.perp_corr_x
+            corr_fn_y = self.perp_corr_y
         else:
-            self.perp_fit_y_err[it] = 0
-            if self.ky_free:
-                self.perp_fit_ky_err[it] = 0
+            corr_fn_x = self.perp_corr_x[it*self.time_slice:
+                                         (it+1)*self.time_slice]
+            corr_fn_y = self.perp_corr_y[it*self.time_slice:
+                                         (it+1)*self.time_slice]
 
-        self.perp_guess_x = fit_x.best_values['l']
-        self.perp_guess_y = fit_y.best_values['l']
-        if self.ky_free:
-            self.perp_guess_ky = fit_y.best_values['k']
+        avg_corr_x, corr_std_x = self.window_mean_std(corr_fn_x, 1)
+        avg_corr_y, corr_std_y = self.window_mean_std(corr_fn_y, 2)
 
-        self.perp_plots_x(it, avg_corr_x, corr_std_x, fit_x)
-        self.perp_plots_y(it, avg_corr_y, corr_std_y, fit_y)
+        return avg_corr_x, corr_std_x, avg_corr_y, corr_std_y
+
+    def window_mean_std(self, corr_fn, axis):
+        """
+        Mean and standard deviation of the correlation function of a time
+        window over every axis except *axis*.
+
+        Parameters
+        ----------
+
+        corr_fn : array_like
+            Correlation function of the time window, with time as the first
+            axis.
+        axis : int
+            Axis of the separation the statistics are a function of.
+
+        Notes
+        -----
+
+        The statistics are calculated in two passes over the time steps,
+        first the mean and then the sum of squared deviations from it, both
+        accumulated in double precision. Only one time step is copied at a
+        time, and unlike the difference of the mean square and the squared
+        mean, the standard deviation is accurate where it is about zero,
+        e.g. at zero separation where the correlation function is 1.
+        """
+        sum_axes = tuple(ax for ax in range(1, corr_fn.ndim) if ax != axis)
+        n = corr_fn.size/corr_fn.shape[axis]
+
+        corr_sum = np.zeros(corr_fn.shape[axis])
+        for corr_t in corr_fn:
+            corr_sum += np.sum(corr_t, axis=tuple(ax-1 for ax in sum_axes),
+                               dtype=np.float64)
+        corr_mean = corr_sum/n
+
+        shape = [1]*(corr_fn.ndim - 1)
+        shape[axis-1] = -1
+        corr_sum_sq = np.zeros(corr_fn.shape[axis])
+        for corr_t in corr_fn:
+            dev = corr_t - corr_mean.reshape(shape)
+            corr_sum_sq += np.sum(dev*dev, axis=tuple(ax-1 for ax in sum_axes))
+
+        return corr_mean, np.sqrt(corr_sum_sq/n)
+
+    def use_perp_spectra(self):
+        """
+        Returns True if the perpendicular analysis is run and uses the power
+        spectra of ``perp_spectra``, i.e. *perp_engine* is 'spectral'.
+        """
+        return (self.perp_engine == 'spectral' and
+                self.analysis in ['all', 'perp'])
+
+    def perp_spectra(self):
+        """
+        Calculates the radial and poloidal power spectra of the Fourier space
+        field for every time step.
+
+        Returns
+        -------
+        power_x : array_like
+            Power spectrum as a function of (t, kx), summed over all ky of
+            the real field, with the kx = 0 power set to zero.
+        power_y : array_like
+            Power spectrum as a function of (t, ky), summed over kx, with the
+            ky = 0 power set to zero.
+
+        Notes
+        -----
+
+        * The power is calculated from the same Fourier components as the
+          real space field of ``field_to_real_space``, including the Fourier
+          correction. Only the Hermitian part in kx of the ky = 0 and Nyquist
+          columns contributes to the real field, so only that part is used.
+        * The ky < 0 components of the real field are the complex conjugates
+          of the ky > 0 components at -kx, so they add the power at -kx to
+          the radial spectrum.
+        * Zeroing the kx = 0 (ky = 0) power removes the mean of every radial
+          (poloidal) line of the real space field.
+        * The spectra only take O(nt*(nkx + nky)) memory, so they are kept
+          instead of the Fourier space field.
+        """
+        field = self.field[:,:,:,0]
+        nyq = self.nky - 1
+        neg_kx = -np.arange(self.nkx) % self.nkx
+
+        power = field.real**2 + field.imag**2
+        for iky in set([0, nyq]):
+            col = (field[:,:,iky] + np.conj(field[:,neg_kx,iky]))/2
+            power[:,:,iky] = col.real**2 + col.imag**2
+        power *= self.fourier_correction()**2
+
+        power_mid = np.sum(power[:,:,1:nyq], axis=2, dtype=np.float64)
+        power_x = power_mid + power_mid[:,neg_kx]
+        for iky in set([0, nyq]):
+            power_x += power[:,:,iky]
+        power_y = np.sum(power, axis=1, dtype=np.float64)
+
+        power_x[:,0] = 0
+        power_y[:,0] = 0
+
+        return power_x, power_y
+
+    def perp_spectral_stats(self, it):
+        """
+        Averages the radial and poloidal correlation functions, calculated
+        from the power spectra, over time slice *it*.
+
+        Parameters
+        ----------
+
+        it : int
+            This is the index of the time slice currently being fitted.
+
+        Returns
+        -------
+        avg_corr_x, corr_std_x, avg_corr_y, corr_std_y : array_like
+            Mean and standard deviation of the radial and poloidal
+            correlation functions, as returned by ``perp_window_stats``.
+
+        Notes
+        -----
+
+        * By the Wiener-Khinchin theorem, the radial correlation function
+          summed over y is the inverse transform of *perp_power_x* over kx,
+          and the poloidal one summed over x is the inverse transform of
+          *perp_power_y* over ky. These are transforms of length nkx and ny
+          rather than of the whole real space field.
+        * The correlation functions are normalized to one at zero lag for
+          every time step, i.e. by the variance of the field over the whole
+          domain rather than of every line as in ``field_normalize_perp``.
+        * The correlation functions are circular, i.e. those of the periodic
+          GS2 domain, evaluated at the lags *dx* and *dy*, so no zero padding
+          or ``perp_norm_mask`` is needed.
+        * The standard deviation is over the time steps of the slice only,
+          since the correlation functions of individual lines are not
+          calculated.
+        """
+        t_slice = slice(it*self.time_slice, (it+1)*self.time_slice)
+        ny_full = 2*(self.nky - 1)
+
+        corr_x = fft_backend.ifftn(self.perp_power_x[t_slice], axes=(1,)).real
+        corr_y = fft_backend.irfftn(
+                self.perp_power_y[t_slice].astype(complex), axes=(1,),
+                s=(ny_full,))
+
+        stats = []
+        for corr, n, n_full in [(corr_x, self.nx, self.nkx),
+                                (corr_y, self.ny, ny_full)]:
+            corr = np.take(corr, (np.arange(n) - n//2) % n_full, axis=1)
+            corr /= corr[:, n//2, np.newaxis]
+            stats += [np.mean(corr, axis=0), np.std(corr, axis=0)]
+
+        return stats
 
     def perp_plots_x(self, it, corr_fn, corr_std, corr_fit):
         """
@@ -987,7 +2069,7 @@ class Simulation(object):
         fig, ax = plt.subplots(1, 1)
         plt.scatter(self.dx, corr_fn, color=pal[0],
                      label=r'$C(\Delta x)$')
-        plt.plot(self.dx, corr_fit.best_fit, color=pal[2],
+        plt.plot(self.dx, corr_fit['best_fit'], color=pal[2],
                  label=r'$\exp(-(\Delta x / \ell_x)^2)$')
         plt.fill_between(self.dx, corr_fn-corr_std, corr_fn+corr_std,
                          alpha=0.3)
@@ -1011,13 +2093,13 @@ class Simulation(object):
         plt.clf()
         fig, ax = plt.subplots(1, 1)
         plt.scatter(self.dy, corr_fn, color=pal[0], label=r'$C(\Delta y)$')
-        plt.plot(self.dy, np.exp(-(self.dy/corr_fit.best_values['l'])**2),
+        plt.plot(self.dy, np.exp(-(self.dy/corr_fit['values']['l'])**2),
                  'k--', label=r'$\exp(-(\Delta y / \ell_y)^2)$')
         if not self.ky_free:
             fit_label=r'$\exp(-(\Delta y / \ell_y)^2) \cos(2 \pi \Delta y/ \ell_y)$'
         else:
             fit_label=r'$\exp(-(\Delta y / \ell_y)^2) \cos(k_y \Delta y)$'
-        plt.plot(self.dy, corr_fit.best_fit, color=pal[2], label=fit_label)
+        plt.plot(self.dy, corr_fit['best_fit'], color=pal[2], label=fit_label)
         plt.fill_between(self.dy, corr_fn-corr_std, corr_fn+corr_std,
                          alpha=0.3)
         plt.legend()
@@ -1113,20 +2195,35 @@ class Simulation(object):
         Parameters
         ----------
 
+        analysis : str
+            Name of the analysis the results belong to.
         result_dict : dict
             Dictionary containing results from a given analysis. Will overwrite
             any existing results for that analysis.
+
+        The file is locked while it is updated, so that analyses running at
+        the same time (see ``run_stages``) do not overwrite each other's
+        results.
         """
-        try:
-            with open(self.out_dir + '/' + 'results.json', 'r') as fp:
-                results = json.load(fp)
-        except FileNotFoundError:
-            results = {}
+        results_file = self.out_dir + '/' + 'results.json'
 
-        with open(self.out_dir + '/' + 'results.json', 'w') as fp:
-            results[analysis] = result_dict
+        # Analyses running at the same time in different processes update
+        # the file one after the other
+        with open(results_file + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+            try:
+                with open(results_file, 'r') as fp:
+                    results = json.load(fp)
+            except FileNotFoundError:
+                results = {}
 
-            json.dump(results, fp)
+            tmp_file = results_file + '.tmp' + str(os.getpid())
+            with open(tmp_file, 'w') as fp:
+                results[analysis] = result_dict
+
+                json.dump(results, fp)
+            os.replace(tmp_file, results_file)
 
     def time_analysis(self):
         """
@@ -1137,6 +2234,14 @@ class Simulation(object):
 
         * Split into time windows and perform correlation analysis on each
           window separately.
+        * Unless *time_corr_full* is True, ``time_corr`` only stores the dy
+          separations used by the fit, see ``time_corr_lags``.
+        * The oscillating fits of all windows are done together at the end by
+          ``time_osc_fit``, so that they can be distributed over
+          *fit_workers* processes.
+        * If *lab_frame_method* is 'window', the lab frame field of each
+          window is calculated and normalized just before it is correlated,
+          see ``lab_frame_window``.
         """
         logging.info("Starting time_analysis...")
 
@@ -1152,96 +2257,167 @@ class Simulation(object):
         os.system('rm -f ' + self.out_dir + '/'+self.time_dir+'/corr_fns/*')
 
         self.time_corr = np.empty([self.nt_slices, self.time_slice, self.nx,
-                                   self.ny], dtype=float)
+                                   len(self.time_corr_lags())],
+                                  dtype=self.real_dtype)
         self.corr_time = np.empty([self.nt_slices, self.nx], dtype=float)
         self.corr_time_err = np.empty([self.nt_slices, self.nx], dtype=float)
 
-        self.field_normalize_time()
+        if self.lab_frame_method == 'field':
+            self.field_normalize_time()
+        osc_points = []
         pbar = ProgressBar(widgets=['Progress: ', Percentage(), Bar()])
         for it in pbar(range(self.nt_slices)):
+            if self.lab_frame_method == 'window':
+                self.field_normalize_time(it)
             self.calculate_time_corr(it)
-            self.time_norm_mask(it)
-            self.time_corr_fit(it)
+            osc_points += [(it, ix) for ix in self.time_corr_fit(it)]
+        self.time_osc_fit(osc_points)
 
         self.time_analysis_summary()
 
         logging.info("Finished time_analysis...")
 
-    def field_normalize_time(self):
+    def field_normalize_time(self, it=None):
         """
         Defines normalized field for the time correlation by subtracting the
         mean and dividing by the RMS value.
+
+        The mean and RMS are taken over t and y in each time window, for each
+        x. All windows are normalized at once by viewing the field as
+        [window, t, x, y] and reducing over the t and y axes.
+
+        Parameters
+        ----------
+
+        it : int, optional
+            Index of the time slice to normalize, when *lab_frame_method* is
+            'window'. The lab frame field of the slice is calculated by
+            ``lab_frame_window`` and ``field_real_space_norm`` only contains
+            that slice. By default the whole field is normalized.
         """
         logging.info('Normalizing the real space field...')
 
-        self.field_real_space_norm = \
-                                np.empty([self.nt,self.nx,self.ny],dtype=float)
+        if it is None:
+            self.field_real_space_norm = np.empty([self.nt,self.nx,self.ny],
+                                                  dtype=self.real_dtype)
 
-        for it in range(self.nt_slices):
-            t_min = it*self.time_slice
-            t_max = (it+1)*self.time_slice
-            field_window = self.field_real_space[t_min:t_max,:,:]
-            for ix in range(self.nx):
-                self.field_real_space_norm[t_min:t_max,ix,:] = \
-                                        field_window[:,ix,:] - \
-                                        np.mean(field_window[:,ix,:])
-                self.field_real_space_norm[t_min:t_max,ix,:] /= \
-                        np.std(self.field_real_space_norm[t_min:t_max,ix,:])
+            nt_windows = self.nt_slices*self.time_slice
+            shape = [self.nt_slices, self.time_slice, self.nx, self.ny]
+            field_windows = self.field_real_space[:nt_windows].reshape(shape)
+            field_norm = self.field_real_space_norm[:nt_windows].reshape(shape)
+        else:
+            field_windows = self.lab_frame_window(it)[np.newaxis]
+            self.field_real_space_norm = np.empty(field_windows.shape[1:],
+                                                  dtype=self.real_dtype)
+            field_norm = self.field_real_space_norm[np.newaxis]
+
+        np.subtract(field_windows, np.mean(field_windows, axis=(1,3),
+                                           keepdims=True),
+                    out=field_norm)
+        field_norm /= np.std(field_norm, axis=(1,3), keepdims=True)
 
         logging.info('Finished normalizing the real space field.')
 
     def calculate_time_corr(self, it):
         """
-        Calculate the time correlation for a given time window at each x.
+        Calculate the normalized time correlation for a given time window at
+        each x.
 
         Parameters
         ----------
 
         it : int
             This is the index of the time slice currently being calculated.
-        """
 
-        field_window = self.field_real_space_norm[it*self.time_slice:(it+1)*
-                                                  self.time_slice,:,:]
+        Notes
+        -----
 
-        for ix in range(self.nx):
-            self.time_corr[it,:,ix,:] = sig.fftconvolve(field_window[:,ix,:],
-                                                        field_window[::-1,ix,::-1],
-                                                        'same')
+        The correlation functions of all x are calculated together by one 2D
+        real FFT over the (t, y) axes of the time window, and divided by the
+        normalization mask from ``time_norm_mask``. If *time_corr_full* is
+        False, the inverse transform in y is only done for the dy separations
+        given by ``time_corr_lags``.
 
-    def time_norm_mask(self, it):
+        If *time_corr_method* is 'binned', the correlation functions are
+        calculated on the time grid of the field, which need not be regular,
+        by ``fft_backend.autocorr_binned``. Each pair of time steps
+        contributes to the two dt of ``time_window_dt`` either side of its
+        time separation, with linear weights, and the result is divided by
+        the sum of the weights at each dt and the number of overlapping
+        points at each dy.
         """
-        Applies the appropriate normalization to the time correlation function.
 
-        Notes
-        -----
+        if self.lab_frame_method == 'window':
+            field_window = self.field_real_space_norm
+        else:
+            field_window = self.field_real_space_norm[it*self.time_slice:
+                                                      (it+1)*self.time_slice]
+
+        if self.time_corr_method == 'binned':
+            lags = self.time_corr_lags()
+            mask_y = self.ny - np.abs(lags - int(self.ny/2))
+            self.time_corr[it] = fft_backend.autocorr_binned(
+                    field_window,
+                    self.t[it*self.time_slice:(it+1)*self.time_slice], 2,
+                    idx=lags, norm=mask_y)
+        elif self.time_corr_full:
+            self.time_corr[it] = fft_backend.autocorr_same(
+                    field_window, (0,2),
+                    norm=self.time_norm_mask()[:,np.newaxis,:])
+        else:
+            lags = self.time_corr_lags()
+            self.time_corr[it] = fft_backend.autocorr_lags(
+                    field_window, (0,2), lags,
+                    norm=self.time_norm_mask()[:,np.newaxis,lags])
 
-        After calling ``sig.fftconvolve`` to calculate ``time_corr``, we are
-        left with an unnormalized correlation function as a function of dt
-        and dy. This function applies a 2D nomalization mask to ``time_corr``
-        which is dependent on the number of points that ``field_real_space_norm``
-        has in common with itself for a given dt, dy, and time window.
-        ``field_real_space_norm`` is already normalized to the standard
-        deviation of the time signal, so the only difference between fftconvolve
-        and np.corrcoef is the number of points in common in the convolution
-        (that aren't the zero padded values and after averaging over many time
-        steps).
+    def time_corr_lags(self):
+        """
+        Indices of the dy separations stored in ``time_corr``.
 
-        Parameters
-        ----------
+        Returns
+        -------
+        lags : array_like
+            All dy indices if *time_corr_full* is True. Otherwise only the
+            *npeaks_fit* indices starting at dy = 0, which are the only ones
+            used by ``time_corr_fit``.
+        """
+        if self.time_corr_full:
+            return np.arange(self.ny)
+        else:
+            mid_idx = int(self.ny/2)
+            return np.arange(mid_idx, mid_idx+self.npeaks_fit)
 
-        it : int
-            This is the index of the time slice currently being calculated.
+    def time_norm_mask(self):
         """
-        logging.info('Applying time normalization mask...')
+        Calculates the appropriate normalization of the time correlation
+        function.
 
-        x = np.ones([self.time_slice, self.ny])
-        mask = sig.fftconvolve(x,x,'same')
+        Returns
+        -------
+        mask : array_like
+            Normalization as a function of dt and dy.
 
-        for ix in range(self.nx):
-            self.time_corr[it,:,ix,:] /= mask
+        Notes
+        -----
+
+        The autocorrelation of ``field_real_space_norm`` is an unnormalized
+        correlation function as a function of dt and dy. The 2D nomalization
+        mask used by ``calculate_time_corr`` is the number of points that
+        ``field_real_space_norm`` has in common with itself for a given dt,
+        dy, and time window. ``field_real_space_norm`` is already normalized
+        to the standard deviation of the time signal, so the only difference
+        between autocorr_same and np.corrcoef is the number of points in
+        common in the convolution (that aren't the zero padded values and
+        after averaging over many time steps).
+
+        The mask only depends on the window shape, so it is calculated once
+        and stored in *time_mask*.
+        """
+        shape = (self.time_slice, self.ny)
+        if self.time_mask is None or self.time_mask.shape != shape:
+            self.time_mask = fft_backend.autocorr_same(np.ones(shape), (0,1))
 
-        logging.info('Finised applying time normalization mask.')
+        return self.time_mask
 
     def time_corr_fit(self, it):
         """
@@ -1253,8 +2429,8 @@ class Simulation(object):
 
         The fitting procedure consists of the following steps:
 
-        * Loop over radial points
-        * Identify the time correlation function peaks
+        * Identify the time correlation function peaks for all radial points
+          at once, see ``time_corr_peaks``
         * Determine what type of function to fit to the peaks
         * Fitting the appropriate function
 
@@ -1262,134 +2438,192 @@ class Simulation(object):
         on the direction of decrease of the peaks, or an oscillating exponential
         if the peaks don't monotically increase or decrease.
 
+        The exponential fits of all radial points are done together by
+        ``fit.exp_fit_batch``, which polishes a log-linear estimate with up
+        to *time_fit_polish* damped Gauss-Newton iterations. The oscillating fits are
+        left to ``time_osc_fit``.
+
         Parameters
         ----------
 
         it : int
             This is the index of the time slice currently being fitted.
+
+        Returns
+        -------
+        osc_ix : array_like
+            Radial indices which need to be fitted with an oscillating
+            Gaussian.
         """
-        t = self.t[it*self.time_slice:(it+1)*self.time_slice]
-        self.dt = np.linspace((-max(t)+t[0])/2, (max(t)-t[0])/2, self.time_slice)
-
-        peaks = np.zeros([self.nx, self.npeaks_fit], dtype=float)
-        max_index = np.empty([self.nx, self.npeaks_fit], dtype=int);
-        mid_idx = int(self.ny/2)
-
-        for ix in range(self.nx):
-            for iy in range(mid_idx,mid_idx+self.npeaks_fit):
-                max_index[ix, iy-mid_idx], peaks[ix, iy-mid_idx] = \
-                    max(enumerate(self.time_corr[it,:,ix,iy]),
-                        key=operator.itemgetter(1))
-
-            if (fit.strictly_increasing(max_index[ix,:]) == True or
-                fit.strictly_increasing(max_index[ix,::-1]) == True):
-                if max_index[ix, self.npeaks_fit-1] > max_index[ix, 0]:
-                    try:
-                        gmod_decay = lm.Model(fit.decaying_exp)
-                        params_t = lm.Parameters()
-                        params_t.add('tau_c', value=self.time_guess_dec)
-                        fit_t = gmod_decay.fit(peaks[ix,:], params_t,
-                                               t=self.dt[max_index[ix,:]])
-
-                        if np.abs(fit_t.best_values['tau_c']) > self.time_max:
-                            self.corr_time[it,ix] = np.nan
-                            self.corr_time_err[it,ix] = np.nan
-                        else:
-                            self.corr_time[it,ix] = fit_t.best_values['tau_c']
-                            if fit_t.errorbars:
-                                self.corr_time_err[it,ix] = np.sqrt(fit_t.covar[0,0])
-                            else:
-                                self.corr_time_err[it,ix] = np.nan
-                            self.time_guess_dec = self.corr_time[it,ix]
-                            self.time_plot(it, ix, max_index, peaks, 'decaying')
-
-                        logging.info("(" + str(it) + "," + str(ix) + ") was fitted "
-                                     "with decaying exponential. tau = "
-                                     + str(self.corr_time[it,ix]) + " s\n")
-
-                    except RuntimeError:
-                        logging.info("(" + str(it) + "," + str(ix) + ") "
-                                "RuntimeError - max fitting iterations reached, "
-                                "skipping this case with tau = NaN\n")
-                        self.corr_time[it, ix] = np.nan
+        self.dt = self.time_window_dt(it)
+
+        max_index, peak_times, peaks = self.time_corr_peaks(it)
+
+        step = np.diff(max_index, axis=1)
+        monotonic = np.all(step > 0, axis=1) | np.all(step < 0, axis=1)
+        decaying = monotonic & (max_index[:,-1] > max_index[:,0])
+        growing = monotonic & ~decaying
+
+        for fit_type, is_type, a in [('decaying', decaying,
+                                      np.abs(peak_times)),
+                                     ('growing', growing, -peak_times)]:
+            if not is_type.any():
+                continue
+
+            if self.fit_warm_start == 'independent':
+                tau_guess = self.time_guess[0]
+            elif fit_type == 'decaying':
+                tau_guess = self.time_guess_dec
+            else:
+                tau_guess = self.time_guess_grow
+            tau_c, tau_c_err = fit.exp_fit_batch(a[is_type], peaks[is_type],
+                                                 tau_guess,
+                                                 self.time_fit_polish)
+
+            for ix, tau, tau_err in zip(np.where(is_type)[0], tau_c, tau_c_err):
+                if not np.abs(tau) <= self.time_max:
+                    self.corr_time[it,ix] = np.nan
+                    self.corr_time_err[it,ix] = np.nan
                 else:
-                    try:
-                        gmod_grow = lm.Model(fit.growing_exp)
-                        params_t = lm.Parameters()
-                        params_t.add('tau_c', value=self.time_guess_grow)
-                        fit_t = gmod_grow.fit(peaks[ix,:], params_t,
-                                              t=self.dt[max_index[ix,:]])
-
-                        if np.abs(fit_t.best_values['tau_c']) > self.time_max:
-                            self.corr_time[it,ix] = np.nan
-                            self.corr_time_err[it,ix] = np.nan
-                        else:
-                            self.corr_time[it,ix] = fit_t.best_values['tau_c']
-                            if fit_t.errorbars:
-                                self.corr_time_err[it,ix] = np.sqrt(fit_t.covar[0,0])
-                            else:
-                                self.corr_time_err[it,ix] = np.nan
-                            self.time_guess_grow = self.corr_time[it,ix]
-                            self.time_plot(it, ix, max_index, peaks, 'growing')
-
-                        logging.info("(" + str(it) + "," + str(ix) + ") was fitted "
-                                     "with growing exponential. tau = "
-                                     + str(self.corr_time[it,ix]) + " s\n")
-
-                    except RuntimeError:
-                        logging.info("(" + str(it) + "," + str(ix) + ") "
-                                "RuntimeError - max fitting iterations reached, "
-                                "skipping this case with tau = NaN\n")
-                        self.corr_time[it, ix] = np.nan
+                    self.corr_time[it,ix] = tau
+                    self.corr_time_err[it,ix] = tau_err
+                    if fit_type == 'decaying':
+                        self.time_guess_dec = tau
+                    else:
+                        self.time_guess_grow = tau
+                    self.time_plot(it, ix, peak_times, peaks, fit_type)
+
+                logging.info("(" + str(it) + "," + str(ix) + ") was fitted "
+                             "with " + fit_type + " exponential. tau = "
+                             + str(self.corr_time[it,ix]) + " s\n")
+
+        return np.where(~monotonic)[0]
+
+    def time_osc_fit(self, osc_points):
+        """
+        Fits the central peak of the time correlation function with an
+        oscillating Gaussian for the given points.
+
+        If abs(max_index) is not monotonically increasing, this usually means
+        that there is no flow and that the peaks cannot be used to calculate
+        the correlation time, see ``time_corr_fit``.
+
+        Parameters
+        ----------
+
+        osc_points : list
+            List of (it, ix) pairs of time slice and radial index to fit.
+
+        Notes
+        -----
+
+        The fits are done by ``parallel_fit.run_fits`` on *fit_workers*
+        processes, warm-started according to *fit_warm_start*, see
+        ``fit_chain``.
+        """
+        # Index of dy = 0 in time_corr
+        mid_idx = int(self.ny/2) - self.time_corr_lags()[0]
+        guess = dict(zip(['l', 'k', 'p'], self.time_guess_osc))
+
+        tasks = []
+        for it, ix in osc_points:
+            corr_fn = np.array(self.time_corr[it,:,ix,mid_idx],
+                               dtype=np.float64)
+            tasks.append((self.fit_chain('time_osc', it, ix),
+                          parallel_fit.fit_time_osc, guess,
+                          (corr_fn, self.time_window_dt(it), self.time_max)))
+        results = parallel_fit.run_fits(tasks, self.fit_workers)
+
+        for (it, ix), fit_t in zip(osc_points, results):
+            if fit_t is None:
+                logging.info("(" + str(it) + "," + str(ix) + ") "
+                        "RuntimeError - max fitting iterations reached, "
+                        "skipping this case with (tau, omega) = NaN\n")
+                self.corr_time[it, ix] = np.nan
+                self.corr_time_err[it, ix] = np.nan
+
+            # Note l = tau_c sinc fitting function specification is for
+            # general l, k, p.
+            elif np.abs(fit_t['values']['l']) > self.time_max:
+                self.corr_time[it,ix] = np.nan
+                self.corr_time_err[it,ix] = np.nan
+                logging.info("(" + str(it) + "," + str(ix) + ") was "
+                             "fitted with an oscillating Gaussian to "
+                             "the central peak. (tau, omega) = "
+                             + str([np.nan, np.nan]) + "\n")
+
             else:
-                try:
-                    # If abs(max_index) is not monotonically increasing, this
-                    # usually means that there is no flow and that the above method
-                    # cannot be used to calculate the correlation time. Try fitting
-                    # a decaying oscillating exponential to the central peak.
-                    gmod_osc = lm.Model(fit.osc_gauss)
-                    params_t = lm.Parameters()
-                    params_t.add('l', value=self.time_guess_osc[0])
-                    params_t.add('k', value=self.time_guess_osc[1])
-                    params_t.add('p', value=self.time_guess_osc[2], vary=False)
-                    fit_t = gmod_osc.fit(self.time_corr[it,:,ix,mid_idx],
-                                         params_t, x=self.dt)
-
-                    # Note l = tau_c sinc fitting function specification is for
-                    # general l, k, p.
-                    if np.abs(fit_t.best_values['l']) > self.time_max:
-                        self.corr_time[it,ix] = np.nan
-                        self.corr_time_err[it,ix] = np.nan
-                        logging.info("(" + str(it) + "," + str(ix) + ") was "
-                                     "fitted with an oscillating Gaussian to "
-                                     "the central peak. (tau, omega) = "
-                                     + str([np.nan, np.nan]) + "\n")
+                self.corr_time[it,ix] = fit_t['values']['l']
+                if fit_t['covar'] is not None:
+                    self.corr_time_err[it,ix] = np.sqrt(fit_t['covar'][0,0])
+                else:
+                    self.corr_time_err[it,ix] = np.nan
+                self.time_guess_osc = np.array([fit_t['values']['l'],
+                                                fit_t['values']['k'],
+                                                fit_t['values']['p']])
+                self.dt = self.time_window_dt(it)
+                self.time_plot(it, ix, None, None, 'oscillating',
+                               omega=fit_t['values']['k'])
 
-                    else:
-                        self.corr_time[it,ix] = fit_t.best_values['l']
-                        if fit_t.errorbars:
-                            self.corr_time_err[it,ix] = np.sqrt(fit_t.covar[0,0])
-                        else:
-                            self.corr_time_err[it,ix] = np.nan
-                        self.time_guess_osc = np.array([fit_t.best_values['l'],
-                                                        fit_t.best_values['k'],
-                                                        fit_t.best_values['p']])
-                        self.time_plot(it, ix, max_index, peaks, 'oscillating',
-                                       omega=fit_t.best_values['k'])
-
-                        logging.info("(" + str(it) + "," + str(ix) + ") was "
-                                     "fitted with an oscillating Gaussian to "
-                                     "the central peak. (tau, omega) = "
-                                     + str([fit_t.best_values['l'],
-                                            fit_t.best_values['k']]) + "\n")
-
-                except RuntimeError:
-                    logging.info("(" + str(it) + "," + str(ix) + ") "
-                            "RuntimeError - max fitting iterations reached, "
-                            "skipping this case with (tau, omega) = NaN\n")
-                    self.corr_time[it, ix] = np.nan
-
-    def time_plot(self, it, ix, max_index, peaks, plot_type, **kwargs):
+                logging.info("(" + str(it) + "," + str(ix) + ") was "
+                             "fitted with an oscillating Gaussian to "
+                             "the central peak. (tau, omega) = "
+                             + str([fit_t['values']['l'],
+                                    fit_t['values']['k']]) + "\n")
+
+    def time_window_dt(self, it):
+        """
+        Returns the time separations of the correlation function of time
+        slice *it*.
+        """
+        t = self.t[it*self.time_slice:(it+1)*self.time_slice]
+        return np.linspace((-max(t)+t[0])/2, (max(t)-t[0])/2, self.time_slice)
+
+    def time_corr_peaks(self, it):
+        """
+        Finds the peaks in dt of the time correlation function for the first
+        *npeaks_fit* dy separations from dy = 0, for all radial points.
+
+        Parameters
+        ----------
+
+        it : int
+            This is the index of the time slice currently being fitted.
+
+        Returns
+        -------
+        max_index : array_like
+            Index in dt of the maximum of each correlation function. Size:
+            (nx, npeaks_fit)
+        peak_times : array_like
+            Time separation of each peak, refined to below the dt grid spacing
+            by fitting a parabola through the maximum and its neighbours.
+        peaks : array_like
+            Value of the correlation function at each refined peak.
+        """
+        mid_idx = int(self.ny/2) - self.time_corr_lags()[0]
+        corr_fn = self.time_corr[it,:,:,mid_idx:mid_idx+self.npeaks_fit]
+
+        max_index = np.argmax(corr_fn, axis=0)
+
+        # Neighbouring points, clipped at the ends of the window in which case
+        # the parabola is flat on one side and the peak is not moved
+        left = np.maximum(max_index - 1, 0)
+        right = np.minimum(max_index + 1, self.time_slice - 1)
+        ix, ip = np.ix_(np.arange(corr_fn.shape[1]),
+                        np.arange(corr_fn.shape[2]))
+        y_mid, y_left, y_right = [corr_fn[idx, ix, ip].astype(np.float64)
+                                  for idx in [max_index, left, right]]
+        interior = (max_index > 0) & (max_index < self.time_slice - 1)
+
+        offset, peaks = fit.parabolic_peak(y_left, y_mid, y_right)
+        offset = np.where(interior, offset, 0)
+        peaks = np.where(interior, peaks, y_mid)
+        peak_times = self.dt[max_index] + offset*(self.dt[1] - self.dt[0])
+
+        return max_index, peak_times, peaks
+
+    def time_plot(self, it, ix, peak_times, peaks, plot_type, **kwargs):
         """
         Plots the time correlation peaks as well as the apprpriate fitting
         function.
@@ -1401,24 +2635,26 @@ class Simulation(object):
             Time slice currently being fitted.
         ix : int
             Radial index currently being fitted.
-        max_index : array_like
-            Array containing radial indices of the peaks. Size: (nx, npeaks_fit)
+        peak_times : array_like
+            Array containing the time separations of the peaks. Size:
+            (nx, npeaks_fit)
         peaks : array_like
-            Array of peak values at the max_index values. Size: (nx, npeaks_fit)
+            Array of peak values at the peak_times values. Size:
+            (nx, npeaks_fit)
         plot_type : str
             Type of fitting function to plot. One of: 'growing'/'decaying'/
             'oscillating'
         """
         plot_style.white()
 
-        mid_idx = int(self.ny/2)
+        mid_idx = int(self.ny/2) - self.time_corr_lags()[0]
         plt.clf()
         fig, ax = plt.subplots(1, 1)
 
         if plot_type == 'decaying':
             plt.plot(self.dt*1e6, self.time_corr[it,:,ix,mid_idx:mid_idx+self.npeaks_fit])
             plt.hold(True)
-            plt.plot(self.dt[max_index[ix,:]]*1e6, peaks[ix,:], 'o', color='#7A1919')
+            plt.plot(peak_times[ix,:]*1e6, peaks[ix,:], 'o', color='#7A1919')
             plt.hold(True)
             plt.plot(self.dt[int(self.time_slice/2):]*1e6,
                      fit.decaying_exp(self.dt[int(self.time_slice/2):],self.corr_time[it,ix]),
@@ -1428,7 +2664,7 @@ class Simulation(object):
         if plot_type == 'growing':
             plt.plot(self.dt*1e6, self.time_corr[it,:,ix,mid_idx:mid_idx+self.npeaks_fit])
             plt.hold(True)
-            plt.plot(self.dt[max_index[ix,:]]*1e6, peaks[ix,:], 'o', color='#7A1919')
+            plt.plot(peak_times[ix,:]*1e6, peaks[ix,:], 'o', color='#7A1919')
             plt.hold(True)
             plt.plot(self.dt[:int(self.time_slice/2)]*1e6,
                      fit.growing_exp(self.dt[:int(self.time_slice/2)],self.corr_time[it,ix]),
@@ -1495,6 +2731,9 @@ class Simulation(object):
         """
         Calculates the parallel correlation function and fits with a Gaussian
         to find the parallel correlation length.
+
+        If *par_stream* is True, the correlation function is only calculated
+        for one time slice at a time, see ``par_window_stats``.
         """
         logging.info("Starting par_analysis...")
 
@@ -1505,15 +2744,15 @@ class Simulation(object):
         os.system('rm -f ' + self.out_dir + '/parallel/corr_fns/*')
 
         self.calculate_l_par()
-        self.calculate_par_corr()
+        if not self.par_stream:
+            self.calculate_par_corr()
 
         self.par_fit_params = np.empty([self.nt_slices, 2],
                                        dtype=float)
         self.par_fit_params_err = np.empty([self.nt_slices, 2],
                                            dtype=float)
 
-        for it in range(self.nt_slices):
-            self.par_corr_fit(it)
+        self.par_corr_fit()
 
         self.par_analysis_summary()
 
@@ -1532,91 +2771,187 @@ class Simulation(object):
                         self.bmag[int(self.ntheta/2)] * self.gradpar)
         dl_dtheta = np.sqrt(dR_dtheta**2 + dZ_dtheta**2 + (self.R*dphi_dtheta)**2)
         self.l_par = np.append(0, integrate.cumtrapz(dl_dtheta, x=self.theta))
+        self.par_interp = None
 
         logging.info('Finished calculating parallel length.')
 
-    def calculate_par_corr(self):
+    def calculate_par_corr(self, it=None):
         """
         Calculate the parallel correlation function and apply normalization mask.
 
-        Interpolation onto a regular parallel grid, correlation calculation,
-        and normalization are done in one function to avoid unnecessary looping
-        over x, y, and theta.
+        Parameters
+        ----------
+
+        it : int, optional
+            Index of the time slice to correlate. By default the correlation
+            function is calculated for all times.
+
+        Notes
+        -----
+
+        * The field is interpolated onto a regular parallel grid for all t, x
+          and y at once with a single product with the sparse matrix of
+          ``par_interp_matrix``. The matrix is calculated on the first call
+          after ``calculate_l_par``, when l_par is replaced by the regular
+          grid.
+        * Each parallel signal is normalized by subtracting its mean and
+          dividing by its standard deviation.
+        * The correlation functions are calculated by
+          ``fft_backend.autocorr_same`` as one batched real FFT along theta,
+          and normalized by the number of overlapping points at each dz.
+        * ``field_real_space`` is not modified.
         """
         logging.info('Start calculating parallel correlation function...')
 
         x = np.ones([self.ntheta])
         mask = sig.correlate(x, x, 'same')
 
-        self.par_corr = np.empty([self.nt, self.nx, self.ny, self.ntheta],
-                                 dtype=float)
-        l_par_reg = np.linspace(0, self.l_par[-1], self.ntheta)
-        pbar = ProgressBar(widgets=['Progress: ', Percentage(), Bar()])
-        for it in pbar(range(self.nt)):
-            logging.info('Parallel correlation timestep: %d of %d'%(it,self.nt))
-            for ix in range(self.nx):
-                for iy in range(self.ny):
-                    f = interp.interp1d(self.l_par,
-                                        self.field_real_space[it,ix,iy,:])
-                    self.field_real_space[it,ix,iy,:] = f(l_par_reg)
-
-                    self.field_real_space[it,ix,iy,:] = \
-                            self.field_real_space[it,ix,iy,:] - \
-                            np.mean(self.field_real_space[it,ix,iy,:])
-                    self.field_real_space[it,ix,iy,:] = \
-                            self.field_real_space[it,ix,iy,:] / \
-                            np.std(self.field_real_space[it,ix,iy,:])
-
-                    self.par_corr[it,ix,iy,:] = \
-                        sig.correlate(self.field_real_space[it,ix,iy,:],
-                                      self.field_real_space[it,ix,iy,:],
-                                      'same')/mask
-
-        self.l_par = l_par_reg
-        self.dl_par = np.linspace(-self.l_par[-1]/2, self.l_par[-1]/2, self.ntheta)
+        if self.par_interp is None:
+            l_par_reg = np.linspace(0, self.l_par[-1], self.ntheta)
+            self.par_interp = self.par_interp_matrix(l_par_reg)
+            self.l_par = l_par_reg
+            self.dl_par = np.linspace(-self.l_par[-1]/2, self.l_par[-1]/2,
+                                      self.ntheta)
+
+        if it is None:
+            field = self.field_real_space
+        else:
+            field = self.field_real_space[it*self.time_slice:
+                                          (it+1)*self.time_slice]
+
+        # Interpolate all parallel signals with one sparse matrix product
+        shape = field.shape
+        field = self.par_interp.dot(field.reshape(-1, shape[3]).T).T
+        field -= np.mean(field, axis=1, keepdims=True)
+        field /= np.std(field, axis=1, keepdims=True)
+
+        self.par_corr = fft_backend.autocorr_same(field.reshape(shape), (3,),
+                                                  norm=mask)
 
         logging.info('Finished calculating parallel correlation function.')
 
-    def par_corr_fit(self, it):
+    def par_interp_matrix(self, l_par_reg):
+        """
+        Returns the sparse matrix which linearly interpolates a function of
+        l_par onto the regular parallel grid *l_par_reg*.
+
+        Parameters
+        ----------
+
+        l_par_reg : array_like
+            Parallel grid to interpolate onto. Must lie within l_par.
+
+        Returns
+        -------
+        interp_matrix : scipy.sparse.csr_matrix
+            Matrix of size (len(l_par_reg), len(l_par)) with two non-zero
+            weights in each row, equivalent to ``interp.interp1d``.
+        """
+        n_par = len(self.l_par)
+        idx, weight = self.interp_weights(self.l_par, l_par_reg)
+
+        rows = np.repeat(np.arange(len(l_par_reg)), 2)
+        cols = np.stack([idx, idx+1], axis=1).ravel()
+        vals = np.stack([1 - weight, weight], axis=1).ravel()
+
+        return sparse.csr_matrix((vals.astype(self.real_dtype), (rows, cols)),
+                                 shape=(len(l_par_reg), n_par))
+
+    def interp_weights(self, x, x_new):
+        """
+        Returns the indices and weights which linearly interpolate a function
+        of *x* onto *x_new*, i.e. f(x_new) = (1 - weight)*f[idx] +
+        weight*f[idx+1].
+
+        Parameters
+        ----------
+
+        x : array_like
+            Increasing grid on which the function is known.
+        x_new : array_like
+            Grid to interpolate onto. Must lie within *x*.
+        """
+        idx = np.searchsorted(x, x_new, side='right') - 1
+        idx = np.clip(idx, 0, len(x) - 2)
+        weight = (x_new - x[idx]) / (x[idx+1] - x[idx])
+
+        return idx, weight
+
+    def par_corr_fit(self):
         """
         Fit the parallel correlation function with an oscillatory Gaussian
-        function for time slice it.
+        function for every time slice.
+
+        Before fitting average over time, x, and y. The fits are done by
+        ``parallel_fit.run_fits`` on *fit_workers* processes, warm-started
+        according to *fit_warm_start*, see ``fit_chain``.
+        """
+        pbar = ProgressBar(widgets=['Progress: ', Percentage(), Bar()])
+        corr_fns, corr_stds = zip(*[self.par_window_stats(it) for it in
+                                    pbar(range(self.nt_slices))])
+
+        # The regular parallel grid is only known after the first window has
+        # been correlated when streaming
+        guess = {'l': self.par_guess[0], 'k': self.par_guess[1]}
+        k_max = 2*np.pi/self.dl_par[-1]*len(self.dl_par)/2
+        tasks = [(self.fit_chain('par', it), parallel_fit.fit_par, guess,
+                  (corr_fns[it], self.dl_par, self.l_par[1], k_max))
+                 for it in range(self.nt_slices)]
+        results = parallel_fit.run_fits(tasks, self.fit_workers)
+
+        for it, par_fit in enumerate(results):
+            if par_fit is None:
+                logging.info("(" + str(it) + ") RuntimeError - max fitting "
+                             "iterations reached, skipping this case with "
+                             "(l_par, k_par) = NaN\n")
+                self.par_fit_params[it, :] = np.nan
+                self.par_fit_params_err[it, :] = np.nan
+                continue
+
+            self.par_fit_params[it, :] = np.abs([par_fit['values']['l'],
+                                                 par_fit['values']['k']])
+            if par_fit['covar'] is not None:
+                self.par_fit_params_err[it, :] = \
+                        np.sqrt(np.diag(par_fit['covar']))
+            else:
+                self.par_fit_params_err[it, :] = np.nan
+            self.par_plot(it, corr_fns[it], corr_stds[it])
+
+            self.par_guess = self.par_fit_params[it, :]
+
+    def par_window_stats(self, it):
+        """
+        Averages the parallel correlation function over t, x and y in time
+        slice *it*.
 
         Parameters
         ----------
 
         it : int
-            Time slice to average over and fit.
+            Time slice to average over.
+
+        Returns
+        -------
+        corr_fn, corr_std : array_like
+            Mean and standard deviation of the parallel correlation function
+            as a function of dl_par.
 
-        Before fitting average over time, x, and y.
+        Notes
+        -----
+
+        * If *par_stream* is True, the correlation function of the time slice
+          is calculated here, so that the memory used does not grow with
+          *nt*. Otherwise the slice of ``par_corr`` is used.
+        * The mean and standard deviation at each dl_par are calculated by
+          ``window_mean_std``.
         """
-        corr_fn = self.par_corr[it*self.time_slice:(it+1)*self.time_slice,:,:,:]
-        corr_std = np.empty([self.ntheta])
-        for i in range(self.ntheta):
-                corr_std[i] = np.std(corr_fn[:,:,:,i])
-        corr_fn = np.mean(np.mean(np.mean(corr_fn, axis=0), axis=0), axis=0)
+        if self.par_stream:
+            self.calculate_par_corr(it)
+            corr_fn = self.par_corr
+        else:
+            corr_fn = self.par_corr[it*self.time_slice:(it+1)*self.time_slice]
 
-        try:
-            gmod_osc = lm.Model(fit.osc_gauss)
-            params = lm.Parameters()
-            params.add('l', value=self.par_guess[0], min=self.l_par[1],
-                       max=100)
-            params.add('k', value=self.par_guess[1],
-                       max=(2*np.pi/self.dl_par[-1]*len(self.dl_par)/2))
-            params.add('p', value=0, vary=False)
-            par_fit = gmod_osc.fit(corr_fn, params, x=self.dl_par)
-
-            self.par_fit_params[it, :] = np.abs([par_fit.best_values['l'],
-                                                 par_fit.best_values['k']])
-            self.par_fit_params_err[it, :] = np.sqrt(np.diag(par_fit.covar))
-            self.par_plot(it, corr_fn, corr_std)
-        except RuntimeError:
-            logging.info("(" + str(it) + ") RuntimeError - max fitting iterations reached, "
-                    "skipping this case with (l_par, k_par) = NaN\n")
-            self.par_fit_params[it, :] = np.nan
-            self.par_fit_params_err[it, :] = np.nan
-
-        self.par_guess = self.par_fit_params[it, :]
+        return self.window_mean_std(corr_fn, 3)
 
     def par_plot(self, it, corr, corr_std):
         """
@@ -1709,52 +3044,12 @@ class Simulation(object):
         * The radial and poloidal coordinates are centered at 0.
         * The radial coordinate is interpolated if neccessary to ensure a
           0.5cm resolution consistent with the BES.
+        * See ``write_field_nc`` for the chunking, compression and precision
+          of the output.
         """
         logging.info("Starting write_field...")
 
-        if 'write_field' not in os.listdir(self.out_dir):
-            os.system("mkdir -p " + self.out_dir + '/write_field')
-
-        if self.write_field_interp_x:
-            #interpolate radial coordinate to be approx 0.5cm
-            interp_fac = int(np.ceil(self.x[1]/0.005))
-            x_nc = np.linspace(min(self.x), max(self.x), interp_fac*self.nx)
-            field_real_space_nc = np.empty([self.nt, len(x_nc), self.ny],
-                                           dtype=float)
-            for it in range(self.nt):
-                for iy in range(self.ny):
-                        f = interp.interp1d(self.x,
-                                            self.field_real_space[it,:,iy])
-                        field_real_space_nc[it,:,iy] = f(x_nc)
-        else:
-            x_nc = self.x
-            field_real_space_nc = self.field_real_space
-
-        if self.lab_frame:
-            nc_file = Dataset(self.out_dir + '/write_field/' +
-                              self.in_field +'_lab_frame.cdf', 'w')
-        elif not self.lab_frame:
-            nc_file = Dataset(self.out_dir + '/write_field/' +
-                              self.in_field +'.cdf', 'w')
-        nc_file.createDimension('x', len(x_nc))
-        nc_file.createDimension('y', self.ny)
-        nc_file.createDimension('t', self.nt)
-        nc_file.createDimension('none', 1)
-        nc_nref = nc_file.createVariable('nref','d', ('none',))
-        nc_tref = nc_file.createVariable('tref','d', ('none',))
-        nc_x = nc_file.createVariable('x','d',('x',))
-        nc_y = nc_file.createVariable('y','d',('y',))
-        nc_t = nc_file.createVariable('t','d',('t',))
-        nc_field = nc_file.createVariable(self.in_field[:self.in_field.find('_')],
-                                      'd',('t', 'x', 'y'))
-
-        nc_field[:,:,:] = field_real_space_nc[:,:,:]
-        nc_nref[:] = self.nref
-        nc_tref[:] = self.tref
-        nc_x[:] = x_nc[:] - x_nc[-1]/2
-        nc_y[:] = self.y[:] - self.y[-1]/2
-        nc_t[:] = self.t[:] - self.t[0]
-        nc_file.close()
+        self.write_field_nc('write_field')
 
         logging.info("Finished write_field...")
 
@@ -1768,57 +3063,137 @@ class Simulation(object):
         * The radial, poloidal, and parallel coordinates are centered at 0.
         * The radial coordinate is interpolated if neccessary to ensure a
           0.5cm resolution consistent with the BES.
+        * See ``write_field_nc`` for the chunking, compression and precision
+          of the output.
         """
         logging.info("Starting write_field_full...")
 
-        if 'write_field_full' not in os.listdir(self.out_dir):
-            os.system("mkdir -p " + self.out_dir + '/write_field_full')
-
         self.calculate_l_par()
+        self.write_field_nc('write_field_full')
+
+        logging.info("Finished write_field_full...")
+
+    def write_field_nc(self, analysis):
+        """
+        Writes the real space field, of dimensions (t, x, y) or (t, x, y, z),
+        to NetCDF in the *analysis* output directory.
+
+        Parameters
+        ----------
+
+        analysis : str
+            Name of the output directory, 'write_field' or
+            'write_field_full'.
+
+        Notes
+        -----
+
+        * The field is written one block at a time, each block holding at
+          most *max_chunk_mem* MB (256 MB if not set) of the output field.
+          If *write_field_chunks* is 'series', the blocks are ranges of the
+          output radial grid covering all times, otherwise they are ranges of
+          time steps, so that each block fills whole NetCDF chunks.
+        * The radial interpolation is done for each block at once from the
+          neighbouring radial points and weights of ``interp_weights``.
+        * The field variable is stored with *write_field_precision* and is
+          compressed with zlib and the shuffle filter if *write_field_zlib*
+          is True.
+        """
+        if analysis not in os.listdir(self.out_dir):
+            os.system("mkdir -p " + self.out_dir + '/' + analysis)
 
         if self.write_field_interp_x:
             #interpolate radial coordinate to be approx 0.5cm
             interp_fac = int(np.ceil(self.x[1]/0.005))
             x_nc = np.linspace(min(self.x), max(self.x), interp_fac*self.nx)
-            field_real_space_nc = np.empty([self.nt, len(x_nc), self.ny,
-                                            self.ntheta], dtype=float)
-            for it in range(self.nt):
-                for iy in range(self.ny):
-                    for iz in range(self.ntheta):
-                        f = interp.interp1d(self.x,
-                                            self.field_real_space[it,:,iy,iz])
-                        field_real_space_nc[it,:,iy,iz] = f(x_nc)
+            idx, weight = self.interp_weights(self.x, x_nc)
         else:
             x_nc = self.x
-            field_real_space_nc = self.field_real_space
+            idx = np.arange(self.nx)
+            weight = None
 
         if self.lab_frame:
-            nc_file = Dataset(self.out_dir + '/write_field_full/' +
+            nc_file = Dataset(self.out_dir + '/' + analysis + '/' +
                               self.in_field +'_lab_frame.cdf', 'w')
         elif not self.lab_frame:
-            nc_file = Dataset(self.out_dir + '/write_field_full/' +
+            nc_file = Dataset(self.out_dir + '/' + analysis + '/' +
                               self.in_field +'.cdf', 'w')
+
+        dims = ('t', 'x', 'y', 'z')[:self.field_real_space.ndim]
+        shape = (self.nt, len(x_nc)) + self.field_real_space.shape[2:]
         nc_file.createDimension('x', len(x_nc))
         nc_file.createDimension('y', self.ny)
-        nc_file.createDimension('z', self.ntheta)
+        if 'z' in dims:
+            nc_file.createDimension('z', self.ntheta)
         nc_file.createDimension('t', self.nt)
         nc_file.createDimension('none', 1)
         nc_nref = nc_file.createVariable('nref','d', ('none',))
         nc_tref = nc_file.createVariable('tref','d', ('none',))
         nc_x = nc_file.createVariable('x','d',('x',))
         nc_y = nc_file.createVariable('y','d',('y',))
-        nc_z = nc_file.createVariable('z','d',('z',))
+        if 'z' in dims:
+            nc_z = nc_file.createVariable('z','d',('z',))
         nc_t = nc_file.createVariable('t','d',('t',))
-        nc_field = nc_file.createVariable(self.in_field[:self.in_field.find('_')],
-                                      'd',('t', 'x', 'y', 'z'))
 
-        nc_field[:,:,:,:] = field_real_space_nc[:,:,:,:]
+        if self.write_field_chunks == 'frame':
+            chunksizes = (1,) + shape[1:]
+        elif self.write_field_chunks == 'series':
+            chunksizes = (self.nt,) + (1,)*(len(shape) - 1)
+        else:
+            chunksizes = None
+        if self.write_field_precision == 'single':
+            nc_dtype = 'f4'
+        else:
+            nc_dtype = 'd'
+        nc_field = nc_file.createVariable(
+                self.in_field[:self.in_field.find('_')], nc_dtype, dims,
+                zlib=self.write_field_zlib, shuffle=self.write_field_zlib,
+                complevel=self.write_field_complevel,
+                contiguous=(chunksizes is None and not self.write_field_zlib),
+                chunksizes=chunksizes)
+
+        # Number of output time steps or radial points per block
+        mem = self.max_chunk_mem if self.max_chunk_mem is not None else 256
+        if self.write_field_chunks == 'series':
+            block_axis = 1
+        else:
+            block_axis = 0
+        item_bytes = np.prod(shape)/shape[block_axis]*8
+        block = max(1, int(mem*1024**2/item_bytes))
+
+        for i_min in range(0, shape[block_axis], block):
+            i_max = min(i_min + block, shape[block_axis])
+            if block_axis == 0:
+                field = self.field_real_space[i_min:i_max]
+                block_idx = idx
+            else:
+                # Input radial points needed by this range of output points
+                x_min = idx[i_min]
+                x_max = min(idx[i_max-1] + 2, self.nx)
+                field = self.field_real_space[:, x_min:x_max]
+                block_idx = idx[i_min:i_max] - x_min
+
+            if weight is None:
+                if block_axis == 0:
+                    field_nc = field
+                else:
+                    field_nc = np.take(field, block_idx, axis=1)
+            else:
+                w = weight[i_min:i_max] if block_axis == 1 else weight
+                w = w.reshape((1, -1) + (1,)*(field.ndim - 2))
+                field_nc = np.take(field, block_idx, axis=1)*(1 - w) + \
+                           np.take(field, block_idx + 1, axis=1)*w
+
+            if block_axis == 0:
+                nc_field[i_min:i_max] = field_nc
+            else:
+                nc_field[:, i_min:i_max] = field_nc
+
         nc_nref[:] = self.nref
         nc_tref[:] = self.tref
         nc_x[:] = x_nc[:] - x_nc[-1]/2
         nc_y[:] = self.y[:] - self.y[-1]/2
-        nc_z[:] = self.l_par[:] - self.l_par[-1]/2
+        if 'z' in dims:
+            nc_z[:] = self.l_par[:] - self.l_par[-1]/2
         nc_t[:] = self.t[:] - self.t[0]
         nc_file.close()
-
-        logging.info("Finished write_field_full...")
@@ -0,0 +1,407 @@
+#########################
+#   gs2_correlation     #
+#   Ferdinand van Wyk   #
+#########################
+
+###############################################################################
+# This file is part of gs2_correlation.
+#
+# gs2_correlation_analysis is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# gs2_correlation is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with gs2_correlation.
+# If not, see <http://www.gnu.org/licenses/>.
+###############################################################################
+
+"""
+.. module:: synthetic
+   :platform: Unix, OSX
+   :synopsis: Writes synthetic GS2 runs with prescribed correlation parameters.
+
+.. moduleauthor:: Ferdinand van Wyk <ferdinandvwyk@gmail.com>
+
+Usage::
+
+    $ python gs2_correlation/synthetic.py scan/run_1/ --nt 500 --nkx 65 \\
+          --nky 33 --ntheta 33 --lx 0.01 --ly 0.02 --tau_c 2e-5 --l_par 4
+
+"""
+
+# Standard
+import os
+import io
+import json
+import argparse
+import configparser
+
+# Third Party
+import numpy as np
+from netCDF4 import Dataset
+import f90nml as nml
+
+# Local
+from gs2_correlation.simulation import Simulation
+
+# Normalization written to the configuration file of a synthetic run, the
+# same as in config_example.ini
+NORMALIZATION = {'rho_tor': 0.8, 'a_minor': 0.58044, 'vth_ref': 1.4587e+05,
+                 'rho_ref': 6.0791e-03, 'bref': 4.9739e-01}
+
+# Circular flux surface with major radius r_geo and minor radius rhoc, in
+# units of a_minor
+GEOMETRY = {'r_geo': 3.0, 'rhoc': 0.8, 'qinp': 2.0, 'shat': 1.0,
+            'drhodpsi': 1.5}
+
+
+def geometry_arrays(ntheta, geometry=GEOMETRY):
+    """
+    Returns the GS2 geometry of a circular flux surface on *ntheta* points.
+
+    Returns
+    -------
+    theta : array_like
+        Theta grid from -pi to pi.
+    g : array_like
+        Geometry file columns: theta, R, Z, alpha, Rprime, Zprime,
+        alpha_prime and bpol, with lengths in units of a_minor and bpol in
+        units of bref.
+    gradpar : array_like
+        Parallel gradient of theta in units of 1/a_minor.
+    """
+    r_geo, rhoc = geometry['r_geo'], geometry['rhoc']
+    qinp, shat = geometry['qinp'], geometry['shat']
+
+    theta = np.linspace(-np.pi, np.pi, ntheta)
+    R = r_geo + rhoc*np.cos(theta)
+    Z = rhoc*np.sin(theta)
+    bpol = rhoc/(qinp*R)
+    bmag = np.sqrt((r_geo/R)**2 + bpol**2)
+    g = np.column_stack([theta, R, Z, -qinp*theta, np.cos(theta),
+                         np.sin(theta), -qinp*shat*theta/rhoc, bpol])
+    gradpar = bpol/(bmag*rhoc)
+
+    return theta, g, gradpar
+
+
+def parallel_length(g, gradpar, geometry=GEOMETRY,
+                    normalization=NORMALIZATION):
+    """
+    Returns the length along the field line in m at each theta, calculated
+    by ``Simulation.calculate_l_par`` from the geometry of the run.
+    """
+    amin, bref = normalization['a_minor'], normalization['bref']
+    ntheta = g.shape[0]
+
+    run = Simulation.__new__(Simulation)
+    run.theta = g[:,0]
+    run.R = g[:,1]*amin
+    run.Z = g[:,2]*amin
+    run.ntheta = ntheta
+    run.bref = bref
+    run.r_geo = geometry['r_geo']*amin
+    run.gradpar = gradpar/amin
+    btor = bref*run.r_geo/run.R[int(ntheta/2)]
+    run.bmag = np.sqrt(btor**2 + (g[:,7]*bref)**2)
+    run.calculate_l_par()
+
+    return run.l_par
+
+
+def box_sizes(g, n0, jtwist, geometry=GEOMETRY, normalization=NORMALIZATION):
+    """
+    Returns the radial and poloidal box sizes in m of the real space field,
+    as calculated when a ``Simulation`` is initialized.
+    """
+    amin = normalization['a_minor']
+    mid = int(g.shape[0]/2)
+
+    delta_rho = ((normalization['rho_tor']/geometry['qinp']) *
+                 (jtwist/(n0*geometry['shat'])))
+    x_box = g[mid,4]*delta_rho*amin
+
+    rmaj = g[mid,1]*amin
+    pitch_angle = np.arctan(g[mid+1,2]/(g[mid,1]*-g[mid+1,3]))
+    y_box = rmaj*2*np.pi/n0*np.sin(pitch_angle)
+
+    return x_box, y_box
+
+
+def write_run(run_folder, nt=100, nkx=33, nky=17, ntheta=33, dt=0.5,
+              t_jitter=0, lx=0.01, ly=0.02, ky=None, tau_c=2e-5, v_y=1e3,
+              l_par=4.0, k_par=0, n0=10, jtwist=5, field='ntot_t',
+              block_size=64, seed=0, geometry=GEOMETRY,
+              normalization=NORMALIZATION):
+    """
+    Writes a synthetic GS2 run with prescribed correlation parameters.
+
+    The run folder contains the NetCDF file 'synthetic.out.nc', with the
+    input file in its *input_file* variable, the geometry file 'synthetic.g'
+    and the input file 'synthetic.in'.
+
+    Parameters
+    ----------
+    run_folder : str
+        Folder the run is written to, which is created if needed.
+    nt, nkx, nky, ntheta : int
+        Number of time steps, radial and poloidal wavenumbers and theta
+        points. *nkx* and *ntheta* should be odd as in GS2.
+    dt : float
+        Time step in GS2 units of a_minor/vth_ref.
+    t_jitter : float
+        Random change of each time step as a fraction of *dt*, between 0
+        (regular grid) and 1.
+    lx, ly : float
+        Radial and poloidal correlation lengths in m.
+    ky : float, optional
+        Poloidal wavenumber of the correlation function in m^-1. By default
+        2 pi/ly, as assumed by the fixed ky poloidal fit.
+    tau_c : float
+        Correlation time in s in the frame moving with *v_y*.
+    v_y : float
+        Poloidal velocity of the fluctuations in m/s.
+    l_par, k_par : float
+        Parallel correlation length in m and wavenumber in m^-1.
+    n0, jtwist : int
+        Toroidal mode number of the first ky and the GS2 jtwist, which set
+        the poloidal and radial box sizes, see ``box_sizes``.
+    field : str
+        Name of the field, with dimensions (t, species, ky, kx, theta, ri).
+    block_size : int
+        Number of time steps calculated and written at once.
+    seed : int
+        Seed of the random number generator.
+    geometry, normalization : dict
+        Flux surface parameters, see ``GEOMETRY``, and normalization
+        parameters, see ``NORMALIZATION``.
+
+    Returns
+    -------
+    info : dict
+        Parameters of the run, including the box sizes, the times in s and
+        the prescribed correlation parameters, which are also written to
+        'synthetic.json' in the run folder.
+
+    Notes
+    -----
+
+    The field is a sum of Fourier modes in x, y and the length along the
+    field line l, with random amplitudes and phases:
+
+    * The power spectrum is exp(-(kx lx)^2/4) exp(-(ky' - ky)^2 ly^2/4)
+      exp(-(kl - k_par)^2 l_par^2/4), so that the correlation functions are
+      exp(-(dx/lx)^2), exp(-(dy/ly)^2) cos(ky dy) and
+      exp(-(dl/l_par)^2) cos(k_par dl), as fitted by ``Simulation``, up to
+      the periodicity of the box. The ky = 0 and Nyquist modes are zero.
+    * The amplitude of every mode is an Ornstein-Uhlenbeck process in time
+      with correlation exp(-|dt|/tau_c), which is exact on any time grid,
+      and its phase moves with *v_y*. The peaks of the time correlation
+      function therefore decay as exp(-|dt|/tau_c).
+    * The modes in l have a period of twice the length of the field line,
+      so that the correlation function is not periodic within it.
+    * The ky > 0 modes are multiplied by 2 as in GS2, see
+      ``Simulation.fourier_correction``.
+
+    The field is calculated and written *block_size* time steps at a time,
+    so any size of run can be written with little memory.
+    """
+    rng = np.random.RandomState(seed)
+    amin = normalization['a_minor']
+    rho_ref = normalization['rho_ref']
+    drhodpsi = geometry['drhodpsi']
+    if ky is None:
+        ky = 2*np.pi/ly
+
+    os.makedirs(run_folder, exist_ok=True)
+    theta, g, gradpar = geometry_arrays(ntheta, geometry)
+    l = parallel_length(g, gradpar, geometry, normalization)
+    x_box, y_box = box_sizes(g, n0, jtwist, geometry, normalization)
+
+    t = dt*(np.arange(nt) + t_jitter*(rng.rand(nt) - 0.5))
+    t_phys = t*amin/normalization['vth_ref']
+
+    # Wavenumbers in m^-1 of the modes in x, y and l
+    kx_m = 2*np.pi*np.fft.fftfreq(nkx, 1./nkx)/x_box
+    ky_m = 2*np.pi*np.arange(nky)/y_box
+    n_l = int(np.ceil((abs(k_par) + 6/l_par)*2*l[-1]/(2*np.pi)))
+    kl_m = 2*np.pi*np.arange(-n_l, n_l + 1)/(2*l[-1])
+
+    spec_x = np.exp(-(kx_m*lx)**2/4)
+    spec_y = np.exp(-(ky_m - ky)**2*ly**2/4)
+    spec_y[[0, -1]] = 0
+    spec_l = np.exp(-(kl_m - k_par)**2*l_par**2/4)
+    amp = np.sqrt(spec_y[:,np.newaxis,np.newaxis] *
+                  spec_x[np.newaxis,:,np.newaxis] *
+                  spec_l[np.newaxis,np.newaxis,:])
+    amp *= 2/np.sqrt(np.sum(amp**2))
+    modes_l = np.exp(1j*np.outer(kl_m, l))
+
+    # GS2 wavenumbers in units of 1/rho_ref, as divided by drhodpsi when read
+    kx = kx_m*rho_ref*drhodpsi
+    ky_gs2 = np.arange(nky)*n0*rho_ref/amin*drhodpsi
+
+    name = os.path.join(run_folder, 'synthetic')
+    input_file = nml.Namelist({
+        'theta_grid_parameters': {'ntheta': ntheta, 'nperiod': 1,
+                                  'rhoc': geometry['rhoc'],
+                                  'qinp': geometry['qinp'],
+                                  'shat': geometry['shat'],
+                                  'R_geo': geometry['r_geo']},
+        'kt_grids_box_parameters': {'nx': int(3*nkx/2) + 1,
+                                    'ny': int(3*(2*nky - 2)/2) + 1,
+                                    'jtwist': jtwist,
+                                    'y0': amin/(n0*rho_ref)},
+        'knobs': {'delt': dt, 'nstep': nt}})
+    with io.StringIO() as fp:
+        input_file.write(fp)
+        input_text = fp.getvalue()
+    with open(name + '.in', 'w') as fp:
+        fp.write(input_text)
+
+    with open(name + '.g', 'w') as fp:
+        fp.write('# shape: circular\n')
+        fp.write('# q = {:12.4e} drhodpsi = {:12.4e}\n'.format(
+                 geometry['qinp'], drhodpsi))
+        fp.write('# theta1 R2 Z3 alpha4 Rprime5 Zprime6 alpha_prime7 bpol8\n')
+        np.savetxt(fp, g, fmt='%20.10e')
+
+    with Dataset(name + '.out.nc', 'w') as ncfile:
+        ncfile.createDimension('t', None)
+        ncfile.createDimension('species', 1)
+        ncfile.createDimension('ky', nky)
+        ncfile.createDimension('kx', nkx)
+        ncfile.createDimension('theta', ntheta)
+        ncfile.createDimension('ri', 2)
+        # GS2 stores new lines in the input file as literal '\n'
+        input_chars = np.array(list(input_text.replace('\n', '\\n')),
+                               dtype='S1')
+        ncfile.createDimension('input_file_dim', len(input_chars))
+
+        for var_name, dims, values in [('t', ('t',), t),
+                                       ('kx', ('kx',), kx),
+                                       ('ky', ('ky',), ky_gs2),
+                                       ('theta', ('theta',), theta),
+                                       ('drhodpsi', (), drhodpsi),
+                                       ('gradpar', ('theta',), gradpar),
+                                       ('Rprime', ('theta',), g[:,4]),
+                                       ('bpol', ('theta',), g[:,7])]:
+            ncfile.createVariable(var_name, 'f8', dims)[:] = values
+        ncfile.createVariable('input_file', 'S1',
+                              ('input_file_dim',))[:] = input_chars
+
+        var = ncfile.createVariable(field, 'f8', ('t', 'species', 'ky', 'kx',
+                                                  'theta', 'ri'))
+        state = (rng.normal(size=amp.shape) +
+                 1j*rng.normal(size=amp.shape))/np.sqrt(2)
+        rho = np.exp(-np.diff(np.concatenate([t_phys[:1], t_phys]))/tau_c)
+        ky_corr = np.full(nky, 2.)
+        ky_corr[0] = 1
+        for t_min in range(0, nt, block_size):
+            t_max = min(t_min + block_size, nt)
+            block = np.empty([t_max - t_min, nky, nkx, ntheta],
+                             dtype=complex)
+            for it in range(t_min, t_max):
+                noise = (rng.normal(size=amp.shape) +
+                         1j*rng.normal(size=amp.shape))/np.sqrt(2)
+                state = rho[it]*state + np.sqrt(1 - rho[it]**2)*noise
+                phase = np.exp(-1j*ky_m*v_y*t_phys[it])*ky_corr
+                block[it-t_min] = np.dot(
+                        (amp*state).reshape(-1, len(kl_m)),
+                        modes_l).reshape(nky, nkx, ntheta) * \
+                        phase[:,np.newaxis,np.newaxis]
+            var[t_min:t_max, 0] = block.view(float).reshape(
+                    block.shape + (2,))
+
+    info = {'cdf_file': name + '.out.nc', 'g_file': name + '.g',
+            'in_file': name + '.in', 'field': field,
+            'nt': nt, 'nkx': nkx, 'nky': nky, 'ntheta': ntheta,
+            't': t_phys.tolist(), 'x_box': x_box, 'y_box': y_box,
+            'l_par_max': float(l[-1]), 'lx': lx, 'ly': ly, 'ky': ky,
+            'tau_c': tau_c, 'v_y': v_y, 'l_par': l_par, 'k_par': k_par,
+            'normalization': dict(normalization)}
+    with open(os.path.join(run_folder, 'synthetic.json'), 'w') as fp:
+        json.dump(info, fp)
+
+    return info
+
+
+def write_config(config_file, run_folder, info, analysis='all',
+                 time_slice=49, options={}):
+    """
+    Writes a configuration file analyzing the synthetic run written by
+    ``write_run`` to *run_folder*.
+
+    The normalization is that of the run and the initial guesses of the fits
+    are the prescribed correlation parameters in *info*, except for a
+    parallel wavenumber of 0, which is replaced by 0.1. The perpendicular
+    and time analyses use the middle theta point. *options* is a dictionary
+    of sections, each a dictionary of options overriding the defaults, e.g.
+    {'general': {'max_chunk_mem': 100}}.
+    """
+    config = configparser.ConfigParser()
+    config['general'] = {
+        'run_folder': os.path.join(run_folder, ''),
+        'out_dir': os.path.join(run_folder, 'correlation_analysis'),
+        'analysis': analysis,
+        'field': info['field'],
+        'species_index': 0,
+        'theta_index': -1 if analysis == 'par' else int(info['ntheta']/2),
+        'zero_bes_scales': False,
+        'zero_zf_scales': True,
+        'time_slice': min(time_slice, info['nt'] - 1 - (info['nt'] % 2))}
+    config['perp'] = {'perp_guess': '[{},{}]'.format(info['lx'], info['ly'])}
+    config['time'] = {'time_guess': '[{},{}]'.format(info['tau_c'], 1),
+                      'time_max': 100*info['tau_c']}
+    # The parallel fit does not move from k = 0, see parallel_fit.fit_par
+    config['par'] = {'par_guess': '[{},{}]'.format(info['l_par'],
+                                                  info['k_par'] or 0.1)}
+    config['normalization'] = info['normalization']
+    config['output'] = {}
+    for section, section_options in options.items():
+        if section not in config:
+            config[section] = {}
+        for option, value in section_options.items():
+            config[section][option] = str(value)
+
+    with open(config_file, 'w') as fp:
+        config.write(fp)
+
+
+#############
+# Main Code #
+#############
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write a synthetic GS2 run '
+                                     'with prescribed correlation parameters')
+    parser.add_argument('run_folder', metavar='run_folder', type=str,
+                        help='Folder the run is written to')
+    for arg, arg_type, default in [('nt', int, 100), ('nkx', int, 33),
+                                   ('nky', int, 17), ('ntheta', int, 33),
+                                   ('dt', float, 0.5), ('t_jitter', float, 0),
+                                   ('lx', float, 0.01), ('ly', float, 0.02),
+                                   ('tau_c', float, 2e-5),
+                                   ('v_y', float, 1e3),
+                                   ('l_par', float, 4.0),
+                                   ('k_par', float, 0), ('n0', int, 10),
+                                   ('jtwist', int, 5), ('seed', int, 0)]:
+        parser.add_argument('--' + arg, type=arg_type, default=default)
+    parser.add_argument('--config', type=str, default=None,
+                        help='Also write a configuration file analyzing the '
+                        'run')
+    parser.add_argument('--analysis', type=str, default='all',
+                        help='Analysis of the configuration file')
+    args = vars(parser.parse_args())
+
+    config_file = args.pop('config')
+    analysis = args.pop('analysis')
+    info = write_run(**args)
+    if config_file is not None:
+        write_config(config_file, args['run_folder'], info, analysis)
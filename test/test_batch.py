@@ -0,0 +1,118 @@
+# Standard
+import os
+import csv
+import json
+import configparser
+
+# Third Party
+import numpy as np
+
+# Local
+import gs2_correlation.batch as batch
+
+class TestClass(object):
+
+    def setup_class(self):
+        os.system('mkdir -p test/test_batch')
+        for run in ['run_1', 'run_2']:
+            os.system('mkdir -p test/test_batch/' + run)
+            os.system('tar -zxf test/test_run.tar.gz -C test/test_batch/' + run)
+
+        config = configparser.ConfigParser()
+        config.read('test/test_config.ini')
+        config['general']['zero_bes_scales'] = 'False'
+        config['general']['out_dir'] = '{run_folder}analysis'
+        with open('test/test_batch/template.ini', 'w') as fp:
+            config.write(fp)
+
+    def teardown_class(self):
+        os.system('rm -rf test/test_batch')
+
+    def test_find_run_folders(self):
+        run_folders = batch.find_run_folders(['test/test_batch/*/test_run/v/id_1',
+                                              'test/test_batch/run_1/test_run/v/id_1/'])
+        assert run_folders == ['test/test_batch/run_1/test_run/v/id_1/',
+                               'test/test_batch/run_2/test_run/v/id_1/']
+
+    def test_write_run_config(self):
+        run_folder = 'test/test_batch/run_1/test_run/v/id_1/'
+        config_file, run = batch.write_run_config('test/test_batch/template.ini',
+                                                  run_folder)
+        assert run.out_dir == run_folder + 'analysis'
+        assert run.cdf_file.startswith(run_folder)
+        config = configparser.ConfigParser()
+        config.read(config_file)
+        assert config['general']['cdf_file'] == run.cdf_file
+
+    def test_run_batch(self):
+        run_folders = batch.find_run_folders(['test/test_batch/*/test_run/v/id_1'])
+        status, out_dirs = batch.run_batch('test/test_batch/template.ini',
+                                           run_folders, workers=2, max_mem=1e-3)
+        assert all(status[f] == 'done' for f in run_folders)
+
+        status, out_dirs = batch.run_batch('test/test_batch/template.ini',
+                                           run_folders, workers=2)
+        assert all(status[f] == 'skipped' for f in run_folders)
+
+        batch.gather_results(status, out_dirs, 'test/test_batch/results.csv')
+        with open('test/test_batch/results.csv', 'r') as fp:
+            rows = list(csv.DictReader(fp))
+        assert [row['run_folder'] for row in rows] == run_folders
+        assert 'perp:lx' in rows[0]
+        results = json.load(open('test/test_batch/results.json', 'r'))
+        assert 'lx_t' in results[run_folders[0]]['perp']
+
+    def test_failed_stage(self):
+        config = configparser.ConfigParser()
+        config.read('test/test_batch/template.ini')
+        config['general']['analysis'] = 'all'
+        config['general']['out_dir'] = '{run_folder}analysis_all'
+        with open('test/test_batch/template_all.ini', 'w') as fp:
+            config.write(fp)
+
+        run_folder = 'test/test_batch/run_1/test_run/v/id_1/'
+        config_file, run = batch.write_run_config('test/test_batch/template_all.ini',
+                                                  run_folder)
+
+        def time_analysis_fail(self):
+            raise RuntimeError('time analysis failed')
+
+        def time_analysis_pass(self):
+            pass
+
+        time_analysis_orig = batch.Simulation.time_analysis
+        try:
+            # perp_analysis writes results.json before time_analysis fails
+            batch.Simulation.time_analysis = time_analysis_fail
+            error = batch.analyze(config_file)
+            assert 'time analysis failed' in error
+            assert os.path.exists(run.out_dir + '/results.json')
+            assert not batch.up_to_date(run, 'test/test_batch/template_all.ini')
+
+            batch.Simulation.time_analysis = time_analysis_pass
+            assert batch.analyze(config_file) is None
+            assert batch.up_to_date(run, 'test/test_batch/template_all.ini')
+        finally:
+            batch.Simulation.time_analysis = time_analysis_orig
+
+    def test_estimate_memory(self):
+        run_folder = 'test/test_batch/run_1/test_run/v/id_1/'
+        config_file, run = batch.write_run_config('test/test_batch/template.ini',
+                                                  run_folder)
+        mem = batch.estimate_memory(run)
+        assert mem > 0
+
+        run.time_interp_fac = 4
+        assert np.isclose(batch.estimate_memory(run), 4*mem)
+
+        run.time_interp_fac = 1
+        run.real_dtype = np.float32
+        assert np.isclose(batch.estimate_memory(run), mem/2)
+
+        run.real_dtype = np.float64
+        run.time_range = [0, 10]
+        assert batch.estimate_memory(run) < mem
+
+        run.time_range = [0, None]
+        run.max_chunk_mem = 100
+        assert batch.estimate_memory(run) > 100
@@ -0,0 +1,84 @@
+# Standard
+import os
+
+# Third Party
+import numpy as np
+import scipy.signal as sig
+
+# Local
+import gs2_correlation.fft_backend as fft_backend
+
+class TestClass(object):
+
+    def teardown_class(self):
+        fft_backend.configure()
+        fft_backend.wisdom_file = None
+        os.system('rm -f test/test_wisdom')
+
+    def test_autocorr_same_2d(self):
+        a = np.random.rand(9, 6)
+        corr = fft_backend.autocorr_same(a, (0,1))
+        assert np.allclose(corr, sig.fftconvolve(a, a[::-1,::-1], 'same'))
+
+    def test_autocorr_same_batched(self):
+        a = np.random.rand(5, 8, 7)
+        corr = fft_backend.autocorr_same(a, (1,))
+        for i in range(5):
+            for k in range(7):
+                assert np.allclose(corr[i,:,k],
+                                   sig.correlate(a[i,:,k], a[i,:,k], 'same'))
+
+    def test_autocorr_lags(self):
+        a = np.random.rand(9, 4, 8)
+        full = fft_backend.autocorr_same(a, (0,2))
+        corr = fft_backend.autocorr_lags(a, (0,2), [4, 5, 7])
+        assert np.allclose(corr, full[:,:,[4,5,7]])
+
+    def test_autocorr_binned(self):
+        a = np.random.rand(9, 4, 8)
+        t = 0.5*np.arange(9)
+        n_pairs = fft_backend.autocorr_same(np.ones(9), (0,))
+        corr = fft_backend.autocorr_binned(a, t, 2)
+        assert np.allclose(corr*n_pairs[:,np.newaxis,np.newaxis],
+                           fft_backend.autocorr_same(a, (0,2)))
+        assert np.allclose(fft_backend.autocorr_binned(a, t, 2, idx=[4, 6]),
+                           corr[:,:,[4, 6]])
+
+        # Direct sum over all pairs of an irregular time grid
+        t = 0.5*np.arange(9) + 0.1*np.random.rand(9)
+        dt_bin = (t[-1] - t[0])/8
+        corr_sum = np.zeros([9, 4, 8])
+        weight_sum = np.zeros(9)
+        for i in range(9):
+            for j in range(9):
+                u = (t[j] - t[i])/dt_bin
+                lower = int(np.floor(u))
+                for b, w in [(lower, 1 - u + lower), (lower + 1, u - lower)]:
+                    if -4 <= b <= 4 and w > 0 and (b != 0 or i == j):
+                        weight_sum[b+4] += w
+                        for ix in range(4):
+                            corr_sum[b+4,ix] += w*sig.correlate(a[j,ix],
+                                                                a[i,ix], 'same')
+        corr = fft_backend.autocorr_binned(a, t, 2)
+        assert np.allclose(corr, corr_sum/weight_sum[:,np.newaxis,np.newaxis])
+
+    def test_plan_reuse(self):
+        fft_backend.clear_plans()
+        a = np.random.rand(4, 6) + 1j*np.random.rand(4, 6)
+        out = fft_backend.fftn(a, (0,1))
+        assert np.allclose(out, np.fft.fftn(a))
+        out_2 = fft_backend.fftn(2*a, (0,1))
+        assert out_2 is out
+        assert len(fft_backend.plans) == 1
+
+    def test_irfftn(self):
+        a = np.random.rand(3, 5, 4) + 1j*np.random.rand(3, 5, 4)
+        assert np.allclose(fft_backend.irfftn(a, (1,2)),
+                           np.fft.irfftn(a, axes=(1,2)))
+
+    def test_wisdom(self):
+        fft_backend.configure(n_threads=2, wisdom='test/test_wisdom')
+        assert fft_backend.threads == 2
+        fft_backend.rfftn(np.random.rand(16), (0,))
+        fft_backend.save_wisdom()
+        assert os.path.isfile('test/test_wisdom')
@@ -0,0 +1,89 @@
+# Standard
+import os
+import json
+
+# Third Party
+import numpy as np
+
+# Local
+import gs2_correlation.profiling as profiling
+
+class TestClass(object):
+
+    def teardown_class(self):
+        os.system('rm -f test/test_profile.json')
+
+    def test_stage(self):
+        reset_peak = profiling.RESET_PEAK
+        # Without tracemalloc.reset_peak, i.e. before Python 3.9
+        for reset in sorted({reset_peak, False}):
+            profiling.RESET_PEAK = reset
+            profiler = profiling.Profiler()
+            with profiler.stage('outer'):
+                a = np.ones(2**20)
+                for i in range(3):
+                    with profiler.stage('inner'):
+                        b = np.ones(2**21)
+                        del b
+            profiler.close()
+
+            outer = profiler.records['outer']
+            inner = profiler.records['outer/inner']
+            assert inner['calls'] == 3
+            assert inner['alloc_peak_mb'] >= 16
+            assert abs(inner['alloc_net_mb']) < 1
+            assert outer['alloc_peak_mb'] >= 24
+            assert outer['alloc_net_mb'] >= 8
+            assert outer['wall'] >= inner['wall']
+            if profiling.current_rss() is not None:
+                assert outer['rss_net_mb'] is not None
+        profiling.RESET_PEAK = reset_peak
+
+    def test_arrays_not_traced(self):
+        # NumPy < 1.13 or Python < 3.6
+        arrays_traced = profiling.arrays_traced
+        profiling.arrays_traced = lambda: False
+        try:
+            profiler = profiling.Profiler()
+        finally:
+            profiling.arrays_traced = arrays_traced
+        for i in range(2):
+            with profiler.stage('stage'):
+                a = np.ones(2**20)
+        report = profiler.report()
+        profiler.close()
+
+        assert not profiler.alloc_traced
+        stage = report['stages']['stage']
+        assert stage['calls'] == 2
+        assert stage['alloc_peak_mb'] is None
+        assert stage['alloc_net_mb'] is None
+        assert report['total']['alloc_peak_mb'] is None
+        assert stage['peak_rss_mb'] > 0
+
+    def test_profile_methods(self):
+        class Analysis(object):
+            def run(self, n):
+                return self.step(n) + 1
+            def step(self, n):
+                return n
+
+        obj = Analysis()
+        profiler = profiling.Profiler()
+        profiler.profile_methods(obj, ['run', 'step'])
+        assert obj.run(1) == 2
+        assert obj.run.__name__ == 'run'
+        assert list(profiler.records) == ['run/step', 'run']
+        assert 'run' not in vars(Analysis())
+
+        profiler.dump('test/test_profile.json')
+        profiler.load('test/test_profile.json')
+        assert not os.path.exists('test/test_profile.json')
+        assert profiler.records['run']['calls'] == 2
+
+        profiler.write('test/test_profile.json', nt=4)
+        profile = json.load(open('test/test_profile.json'))
+        profiler.close()
+        assert profile['info'] == {'nt': 4}
+        assert profile['total']['wall'] > 0
+        assert set(profile['stages']) == {'run', 'run/step'}
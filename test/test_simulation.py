@@ -2,15 +2,23 @@
 import os
 import pytest
 import json
+import configparser
 
 # Third Party
 import numpy as np
+import scipy.signal as sig
+import scipy.interpolate as interp
 import matplotlib
 matplotlib.use('Agg') # specifically for Travis CI to avoid backend errors
 import f90nml as nml
+import lmfit as lm
+from netCDF4 import Dataset
 
 # Local
 from gs2_correlation.simulation import Simulation
+import gs2_correlation.fft_backend as fft_backend
+import gs2_correlation.fitting_functions as fit
+import gs2_correlation.parallel_fit as parallel_fit
 
 class TestClass(object):
 
@@ -93,6 +101,93 @@ class TestClass(object):
         arr_shapes = (run.nt, run.nkx, run.nky, 1, 2)
         assert field_shape == arr_shapes
 
+    def test_read_netcdf_chunks(self, run):
+        run.time_interpolate_bool = False
+        run.read_netcdf()
+        full_field = run.field
+        run.max_chunk_mem = 0.01
+        chunks = [field for out_idx, field, t in run.read_netcdf_chunks()]
+        assert len(chunks) > 1
+        assert (np.concatenate(chunks) == full_field).all()
+
+    def test_stream_real_space(self, run):
+        config = configparser.ConfigParser()
+        config.read('test/test_config.ini')
+        config['general']['analysis'] = 'time'
+        config['general']['zero_bes_scales'] = 'False'
+        config['general']['time_interp_fac'] = '2'
+        with open('test/test_run/full_config.ini', 'w') as configfile:
+            config.write(configfile)
+        config['general']['max_chunk_mem'] = '0.05'
+        with open('test/test_run/stream_config.ini', 'w') as configfile:
+            config.write(configfile)
+
+        full = Simulation('test/test_run/full_config.ini')
+        stream = Simulation('test/test_run/stream_config.ini')
+        assert stream.chunk_size() < stream.nt
+        assert stream.field is None
+        assert stream.field_real_space.shape == full.field_real_space.shape
+        assert np.allclose(stream.field_real_space, full.field_real_space)
+
+    def test_cache(self, run):
+        config = configparser.ConfigParser()
+        config.read('test/test_config.ini')
+        config['general']['analysis'] = 'time'
+        config['general']['zero_bes_scales'] = 'False'
+        config['general']['cache_dir'] = 'test/test_run/cache'
+        with open('test/test_run/cache_config.ini', 'w') as configfile:
+            config.write(configfile)
+
+        first = Simulation('test/test_run/cache_config.ini')
+        assert os.listdir('test/test_run/cache') == [first.cache_key()]
+        second = Simulation('test/test_run/cache_config.ini')
+        assert isinstance(second.field_real_space, np.memmap)
+        assert np.allclose(second.field_real_space, first.field_real_space)
+        assert (second.t == first.t).all()
+        assert (second.dx == first.dx).all()
+        assert (second.dy == first.dy).all()
+        assert second.nt_slices == first.nt_slices
+
+        second.time_interp_fac = 2
+        assert second.cache_key() != first.cache_key()
+
+        config['general']['time_interp_method'] = 'fft'
+        config['general']['time_interp_fac'] = '2'
+        with open('test/test_run/cache_config.ini', 'w') as configfile:
+            config.write(configfile)
+        with pytest.warns(UserWarning):
+            fft = Simulation('test/test_run/cache_config.ini')
+        assert fft.time_interp_method == 'linear'
+        assert fft.field_real_space.shape[0] == 2*first.nt
+
+    def test_precision(self, run):
+        config = configparser.ConfigParser()
+        config.read('test/test_config.ini')
+        config['general']['zero_bes_scales'] = 'False'
+        with open('test/test_run/double_config.ini', 'w') as configfile:
+            config.write(configfile)
+        config['general']['precision'] = 'single'
+        with open('test/test_run/single_config.ini', 'w') as configfile:
+            config.write(configfile)
+
+        double = Simulation('test/test_run/double_config.ini')
+        single = Simulation('test/test_run/single_config.ini')
+        assert single.field_real_space.dtype == np.float32
+        assert np.allclose(single.field_real_space, double.field_real_space,
+                           rtol=0, atol=1e-5*np.abs(double.field_real_space).max())
+
+        double.perp_analysis()
+        single.perp_analysis()
+        assert single.perp_corr_x.dtype == np.float32
+        assert np.allclose(single.perp_corr_x, double.perp_corr_x, atol=1e-5)
+        assert np.allclose(single.perp_corr_y, double.perp_corr_y, atol=1e-5)
+        # The radial correlation function of the test run is not Gaussian,
+        # so only the poloidal fit is well conditioned enough to compare
+        assert np.allclose(single.perp_fit_y, double.perp_fit_y, rtol=1e-3)
+
+        single.precision = 'double'
+        assert single.cache_key() == double.cache_key()
+
     def test_read_geometry_file(self, run):
         run.read_geometry_file()
         assert run.geometry.shape[1] > 6
@@ -110,6 +205,11 @@ class TestClass(object):
         os.system('mv test/test_run/v/id_1/v_id_1.tmp test/test_run/v/id_1/v_id_1.in')
         os.system('mv test/test_run/v/id_1/.v_id_1.tmp test/test_run/v/id_1/.v_id_1.in')
 
+    def test_extract_input_file(self, run):
+        assert 'input_file.in' not in os.listdir(run.run_folder)
+        with Dataset(run.cdf_file, 'r') as ncfile:
+            assert '&theta_grid_parameters' in run.extract_input_file(ncfile)
+
     def test_time_interpolate(self, run):
         field_shape = run.field.shape
         arr_shapes = (run.nt, run.nkx, run.nky, run.ntheta)
@@ -122,6 +222,36 @@ class TestClass(object):
         field_shape = run.field.shape
         assert field_shape == arr_shapes
 
+    def test_time_interpolate_linear(self, run):
+        run.time_interp_fac = 3
+        run.t = np.linspace(0, 1, 11)**2
+        run.nt = 11
+        run.field = np.cos(run.t)[:,np.newaxis,np.newaxis,np.newaxis] * \
+                    np.ones([11, 2, 3, 1])
+        t_orig = run.t
+        field_orig = run.field
+        run.time_interpolate()
+        assert run.field.shape == (33, 2, 3, 1)
+        assert np.allclose(run.field[:,1,2,0],
+                           np.interp(run.t, t_orig, field_orig[:,1,2,0]))
+
+    def test_time_interpolate_cubic(self, run):
+        run.time_interp_method = 'cubic'
+        run.time_interp_fac = 4
+        arr_shapes = (run.time_interp_fac*run.nt, run.nkx, run.nky, run.ntheta)
+        run.time_interpolate()
+        assert run.field.shape == arr_shapes
+
+    def test_time_interpolate_fft(self, run):
+        run.time_interp_method = 'fft'
+        run.time_interp_fac = 4
+        run.t = np.linspace(0, 1, 20, endpoint=False)
+        run.nt = 20
+        run.field = np.exp(2j*np.pi*3*run.t)[:,np.newaxis,np.newaxis,np.newaxis]
+        run.time_interpolate()
+        assert len(run.t) == 4*19 + 1
+        assert np.allclose(run.field[:,0,0,0], np.exp(2j*np.pi*3*run.t))
+
     def test_zero_bes_scales(self, run):
         assert (run.field[:, 1, 1, 0] == 0).all()
 
@@ -131,19 +261,124 @@ class TestClass(object):
     def test_to_lab_frame(self, run):
         run.field = np.ones([51,5,6,9])
         run.to_lab_frame()
-        assert np.abs(run.field[5,0,3,0] - np.real(np.exp(1j*3*5*run.omega*run.t[5]))) < 1e-5
+        assert run.field.dtype == run.complex_dtype
+        assert np.abs(run.field[5,0,3,0] - np.exp(1j*3*5*run.omega*run.t[5])) < 1e-5
+
+        run.complex_dtype = np.complex64
+        run.field = np.ones([51,5,6,9], dtype=np.complex64)
+        run.to_lab_frame()
+        assert run.field.dtype == np.complex64
+        assert np.abs(run.field[5,0,3,0] - np.exp(1j*3*5*run.omega*run.t[5])) < 1e-5
+
+    def test_lab_frame_window(self, run):
+        config = configparser.ConfigParser()
+        config.read('test/test_config.ini')
+        config['general']['analysis'] = 'time'
+        config['general']['zero_bes_scales'] = 'False'
+        config['general']['lab_frame'] = 'True'
+        config['general']['time_interp_fac'] = '2'
+        with open('test/test_run/lab_field_config.ini', 'w') as configfile:
+            config.write(configfile)
+        config['general']['lab_frame_method'] = 'window'
+        with open('test/test_run/lab_window_config.ini', 'w') as configfile:
+            config.write(configfile)
+
+        field = Simulation('test/test_run/lab_field_config.ini')
+        window = Simulation('test/test_run/lab_window_config.ini')
+        assert window.field.shape[0] == len(window.t_field)
+        assert window.field_real_space.shape == (0, window.nx, window.ny)
+        assert (window.t == field.t).all()
+        assert window.nt_slices == field.nt_slices
+
+        it = 1
+        t_slice = slice(it*field.time_slice, (it+1)*field.time_slice)
+        assert np.allclose(window.lab_frame_window(it),
+                           field.field_real_space[t_slice])
+        assert window.field.shape[0] == len(window.t_field)
+
+        field.field_normalize_time()
+        window.field_normalize_time(it)
+        assert np.allclose(window.field_real_space_norm,
+                           field.field_real_space_norm[t_slice])
 
     def test_field_to_complex(self, run):
         assert np.iscomplexobj(run.field) == True
 
+    def test_field_to_complex_view(self, run):
+        run.field = np.random.randn(4, 3, 5, 1, 2)
+        field = run.field
+        run.field_to_complex()
+        assert np.shares_memory(run.field, field)
+        assert (run.field == field[...,0] + 1j*field[...,1]).all()
+
+        # Swapped axes as returned by read_field_slice are copied
+        run.field = np.swapaxes(np.random.randn(4, 5, 3, 1, 2), 1, 2)
+        field = run.field
+        run.field_to_complex()
+        assert not np.shares_memory(run.field, field)
+        assert (run.field == field[...,0] + 1j*field[...,1]).all()
+
     def test_fourier_correction(self, run):
-        run.field = np.ones([51, 5, 5, 9])
-        run.fourier_correction()
-        assert ((run.field[:,:,1:,:] - 0.5) < 1e-5).all()
+        corr = run.fourier_correction()
+        assert len(corr) == run.nky
+        assert corr[0] == 1
+        assert ((corr[1:] - 0.5) < 1e-5).all()
 
     def test_field_to_real_space(self, run):
         assert run.field_real_space.shape == (run.nt, run.nx, run.ny)
 
+    def test_field_to_real_space_fused(self, run):
+        field = np.random.randn(4, 6, 5, 1) + 1j*np.random.randn(4, 6, 5, 1)
+        run.nkx = 6
+        run.nky = 5
+        run.nx = 6
+        run.ny = 8
+        run.box_idx = [0, 0]
+        run.field = field.copy()
+        run.field_to_real_space()
+
+        field[:,:,1:,:] /= 2
+        expected = np.roll(np.fft.irfftn(field, axes=(1,2)), 3, axis=1)
+        expected = expected*6*8*run.rho_star
+        assert np.allclose(run.field_real_space, expected)
+
+    def test_field_to_real_space_plans(self, run):
+        run.field = np.ones([4, 5, 4, 1], dtype=complex)
+        run.nkx = 5
+        run.nky = 4
+        run.nx = 5
+        run.ny = 6
+        run.box_idx = [0, 0]
+        fft_backend.clear_plans()
+        run.field_to_real_space()
+        plan = list(fft_backend.plans.values())[0]
+        run.field = np.zeros([4, 5, 4, 1], dtype=complex)
+        run.field_to_real_space()
+        assert list(fft_backend.plans.values()) == [plan]
+        assert run.field_real_space.shape == (4, 5, 6, 1)
+        assert (run.field_real_space == 0).all()
+
+    def test_field_to_real_space_box(self, run):
+        field = np.random.randn(4, 12, 9, 2) + 1j*np.random.randn(4, 12, 9, 2)
+        run.nkx = 12
+        run.nky = 9
+        run.field = field
+        run.domain = 'full'
+        run.box_idx = [0, 0]
+        run.nx = 12
+        run.ny = 16
+        run.field_to_real_space()
+        full = run.field_real_space
+
+        run.field = field
+        run.domain = 'middle'
+        run.box_idx = [3, 5]
+        run.nx = 7
+        run.ny = 5
+        run.field_to_real_space()
+        assert run.field_real_space.shape == (4, 7, 5, 2)
+        assert np.allclose(run.field_real_space, full[:,3:10,5:10,:])
+
     def test_domain_reduce(self, run):
         run.box_size = [0.0005, 0.25]
         original_max_x = run.x[-1]
@@ -168,6 +403,53 @@ class TestClass(object):
         assert len(run.dx)%2 == 1
         assert len(run.dy)%2 == 1
 
+    def test_run_stages(self, run):
+        run.field_real_space = np.random.randn(*run.field_real_space.shape)
+        run.stage_workers = 2
+        for i in range(4):
+            setattr(run, 'stage_' + str(i),
+                    lambda i=i: run.write_results('stage_' + str(i), {}))
+        run.run_stages(['write_field'] + ['stage_' + str(i) for i in range(4)])
+        assert ('ntot_t.cdf' in
+                os.listdir('test/test_run/v/id_1/analysis/write_field'))
+        results = json.load(open('test/test_run/v/id_1/analysis/results.json'))
+        assert all('stage_' + str(i) in results for i in range(4))
+        assert run.field_real_space.flags.writeable
+
+        def modify_field():
+            run.field_real_space[0] = 0
+        run.modify_field = modify_field
+        with pytest.raises(RuntimeError):
+            run.run_stages(['write_field', 'modify_field'])
+        run.stage_workers = 1
+        with pytest.raises(ValueError):
+            run.run_stages(['modify_field'])
+
+    def test_profile(self, run):
+        assert run.profiler is None
+        assert 'read_netcdf' not in vars(run)
+
+        run = Simulation('test/test_config.ini', profile=True)
+        assert 'read_netcdf' in run.profiler.records
+        assert 'field_to_real_space' in run.profiler.records
+        run.field_real_space = np.random.randn(*run.field_real_space.shape)
+        run.stage_workers = 2
+        run.stage_0 = lambda: run.field_odd_pts()
+        run.run_stages(['write_field', 'stage_0'])
+        assert 'stage_0' not in run.profiler.records
+        assert 'field_odd_pts' in run.profiler.records
+        assert not os.path.exists(run.stage_profile_file('write_field'))
+
+        run.analysis = 'write_field'
+        run.run_analysis()
+        profile = json.load(open('test/test_run/v/id_1/analysis/profile.json'))
+        assert profile['info']['field_shape'] == [run.nt, run.nx, run.ny,
+                                                  run.ntheta]
+        stage = profile['stages']['write_field/write_field_nc']
+        assert stage['calls'] == 2
+        assert stage['wall'] > 0
+        assert stage['alloc_peak_mb'] >= stage['alloc_net_mb']
+
     def test_perp_analysis(self, run):
         run.perp_analysis()
         assert len(run.perp_fit_x) == run.nt_slices
@@ -202,6 +484,157 @@ class TestClass(object):
         t = json.load(open('test/test_run/v/id_1/analysis/results.json', 'r'))
         assert t['test1']['test'] == 0
 
+    def test_perp_window_stats(self, run):
+        np.random.seed(0)
+        run.field_real_space = np.random.randn(run.nt, run.nx, run.ny)
+        run.perp_stream = False
+        run.field_normalize_perp()
+        run.calculate_perp_corr()
+        corr_fn_x = run.perp_corr_x[run.time_slice:2*run.time_slice]
+        corr_fn_y = run.perp_corr_y[run.time_slice:2*run.time_slice]
+        avg_corr_x, corr_std_x, avg_corr_y, corr_std_y = \
+                run.perp_window_stats(1)
+        assert np.allclose(avg_corr_x, np.mean(corr_fn_x, axis=(0,2)))
+        assert np.allclose(corr_std_x, np.std(corr_fn_x, axis=(0,2)),
+                           atol=1e-12)
+        assert np.allclose(avg_corr_y, np.mean(corr_fn_y, axis=(0,1)))
+        assert np.allclose(corr_std_y, np.std(corr_fn_y, axis=(0,1)),
+                           atol=1e-12)
+        # The correlation function is 1 at zero separation
+        assert corr_std_x[int(run.nx/2)] < 1e-12
+        assert corr_std_y[int(run.ny/2)] < 1e-12
+
+        run.perp_stream = True
+        stream_stats = run.perp_window_stats(1)
+        assert run.perp_corr_x.shape == (run.time_slice, run.nx, run.ny)
+        for stream_stat, stat in zip(stream_stats, [avg_corr_x, corr_std_x,
+                                                    avg_corr_y, corr_std_y]):
+            assert np.allclose(stream_stat, stat)
+
+    def test_perp_spectra(self, run):
+        run.nkx, run.nky = 9, 6
+        run.nx, run.ny = 9, 9
+        run.time_slice = 7
+        run.field = (np.random.randn(7, 9, 6, 1) +
+                     1j*np.random.randn(7, 9, 6, 1))
+        run.perp_engine = 'spectral'
+        run.perp_power_x, run.perp_power_y = run.perp_spectra()
+        avg_corr_x, corr_std_x, avg_corr_y, corr_std_y = \
+                run.perp_window_stats(0)
+
+        # Circular correlation of the real space field with the mean of
+        # every line removed
+        field = np.fft.irfftn(run.field[:,:,:,0]*run.fourier_correction(),
+                              axes=(1,2), s=(9, 10))
+        for axis, n, avg_corr in [(1, 9, avg_corr_x), (2, 9, avg_corr_y)]:
+            field_norm = field - np.mean(field, axis=axis, keepdims=True)
+            corr = np.array([np.sum(field_norm*np.roll(field_norm, -m, axis),
+                                    axis=(1,2))
+                             for m in range(-(n//2), n//2 + 1)]).T
+            corr /= corr[:, n//2, np.newaxis]
+            assert np.allclose(avg_corr, np.mean(corr, axis=0))
+
+    def test_perp_engine_spectral(self, run):
+        config = configparser.ConfigParser()
+        config.read('test/test_config.ini')
+        config['general']['zero_bes_scales'] = 'False'
+        config['perp']['perp_engine'] = 'spectral'
+        with open('test/test_run/spectral_config.ini', 'w') as configfile:
+            config.write(configfile)
+        config['general']['max_chunk_mem'] = '0.05'
+        with open('test/test_run/spectral_stream_config.ini', 'w') as configfile:
+            config.write(configfile)
+
+        spectral = Simulation('test/test_run/spectral_config.ini')
+        stream = Simulation('test/test_run/spectral_stream_config.ini')
+        assert spectral.field is None
+        assert spectral.field_real_space.shape == (0, spectral.nx, spectral.ny)
+        assert spectral.perp_power_x.shape == (spectral.nt, spectral.nkx)
+        assert spectral.perp_power_y.shape == (spectral.nt, spectral.nky)
+        assert stream.field_real_space.shape[0] == 0
+        assert np.allclose(stream.perp_power_x, spectral.perp_power_x)
+        assert np.allclose(stream.perp_power_y, spectral.perp_power_y)
+
+        spectral.perp_analysis()
+        assert len(spectral.perp_fit_x) == spectral.nt_slices
+        assert len(spectral.perp_fit_y) == spectral.nt_slices
+        results = json.load(open('test/test_run/v/id_1/analysis/results.json',
+                                 'r'))
+        assert 'ly' in results['perp']
+
+        del config['general']['max_chunk_mem']
+        config['general']['domain'] = 'middle'
+        with open('test/test_run/spectral_middle_config.ini', 'w') as configfile:
+            config.write(configfile)
+        with pytest.warns(UserWarning):
+            middle = Simulation('test/test_run/spectral_middle_config.ini')
+        assert middle.perp_engine == 'real'
+        assert middle.field_real_space.shape[1:] == (middle.nx, middle.ny)
+
+    def test_perp_spectral_stats(self, run):
+        # Homogeneous random field with a correlation length much smaller
+        # than the domain, for which both engines should agree
+        nkx, nky = 64, 33
+        kx = np.fft.fftfreq(nkx)*nkx
+        ky = np.arange(nky)
+        amp = np.exp(-(kx[:,np.newaxis]/16)**2 - (ky[np.newaxis,:]/12)**2)
+        run.field = (amp*(np.random.randn(9, nkx, nky) +
+                          1j*np.random.randn(9, nkx, nky)))[...,np.newaxis]
+        run.nkx, run.nky = nkx, nky
+        run.nx, run.ny = nkx, 2*(nky - 1)
+        run.x, run.y = np.arange(run.nx), np.arange(run.ny)
+        run.time_slice = 9
+        run.perp_power_x, run.perp_power_y = run.perp_spectra()
+        run.field_to_real_space()
+        run.field_odd_pts()
+        run.field_real_space = run.field_real_space[:,:,:,0]
+
+        run.perp_engine = 'real'
+        run.perp_stream = True
+        real_stats = run.perp_window_stats(0)
+        run.perp_engine = 'spectral'
+        spectral_stats = run.perp_window_stats(0)
+
+        for real_corr, spectral_corr, n in [(real_stats[0], spectral_stats[0],
+                                             run.nx),
+                                            (real_stats[2], spectral_stats[2],
+                                             run.ny)]:
+            assert spectral_corr.shape == (n,)
+            assert spectral_corr[n//2] == 1
+            assert np.allclose(spectral_corr[n//2-5:n//2+6],
+                               real_corr[n//2-5:n//2+6], atol=0.1)
+
+    def test_fit_chain(self, run):
+        run.fit_warm_start = 'serial'
+        assert run.fit_chain('time_osc', 1, 2) == run.fit_chain('time_osc', 0, 3)
+        run.fit_warm_start = 'window'
+        assert run.fit_chain('time_osc', 1, 2) == run.fit_chain('time_osc', 0, 2)
+        assert run.fit_chain('time_osc', 1, 2) != run.fit_chain('time_osc', 1, 3)
+        run.fit_warm_start = 'independent'
+        assert run.fit_chain('time_osc', 1, 2) != run.fit_chain('time_osc', 0, 2)
+
+    def test_run_fits(self, run):
+        dx = np.linspace(-1, 1, 21)
+        np.random.seed(0)
+        tasks = []
+        for it in range(3):
+            for ix in range(2):
+                corr_fn = fit.gauss(dx, 0.2*(it+ix+1), 0) + \
+                          0.01*np.random.randn(len(dx))
+                tasks.append(((ix, it), parallel_fit.fit_perp_x, {'l': 0.5},
+                              (corr_fn, dx)))
+
+        for chain in [lambda ix, it: ix, lambda ix, it: (ix, it)]:
+            chain_tasks = [(chain(*task[0]),) + task[1:] for task in tasks]
+            serial = parallel_fit.run_fits(chain_tasks, 1)
+            pool = parallel_fit.run_fits(chain_tasks, 3)
+            for serial_fit, pool_fit in zip(serial, pool):
+                assert serial_fit['values'] == pool_fit['values']
+                assert np.array_equal(serial_fit['covar'], pool_fit['covar'])
+            for i, (ix, it) in enumerate(task[0] for task in tasks):
+                assert np.isclose(np.abs(serial[i]['values']['l']),
+                                  0.2*(it+ix+1), rtol=0.1)
+
     def test_perp_analysis_ky_free(self, run):
         run.ky_free = True
         run.perp_guess_ky = 1
@@ -236,12 +669,19 @@ class TestClass(object):
         assert run.field_real_space_norm_x.shape == (run.nt, run.nx, run.ny)
         assert run.field_real_space_norm_y.shape == (run.nt, run.nx, run.ny)
 
+        run.field_real_space = np.random.randn(run.nt, run.nx, run.ny)
+        run.field_normalize_perp()
+        assert np.allclose(np.mean(run.field_real_space_norm_x, axis=1), 0)
+        assert np.allclose(np.std(run.field_real_space_norm_x, axis=1), 1)
+        assert np.allclose(np.mean(run.field_real_space_norm_y, axis=2), 0)
+        assert np.allclose(np.std(run.field_real_space_norm_y, axis=2), 1)
+
     def test_perp_norm_mask(self, run):
-        run.perp_corr_x = np.ones([51,5,5])
-        run.perp_corr_y = np.ones([51,5,5])
-        run.perp_norm_mask()
-        assert np.abs(run.perp_corr_x[0,2,0] - 1./5.) < 1e-5
-        assert np.abs(run.perp_corr_y[0,0,2] - 1./5.) < 1e-5
+        run.nx = 5
+        run.ny = 5
+        mask_x, mask_y = run.perp_norm_mask()
+        assert np.abs(1./mask_x[2] - 1./5.) < 1e-5
+        assert np.abs(1./mask_y[2] - 1./5.) < 1e-5
 
     def test_calculate_perp_corr(self, run):
         run.field_normalize_perp()
@@ -249,6 +689,20 @@ class TestClass(object):
         assert run.perp_corr_x.shape == (run.nt, run.nx, run.ny)
         assert run.perp_corr_y.shape == (run.nt, run.nx, run.ny)
 
+        field = np.random.randn(4, 7, 9)
+        run.nx = 7
+        run.ny = 9
+        run.field_real_space_norm_x = field
+        run.field_real_space_norm_y = 2*field
+        run.calculate_perp_corr()
+        mask_x, mask_y = run.perp_norm_mask()
+        assert np.allclose(run.perp_corr_x[1,:,3],
+                           sig.correlate(field[1,:,3], field[1,:,3],
+                                         'same')/mask_x)
+        assert np.allclose(run.perp_corr_y[2,4,:],
+                           sig.correlate(2*field[2,4,:], 2*field[2,4,:],
+                                         'same')/mask_y)
+
     def test_time_analysis(self, run):
         run.lab_frame = False
         run.time_analysis()
@@ -262,11 +716,12 @@ class TestClass(object):
         assert ('corr_time.pdf' in os.listdir('test/test_run/v/id_1/analysis/time'))
         assert run.field_real_space.shape == (run.nt, run.nx, run.ny)
         assert run.time_corr.shape == (run.nt_slices, run.time_slice,
-                                       run.nx, run.ny)
+                                       run.nx, run.npeaks_fit)
         assert ('corr_fns' in os.listdir('test/test_run/v/id_1/analysis/time'))
 
     def test_time_analysis_lab_frame(self, run):
         run.lab_frame = True
+        run.time_corr_full = True
         run.time_analysis()
 
         results = json.load(open('test/test_run/v/id_1/analysis/results.json', 'r'))
@@ -281,14 +736,103 @@ class TestClass(object):
                                        run.nx, run.ny)
         assert ('corr_fns' in os.listdir('test/test_run/v/id_1/analysis/time_lab_frame'))
 
+    def test_time_corr_peaks(self, run):
+        run.time_slice = 21
+        run.ny = 5
+        run.npeaks_fit = 2
+        run.time_corr_full = False
+        run.dt = np.linspace(-1, 1, run.time_slice)
+        t_peak = np.array([[0.013, 0.21], [-0.3, -0.52]])
+        t_peak_grid = np.round(t_peak/0.1)*0.1
+        run.time_corr = np.empty([1, run.time_slice, 2, 2])
+        for ix in range(2):
+            for iy in range(2):
+                run.time_corr[0,:,ix,iy] = 1 - (run.dt - t_peak[ix,iy])**2
+        max_index, peak_times, peaks = run.time_corr_peaks(0)
+        assert np.allclose(run.dt[max_index], t_peak_grid)
+        assert np.allclose(peak_times, t_peak)
+        assert np.allclose(peaks, 1)
+
+    def test_exp_fit_batch(self, run):
+        t = np.array([[1, 2, 3, 4, 5], [2, 3, 5, 6, 8]])*1e-6
+        noise = np.array([0.01, -0.02, 0.015, 0, -0.01])
+        peaks = np.exp(-t/np.array([[3e-6], [6e-6]])) + noise
+        tau_c, tau_c_err = fit.exp_fit_batch(t, peaks, 1e-5)
+        for i in range(2):
+            gmod_decay = lm.Model(fit.decaying_exp)
+            params_t = lm.Parameters()
+            params_t.add('tau_c', value=1e-5)
+            fit_t = gmod_decay.fit(peaks[i], params_t, t=t[i])
+            assert np.isclose(tau_c[i], fit_t.best_values['tau_c'])
+            assert np.isclose(tau_c_err[i], np.sqrt(fit_t.covar[0,0]),
+                              rtol=1e-3)
+
+    def test_exp_fit_batch_noisy(self, run):
+        np.random.seed(0)
+        t = np.tile(np.arange(1, 6)*1e-6, (200, 1))
+        peaks = np.exp(-t/4e-6) + 0.3*np.random.randn(200, 5)
+        # Non-monotone and increasing peaks
+        peaks[0] = [0.2, 0.9, -0.1, 0.5, 0.3]
+        peaks[1] = [0.1, 0.2, 0.4, 0.8, 1.6]
+        tau_c, tau_c_err = fit.exp_fit_batch(t, peaks, 1e-5)
+        tau_log, tau_log_err = fit.exp_fit_batch(t, peaks, 1e-5, n_iter=0)
+
+        assert np.all(np.isfinite(tau_c)) and np.all(tau_c > 0)
+        assert np.isclose(tau_log[1], 1e-5)
+        cost = fit.exp_fit_cost(t, peaks, 1/tau_c)
+        assert np.all(cost <= fit.exp_fit_cost(t, peaks, 1/tau_log))
+        for i in range(200):
+            gmod_decay = lm.Model(fit.decaying_exp)
+            params_t = lm.Parameters()
+            params_t.add('tau_c', value=tau_log[i], min=0)
+            fit_t = gmod_decay.fit(peaks[i], params_t, t=t[i])
+            assert cost[i] <= np.sum(fit_t.residual**2)*(1 + 1e-6)
+
     def test_field_normalize_time(self, run):
         run.field_normalize_time()
         assert run.field_real_space_norm.shape == (run.nt, run.nx, run.ny)
 
+        run.field_real_space = np.random.randn(run.nt, run.nx, run.ny)
+        run.field_normalize_time()
+        for it in range(run.nt_slices):
+            window = run.field_real_space_norm[it*run.time_slice:
+                                               (it+1)*run.time_slice]
+            assert np.allclose(np.mean(window, axis=(0,2)), 0)
+            assert np.allclose(np.std(window, axis=(0,2)), 1)
+
     def test_time_norm_mask(self, run):
-        run.time_corr = np.ones([5, 9, 5, 5])
-        run.time_norm_mask(0)
-        assert np.abs(run.time_corr[0,4,0,2] - 1./45.) < 1e-5
+        run.time_slice = 9
+        run.ny = 5
+        mask = run.time_norm_mask()
+        assert np.abs(1./mask[4,2] - 1./45.) < 1e-5
+        assert run.time_norm_mask() is mask
+
+    def test_calculate_time_corr(self, run):
+        run.field_real_space_norm = np.random.randn(run.nt, run.nx, run.ny)
+        run.time_corr_full = True
+        run.time_corr = np.empty([run.nt_slices, run.time_slice, run.nx,
+                                  run.ny])
+        run.calculate_time_corr(1)
+        window = run.field_real_space_norm[run.time_slice:2*run.time_slice]
+        mask = run.time_norm_mask()
+        for ix in range(run.nx):
+            corr = sig.fftconvolve(window[:,ix,:], window[::-1,ix,::-1],
+                                   'same')/mask
+            assert np.allclose(run.time_corr[1,:,ix,:], corr)
+
+        full_corr = run.time_corr
+        run.time_corr_full = False
+        run.npeaks_fit = 2
+        lags = run.time_corr_lags()
+        assert (lags == [int(run.ny/2), int(run.ny/2)+1]).all()
+        run.time_corr = np.empty([run.nt_slices, run.time_slice, run.nx, 2])
+        run.calculate_time_corr(1)
+        assert np.allclose(run.time_corr[1], full_corr[1][:,:,lags])
+
+        run.time_corr_method = 'binned'
+        run.t = 2e-6*np.arange(run.nt)
+        run.calculate_time_corr(1)
+        assert np.allclose(run.time_corr[1], full_corr[1][:,:,lags])
 
     def test_par_analysis(self, run):
         run.field_real_space = np.random.randint(0,10,size=[51,5,5,9])
@@ -310,6 +854,28 @@ class TestClass(object):
         assert ('par_fit_it_0.pdf' in
                 os.listdir('test/test_run/v/id_1/analysis/parallel/corr_fns'))
 
+    def test_par_window_stats(self, run):
+        np.random.seed(0)
+        field = np.random.randn(51, 5, 5, 9)
+        run.field_real_space = field.copy()
+        run.ntheta = 9
+        run.nt_slices = 5
+        run.calculate_l_par()
+        run.par_stream = False
+        run.calculate_par_corr()
+        assert np.array_equal(run.field_real_space, field)
+        corr_fn = run.par_corr[run.time_slice:2*run.time_slice]
+        corr_mean, corr_std = run.par_window_stats(1)
+        assert np.allclose(corr_mean, np.mean(corr_fn, axis=(0,1,2)))
+        assert np.allclose(corr_std, np.std(corr_fn, axis=(0,1,2)),
+                           atol=1e-12)
+
+        run.par_stream = True
+        stream_mean, stream_std = run.par_window_stats(1)
+        assert run.par_corr.shape == (run.time_slice, 5, 5, 9)
+        assert np.allclose(stream_mean, corr_mean)
+        assert np.allclose(stream_std, corr_std)
+
     def test_calculate_l_par(self, run):
         run.calculate_l_par()
         assert run.l_par.shape[0] == len(run.theta)
@@ -323,6 +889,15 @@ class TestClass(object):
                 np.abs(run.l_par[-1]/(run.ntheta-1))) < 1e-5
         assert run.par_corr.shape == (51,5,5,9)
 
+    def test_par_interp_matrix(self, run):
+        run.l_par = np.cumsum([0, 1, 0.5, 2, 1, 0.3])
+        l_par_reg = np.linspace(0, run.l_par[-1], 6)
+        interp_matrix = run.par_interp_matrix(l_par_reg)
+        assert interp_matrix.nnz <= 2*len(l_par_reg)
+        f = np.random.randn(4, 6)
+        assert np.allclose(interp_matrix.dot(f.T).T,
+                           interp.interp1d(run.l_par, f)(l_par_reg))
+
     def test_write_field(self, run):
         run.write_field()
         assert ('ntot_t.cdf' in os.listdir('test/test_run/v/id_1/analysis/write_field'))
@@ -333,6 +908,54 @@ class TestClass(object):
         run.write_field_full()
         assert ('ntot_t.cdf' in os.listdir('test/test_run/v/id_1/analysis/write_field_full'))
 
+    def test_write_field_options(self, run):
+        run.field_real_space = np.random.randn(*run.field_real_space.shape)
+        run.write_field()
+        nc_file = Dataset('test/test_run/v/id_1/analysis/write_field/ntot_t.cdf')
+        field = nc_file.variables['ntot'][:]
+        nc_file.close()
+
+        run.write_field_chunks = 'series'
+        run.write_field_zlib = True
+        run.write_field_precision = 'single'
+        run.max_chunk_mem = 1e-3
+        run.write_field()
+        nc_file = Dataset('test/test_run/v/id_1/analysis/write_field/ntot_t.cdf')
+        nc_field = nc_file.variables['ntot']
+        assert nc_field.dtype == np.float32
+        assert nc_field.chunking() == [run.nt, 1, 1]
+        assert nc_field.filters()['zlib']
+        assert np.allclose(nc_field[:], field, rtol=1e-6)
+        nc_file.close()
+
+    def test_write_field_interp_x(self, run):
+        np.random.seed(0)
+        run.write_field_interp_x = True
+        run.x = np.linspace(0, 0.1, run.nx)
+        x_nc = np.linspace(0, 0.1, int(np.ceil(run.x[1]/0.005))*run.nx)
+        assert len(x_nc) > run.nx
+
+        run.field_real_space = np.random.randn(*run.field_real_space.shape)
+        field_ref = interp.interp1d(run.x, run.field_real_space,
+                                    axis=1)(x_nc)
+        for chunks in ['frame', 'series']:
+            run.write_field_chunks = chunks
+            run.max_chunk_mem = 1e-3
+            run.write_field()
+            nc_file = Dataset('test/test_run/v/id_1/analysis/write_field/ntot_t.cdf')
+            assert np.allclose(nc_file.variables['x'][:], x_nc - x_nc[-1]/2)
+            assert np.allclose(nc_file.variables['ntot'][:], field_ref)
+            nc_file.close()
+
+        run.field_real_space = np.random.randn(run.nt, run.nx, 5, 9)
+        run.ntheta = 9
+        field_ref = interp.interp1d(run.x, run.field_real_space,
+                                    axis=1)(x_nc)
+        run.write_field_full()
+        nc_file = Dataset('test/test_run/v/id_1/analysis/write_field_full/ntot_t.cdf')
+        assert np.allclose(nc_file.variables['ntot'][:], field_ref)
+        nc_file.close()
+
     def test_write_field_lab_frame(self, run):
         run.lab_frame = True
         run.write_field()
@@ -0,0 +1,108 @@
+# Standard
+import os
+import json
+import warnings
+
+# Third Party
+import numpy as np
+
+# Local
+import gs2_correlation.synthetic as synthetic
+from gs2_correlation.simulation import Simulation
+
+def line_corr(corr):
+    """
+    Correlation function measured after subtracting the mean of each line,
+    with corr given at all periodic separations of the line.
+    """
+    m = np.mean(corr)
+    return (corr - m)/(1 - m)
+
+class TestClass(object):
+
+    def setup_class(self):
+        self.info = synthetic.write_run('test/test_synthetic', nt=150,
+                                        nkx=33, nky=17, ntheta=33, jtwist=10,
+                                        l_par=2.0)
+
+    def teardown_class(self):
+        os.system('rm -rf test/test_synthetic')
+
+    def simulation(self, analysis):
+        synthetic.write_config('test/test_synthetic/config.ini',
+                               'test/test_synthetic', self.info, analysis)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            return Simulation('test/test_synthetic/config.ini')
+
+    def test_write_run(self):
+        for ext in ['.out.nc', '.g', '.in']:
+            assert os.path.exists('test/test_synthetic/synthetic' + ext)
+        assert (json.load(open('test/test_synthetic/synthetic.json')) ==
+                json.loads(json.dumps(self.info)))
+
+        run = self.simulation('par')
+        assert run.field_real_space.shape == (150, 33, 31, 33)
+        assert run.n0 == 10
+        assert np.isclose(run.x[1]*run.nkx, self.info['x_box'])
+        assert np.isclose(run.y[1]*2*(run.nky - 1), self.info['y_box'])
+        assert np.allclose(run.t, self.info['t'])
+        assert run.jtwist == 10
+        run.calculate_l_par()
+        assert np.isclose(run.l_par[-1], self.info['l_par_max'])
+
+    def test_perp_corr(self):
+        run = self.simulation('perp')
+        run.field_normalize_perp()
+        run.calculate_perp_corr()
+        stats = [run.perp_window_stats(it) for it in range(run.nt_slices)]
+        corr_x = np.mean([s[0] for s in stats], axis=0)
+        corr_y = np.mean([s[2] for s in stats], axis=0)
+
+        # Periodic separations of the full box, before field_odd_pts
+        dx = np.fft.fftfreq(33, 1./33)*run.x[1]
+        dy = np.fft.fftfreq(32, 1./32)*run.y[1]
+        fit_x = line_corr(np.exp(-(dx/self.info['lx'])**2))
+        fit_y = line_corr(np.exp(-(dy/self.info['ly'])**2) *
+                          np.cos(self.info['ky']*dy))
+
+        mid_x = int(run.nx/2)
+        mid_y = int(run.ny/2)
+        assert np.allclose(corr_x[mid_x:mid_x+5], fit_x[:5], atol=0.1)
+        assert np.allclose(corr_y[mid_y:mid_y+5], fit_y[:5], atol=0.1)
+
+    def test_time_corr(self):
+        run = self.simulation('time')
+        # Peaks further than ~ly/2 are ambiguous since ky = 2 pi/ly
+        run.npeaks_fit = 3
+        run.time_corr = np.empty([run.nt_slices, run.time_slice, run.nx,
+                                  len(run.time_corr_lags())])
+        run.field_normalize_time()
+        peak_times = []
+        peaks = []
+        for it in range(run.nt_slices):
+            run.calculate_time_corr(it)
+            run.dt = run.time_window_dt(it)
+            max_index, t_peak, peak = run.time_corr_peaks(it)
+            peak_times.append(np.mean(t_peak, axis=0))
+            peaks.append(np.mean(peak, axis=0))
+        peak_times = np.mean(peak_times, axis=0)
+        peaks = np.mean(peaks, axis=0)
+
+        assert np.allclose(peak_times, np.arange(run.npeaks_fit)*run.y[1]/
+                           self.info['v_y'], atol=0.5*(run.t[1] - run.t[0]))
+        assert np.allclose(peaks, np.exp(-peak_times/self.info['tau_c']),
+                           atol=0.05)
+
+    def test_par_corr(self):
+        run = self.simulation('par')
+        run.calculate_l_par()
+        run.calculate_par_corr()
+        corr, corr_std = run.par_window_stats(0)
+
+        mid = int(run.ntheta/2)
+        dl = run.dl_par[mid:]
+        fit = np.exp(-(dl/self.info['l_par'])**2)
+        m = np.sqrt(np.pi)*self.info['l_par']/self.info['l_par_max']
+        assert np.allclose(corr[mid:mid+4], ((fit - m)/(1 - m))[:4],
+                           atol=0.1)